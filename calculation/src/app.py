@@ -1,54 +1,61 @@
 #!/usr/bin/env python3
 import json
 import traceback
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from urllib.parse import urlparse
-import boto3
 import os
 import shutil
+import signal
 import sys
+import threading
+import time
 from pathlib import Path
 import tempfile
 import uuid
 
-import requests
-
 from pynico_eros_montin import pynico as pn
 
+import chunkstore
+import clients
+import fanout
+import history
+import liveupload
+import planner
+import preflight
+import previews
+import serialization
+from jobqueue import Heartbeat, open_queue
+from archive import directory_size, zip_directory
+from artifacts import SPECS as ARTIFACT_SPECS, ArtifactCache, harvest_policy
+from inputcache import InputCache, object_identity
+from progress import Monitor
+from resources import memory_limit, peak_rss, reset_peak_rss
+from resultcache import DEFAULT_WAIT as DEFAULT_RESULT_WAIT, open_result_cache, result_key
+from runner import ComputationError, plan_parallelism, run_snr, snr_args
+from tracing import Tracer
+from workspace import JobWorkspace
+from transfer import RangeDownloader, TransferCancelled, probe_url, s3_transfer_config
+from upload import (
+    PresignedMultipartTarget,
+    PresignedPutTarget,
+    S3MultipartTarget,
+    StreamingUpload,
+)
+
 logger = None
+_input_cache = None
+_artifact_cache = None
 
 
 class PrintingLogger(pn.Log):
     def write(self, message, type=None, settings=None):
-        print(message)
+        print(serialization.preview(str(message)))
         return super().append(str(message), type, settings)
 
 
-def sanitize_for_json(data):
-    """Recursively sanitize data to make it JSON-serializable."""
-    if isinstance(data, dict):
-        return {k: sanitize_for_json(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_for_json(v) for v in data]
-    elif isinstance(data, (int, float, str, bool, type(None))):
-        return data
-    else:
-        return str(data)
-
-
-def write_json_file(file_path, data):
-    """Sanitize `data` and write it as JSON to `file_path`."""
-    try:
-        sanitized_data = sanitize_for_json(data)
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(sanitized_data, f, indent=4)
-        print(f"JSON data successfully written to {file_path}")
-    except Exception as e:
-        print(f"Failed to write JSON data to file: {e}")
-
-
-def pick_random_path(suffix):
-    """Create a random temporary file path."""
-    temp_dir = Path(tempfile.gettempdir())
+def pick_random_path(suffix, directory=None):
+    """Create a random temporary file path (under `directory` if given)."""
+    temp_dir = Path(directory or tempfile.gettempdir())
     random_name = f"{uuid.uuid4().hex}{suffix}"
     return temp_dir / random_name
 
@@ -59,37 +66,232 @@ def create_random_temp_dir():
     return directory
 
 
-def download_from_s3(file_info, s3=None, pt="/tmp"):
+def get_input_cache():
+    """Return the container-wide input cache, or None if disabled via MROINPUTCACHE."""
+    global _input_cache
+    if os.getenv("MROINPUTCACHE", "true").lower() not in ("true", "1", "yes"):
+        return None
+    if _input_cache is None:
+        try:
+            _input_cache = InputCache()
+        except OSError as e:
+            print(f"input cache unavailable: {e}")
+            return None
+    return _input_cache
+
+
+def get_artifact_cache():
+    """Return the container-wide calibration artifact cache, or None unless enabled via MROARTIFACTCACHE."""
+    global _artifact_cache
+    if os.getenv("MROARTIFACTCACHE", "false").lower() not in ("true", "1", "yes"):
+        return None
+    if _artifact_cache is None:
+        try:
+            _artifact_cache = ArtifactCache()
+        except OSError as e:
+            print(f"artifact cache unavailable: {e}")
+            return None
+    return _artifact_cache
+
+
+def download_from_s3(file_info, s3=None, pt=None, cancel_event=None, etag=None):
     """
     If file_info == {"bucket": ..., "key": ..., "filename": ...}, download that S3 object
-    into a random file under `pt`, then set file_info["filename"] to the local path and
-    file_info["type"] = "local".
+    into a random file under `pt` (default: the temp dir), then set file_info["filename"]
+    to the local path and file_info["type"] = "local".
+
+    If `cancel_event` is set while the transfer is running, the partial file is removed
+    and TransferCancelled is raised. Returns the number of bytes written.
+
+    When the input cache is enabled, a cached copy of the same object is used
+    directly (no transfer, returns 0) and fresh downloads are added to it.
     """
     filename = file_info["filename"]
+    suffix = Path(filename).suffix
+    cache = get_input_cache()
+    identity = None
+    if cache is not None:
+        if s3 is None and "presigned_url" not in file_info:
+            s3 = clients.s3_resource()
+        identity = object_identity(file_info, s3, etag)
+        cached = cache.lookup(identity, suffix) if identity else None
+        if cached is not None:
+            logger.write(f"input cache hit for {filename}")
+            file_info["filename"] = str(cached)
+            file_info["type"] = "local"
+            return 0
     # Create random local path
-    local_path = pick_random_path(suffix=Path(filename).suffix)
-
-    if "presigned_url" in file_info:
-        logger.write("Downloading from presigned URL " + file_info["key"])
-        response = requests.get(file_info["presigned_url"])
-        if response.status_code == 200:
-            # Write data to the file in chunks
-            with local_path.open("wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):  # 8 KB chunks
-                    file.write(chunk)
+    local_path = pick_random_path(suffix=suffix, directory=pt)
+    transferred = 0
+
+    def _check_cancel():
+        if cancel_event is not None and cancel_event.is_set():
+            raise TransferCancelled(f"download of {filename} cancelled")
+
+    try:
+        if "presigned_url" in file_info:
+            logger.write("Downloading from presigned URL " + file_info["key"])
+            downloader = RangeDownloader(session=clients.http_session(), cancel_event=cancel_event)
+            transferred = downloader.download(file_info["presigned_url"], str(local_path))
         else:
-            raise Exception(
-                f"Failed to download file. HTTP status code: {response.status_code}"
+            key = file_info["key"]
+            bucket = file_info["bucket"]
+            if s3 is None:
+                s3 = clients.s3_resource()
+
+            def _progress(nbytes):
+                nonlocal transferred
+                transferred += nbytes
+                # raising from the callback aborts the managed transfer
+                _check_cancel()
+
+            # the low-level client is thread-safe, resources are not
+            s3.meta.client.download_file(
+                bucket, key, str(local_path), Callback=_progress, Config=s3_transfer_config()
             )
-    else:
-        key = file_info["key"]
-        bucket = file_info["bucket"]
-        if s3 is None:
-            s3 = boto3.resource("s3")
-
-        s3.Bucket(bucket).download_file(key, str(local_path))
+    except BaseException:
+        local_path.unlink(missing_ok=True)
+        raise
+    if identity is not None:
+        local_path = cache.insert(identity, local_path, suffix)
     file_info["filename"] = str(local_path)
     file_info["type"] = "local"
+    return transferred
+
+
+def collect_inputs(task_info):
+    """
+    Return {name: options} for every S3 input referenced by the task: the
+    reconstructor noise/signal entries plus anything listed in task["files"].
+    """
+    recon_opts = task_info["options"]["reconstructor"]["options"]
+    names = ["noise", "signal"]
+    for entry in task_info.get("files") or []:
+        name = entry.get("name") if isinstance(entry, dict) else entry
+        if isinstance(name, str) and name not in names:
+            names.append(name)
+
+    inputs = {}
+    for name in names:
+        entry = recon_opts.get(name)
+        if not isinstance(entry, dict):
+            continue
+        opts = entry.get("options")
+        if isinstance(opts, dict) and opts.get("type") == "s3":
+            inputs[name] = opts
+    return inputs
+
+
+def probe_inputs(inputs, s3=None):
+    """
+    HEAD every input in parallel (no data transfer) and return
+    {name: {"size": bytes or None, "etag": str or None}}. An input that cannot
+    be HEADed gets {"size": None, "etag": None, "error": message} instead.
+    """
+    def _probe(file_info):
+        try:
+            if "presigned_url" in file_info:
+                size, etag = probe_url(file_info["presigned_url"], clients.http_session())
+                return {"size": size, "etag": etag}
+            head = (s3 or clients.s3_resource()).meta.client.head_object(
+                Bucket=file_info["bucket"], Key=file_info["key"]
+            )
+        except Exception as e:
+            return {"size": None, "etag": None, "error": str(e)}
+        return {"size": head.get("ContentLength"), "etag": head.get("ETag")}
+
+    if not inputs:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(inputs), thread_name_prefix="probe") as pool:
+        futures = {name: pool.submit(_probe, info) for name, info in inputs.items()}
+    return {name: f.result() for name, f in futures.items()}
+
+
+def reserve_input_space(inputs, probes, workspace):
+    """
+    Make sure the inputs that are not already cached fit on disk, evicting
+    unused cache entries if that is what it takes; raises WorkspaceFullError.
+    """
+    cache = get_input_cache()
+    required = 0
+    for name, file_info in inputs.items():
+        probe = probes.get(name) or {}
+        if cache is not None:
+            identity = object_identity(file_info, None, probe.get("etag"))
+            if identity and cache.contains(identity, Path(file_info["filename"]).suffix):
+                continue
+        required += probe.get("size") or 0
+    available = workspace.available()
+    if required > available and cache is not None:
+        freed = cache.free_up(required - available)
+        logger.write(f"evicted {freed / 1e6:.1f} MB from the input cache to make room")
+    workspace.check_budget(required, "input download")
+    logger.write(f"reserved {required / 1e6:.1f} MB of scratch space for inputs")
+    return required
+
+
+def fetch_inputs(inputs, s3=None, max_workers=None, workspace=None, probes=None):
+    """
+    Download all `inputs` ({name: file_info}) in parallel, into `workspace`
+    if given. `probes` from probe_inputs spare the cache a second HEAD.
+
+    Every transfer starts at once; as soon as one fails the others are cancelled
+    and the first error is re-raised. Logs per-file throughput and returns
+    {name: bytes}.
+    """
+    if not inputs:
+        return {}
+    cache = get_input_cache()
+    if cache is not None:
+        cache.reset_stats()
+    max_workers = max_workers or int(os.getenv("MRODOWNLOADWORKERS", "0")) or len(inputs)
+    cancel = threading.Event()
+
+    probes = probes or {}
+    directory = workspace.root if workspace is not None else None
+
+    def _fetch(name, file_info):
+        start = time.monotonic()
+        etag = (probes.get(name) or {}).get("etag")
+        nbytes = download_from_s3(file_info, s3, directory, cancel_event=cancel, etag=etag)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        if nbytes or file_info.get("type") != "local" or cache is None:
+            logger.write(
+                f"{name} file downloaded: {nbytes / 1e6:.1f} MB in {elapsed:.2f}s "
+                f"({nbytes / 1e6 / elapsed:.1f} MB/s)"
+            )
+        else:
+            logger.write(f"{name} file served from input cache")
+        return nbytes
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as pool:
+        futures = {pool.submit(_fetch, name, info): name for name, info in inputs.items()}
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [f for f in done if f.exception() is not None]
+        if failed:
+            cancel.set()
+            for f in pending:
+                f.cancel()
+            wait(pending)
+            name = futures[failed[0]]
+            logger.write(f"download of {name} failed, cancelled remaining transfers")
+            raise failed[0].exception()
+
+    if cache is not None:
+        st = cache.stats()
+        logger.write(
+            f"input cache: hits={st['hits']} misses={st['misses']} "
+            f"evictions={st['evictions']} size={st['bytes'] / 1e6:.1f}/{st['max_bytes'] / 1e6:.1f} MB"
+        )
+    sizes = {futures[f]: f.result() for f in futures}
+    elapsed = max(time.monotonic() - start, 1e-6)
+    total = sum(sizes.values())
+    logger.write(
+        f"fetched {len(sizes)} input(s): {total / 1e6:.1f} MB in {elapsed:.2f}s "
+        f"({total / 1e6 / elapsed:.1f} MB/s aggregate)"
+    )
+    return sizes
 
 
 def parse_s3_url(presigned_url):
@@ -114,6 +316,46 @@ def parse_s3_url(presigned_url):
     return bucket_name, object_key
 
 
+def result_target(info_json, s3, result_bucket, user_id):
+    """
+    Upload target for the job's result zip and where the zip ends up:
+    (target, bucket, key, presigned_url or None).
+    """
+    if presigned_parts := info_json.get("presigned_upload_parts"):
+        # caller-created multipart upload with one presigned URL per part
+        logger.write(f"Uploading to {len(presigned_parts['part_urls'])} presigned part urls")
+        target = PresignedMultipartTarget.from_event(presigned_parts, clients.http_session())
+        presigned_url = presigned_parts["complete_url"]
+        bucket, key = parse_s3_url(presigned_url)
+        return target, bucket, key, presigned_url
+    if presigned_url := info_json.get("presigned_upload_url"):
+        logger.write("Uploading to presigned url")
+        target = PresignedPutTarget(presigned_url, clients.http_session())
+        bucket, key = parse_s3_url(presigned_url)
+        return target, bucket, key, presigned_url
+    # 13) Upload zip to the "results" bucket
+    key = f"MR Optimum/{user_id}/{uuid.uuid4().hex}.zip"
+    return S3MultipartTarget(s3.meta.client, result_bucket, key), result_bucket, key, None
+
+
+def result_wait_budget(context):
+    """Seconds a job may wait for an identical job in flight (MRORESULTWAIT, bounded by the Lambda deadline)."""
+    wait = float(os.getenv("MRORESULTWAIT", str(DEFAULT_RESULT_WAIT)))
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        # keep enough time to compute ourselves if the other job fails
+        wait = min(wait, context.get_remaining_time_in_millis() / 1000 / 2)
+    return wait
+
+
+def emit_metrics(tracer, status):
+    """Print the job's stage timings as CloudWatch EMF lines unless MROEMF is off."""
+    if os.getenv("MROEMF", "true").lower() in ("true", "1", "yes"):
+        try:
+            tracer.emit_emf(status=status)
+        except Exception as e:
+            print(f"could not emit metrics: {e}")
+
+
 def do_process(event, context=None, s3=None):
     global logger
     """
@@ -133,53 +375,47 @@ def do_process(event, context=None, s3=None):
 
     # Initialize logging
     logger = PrintingLogger("mroptimum job", {"event": event, "context": context or {}})
+    # Per-stage wall time / bytes, written to info.json and emitted as EMF metrics
+    tracer = Tracer()
+    info_json = token = pipelineid = user_id = None
+    task_info = probes = snr_run = memory_plan = live = None
+    result_cache = dedupe_key = None
+    status = "failed"
+    # peak RSS is per process; start counting again for this job
+    reset_peak_rss()
+    # Every temp artifact of this job lives here and is deleted when the job ends
+    workspace = JobWorkspace(log=logger.write)
+    logger.write(f"job workspace {workspace.root}")
+
+    # inputs pinned by the previous job on this warm container may be evicted again
+    input_cache = get_input_cache()
+    if input_cache is not None:
+        input_cache.release()
 
     try:
-        # Prepare S3 resource
+        # Prepare S3 resource (shared by every job on this warm container)
         if s3 is None:
-            s3 = boto3.resource("s3")
+            s3 = clients.s3_resource()
 
-        # Log deployed image info (Lambda ImageUri or ECS/Fargate metadata) for debugging
+        # Log deployed image info (Lambda ImageUri or ECS/Fargate metadata) for debugging;
+        # discovered once per container in the background, so this is normally free
         def _log_deployed_image_info():
-            try:
-                # 1) If running as Lambda, query get_function for ImageUri (requires lambda:GetFunction)
-                fn = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
-                if fn:
-                    try:
-                        client = boto3.client("lambda")
-                        resp = client.get_function(FunctionName=fn)
-                        image_uri = resp.get("Code", {}).get("ImageUri")
-                        if image_uri:
-                            logger.write(f"Lambda image URI: {image_uri}")
-                        else:
-                            logger.write("Lambda is running but Code.ImageUri not present in function configuration")
-                    except Exception as e:
-                        logger.write(f"Could not get Lambda function config: {e}")
-
-                # 2) If running in ECS/Fargate, query metadata endpoint
-                meta_uri = os.environ.get("ECS_CONTAINER_METADATA_URI_V4") or os.environ.get("ECS_CONTAINER_METADATA_URI")
-                if meta_uri:
-                    try:
-                        # metadata endpoint returns JSON; attempt to extract container image
-                        r = requests.get(meta_uri, timeout=5)
-                        if r.status_code == 200:
-                            md = r.json()
-                            # v4/v3 metadata include Containers list or Image
-                            containers = md.get("Containers") or md.get("Container") or [md]
-                            for c in containers:
-                                img = c.get("Image") or c.get("ImageID")
-                                if img:
-                                    logger.write(f"ECS/Fargate container image: {img}")
-                        else:
-                            logger.write(f"ECS metadata request returned status {r.status_code}")
-                    except Exception as e:
-                        logger.write(f"Could not read ECS metadata endpoint: {e}")
-            except Exception as e:
-                logger.write(f"Error while detecting deployed image: {e}")
+            identity = clients.deployment_identity()
+            if identity is None:
+                logger.write("deployed image info not available yet")
+                return
+            for err in identity["errors"]:
+                logger.write(err)
+            if identity["platform"] == "lambda":
+                if identity["image_uri"]:
+                    logger.write(f"Lambda image URI: {identity['image_uri']}")
+                else:
+                    logger.write("Lambda is running but Code.ImageUri not present in function configuration")
+            for img in identity["images"]:
+                logger.write(f"ECS/Fargate container image: {img}")
 
         _log_deployed_image_info()
 
-
         # s3 implementation
         if "Records" in event and event["Records"] and "s3" in event["Records"][0]:
             # ----- S3 path: extract bucket/key, download JSON -----
@@ -189,8 +425,10 @@ def do_process(event, context=None, s3=None):
             logger.write(f"file_key {file_key}")
 
             # Download the JSON payload to /tmp/<random>.json
-            fj = pick_random_path(suffix=".json")
-            s3.Bucket(bucket_name).download_file(file_key, str(fj))
+            fj = workspace.path(suffix=".json")
+            with tracer.span("event_fetch") as span:
+                s3.Bucket(bucket_name).download_file(file_key, str(fj))
+                span.add_bytes(fj.stat().st_size)
             logger.write(f"file downloaded to {fj}")
 
             # Read that JSON from local
@@ -226,16 +464,14 @@ def do_process(event, context=None, s3=None):
                 logger.write("Notice: using task-level 'output' as top-level 'output' was missing or empty")
         logger.write(f"pipelineid {pipelineid}")
         logger.write(f"token {token}")
+        # 2b) Reject an invalid job now, before anything is downloaded
+        if preflight.enabled():
+            with tracer.span("preflight"):
+                problems = preflight.validate(info_json.get("task"), info_json_output, log=logger.write)
+            if problems:
+                raise preflight.PreflightError(problems)
         # Determine flags for coilsensitivity, matlab, gfactor
-        savecoils = "--no-coilsens"
-        savematlab = "--no-matlab"
-        savegfactor = "--no-gfactor"
-        if info_json_output.get("coilsensitivity"):
-            savecoils = "--coilsens"
-        if info_json_output.get("matlab"):
-            savematlab = "--matlab"
-        if info_json_output.get("gfactor"):
-            savegfactor = "--gfactor"
+        savematlab, savecoils, savegfactor = preflight.output_flags(info_json_output)
         logger.write(f"savecoils {savecoils}")
         logger.write(f"savematlab {savematlab}")
         logger.write(f"savegfactor {savegfactor}")
@@ -246,64 +482,149 @@ def do_process(event, context=None, s3=None):
         SIGNAL_AVAILABLE = False
         MULTIRAID = False
         calculation_name=task_info.get("name", "N/A")
+        tracer.set_dimensions(
+            Task=calculation_name,
+            Reconstructor=task_info.get("options", {}).get("reconstructor", {}).get("name"),
+        )
+        tracer.properties["pipelineid"] = pipelineid
 
-        # 6) If noise or signal == S3 type, download locally
+        # 6) Download every S3-typed input (noise, signal, extra files) in parallel
         recon_opts = task_info["options"]["reconstructor"]["options"]
-        if "noise" in recon_opts:
-            noise_opts = recon_opts["noise"]["options"]
-            if noise_opts.get("type") == "s3":
-                download_from_s3(noise_opts, s3)
-                logger.write("noise file downloaded")
-                NOISE_AVAILABLE = True
-        else:
+        inputs = collect_inputs(task_info)
+        if "noise" not in recon_opts:
             # If "noise" is not present, we skip this step
             logger.write("no noise options found, skipping download")
-
-        if "signal" in recon_opts:
-            signal_opts = recon_opts["signal"]["options"]
-            if signal_opts.get("type") == "s3":
-                download_from_s3(signal_opts, s3)
-                logger.write("signal file downloaded")
-                SIGNAL_AVAILABLE = True
-                if signal_opts.get("vendor", "").lower() == "siemens":
-                    # If vendor is mroptimum, we can use the signal options directly
-                    logger.write("signal vendor is mroptimum, using options directly")
-                    MULTIRAID = signal_opts.get("multiraid", False)
-        else:
+        if "signal" not in recon_opts:
             # If "signal" is not present, we skip this step
             logger.write("no signal options found, skipping download")
+        with tracer.span("input_probe", files=len(inputs)):
+            probes = probe_inputs(inputs, s3)
+        if preflight.enabled():
+            problems = preflight.check_inputs(inputs, probes)
+            if problems:
+                raise preflight.PreflightError(problems)
+
+        # An identical job (same options, same input objects, same outputs) may already
+        # have been computed, or be computing right now: reuse its zip instead
+        try:
+            result_cache = open_result_cache(s3.meta.client, log=logger.write)
+        except Exception as e:
+            # a misconfigured MRORESULTCACHE turns deduplication off, it does not fail the job
+            logger.write(f"result cache disabled: {e}")
+            result_cache = None
+        # MROLIVEUPLOAD=only delivers per-file objects, not a zip the index could point at
+        live_only = liveupload.mode() == "only" and not (
+            info_json.get("presigned_upload_parts") or info_json.get("presigned_upload_url")
+        )
+        if result_cache is not None and live_only:
+            logger.write("result deduplication off: MROLIVEUPLOAD=only produces no zip to reuse")
+        elif result_cache is not None:
+            dedupe_key = result_key(task_info, info_json_output, inputs, probes, s3, user_id)
+        cached = None
+        if dedupe_key:
+            with tracer.span("result_lookup") as span:
+                try:
+                    cached = result_cache.claim(dedupe_key, wait_seconds=result_wait_budget(context))
+                except Exception as e:
+                    # deduplication is an optimization; never fail the job over it
+                    logger.write(f"result cache unavailable: {e}")
+                    dedupe_key = None
+                span.attrs["hit"] = cached is not None
+            if cached is not None:
+                logger.write(f"identical job already computed: s3://{cached['bucket']}/{cached['key']}")
+                target, result_bucket, key, presigned_url = result_target(info_json, s3, result_bucket, user_id)
+                try:
+                    with tracer.span("result_copy") as span:
+                        span.add_bytes(result_cache.copy_to(cached, target))
+                except Exception as e:
+                    logger.write(f"could not reuse the cached result ({e}), computing instead")
+                else:
+                    logger.write(f"delivered cached result to {presigned_url or f's3://{result_bucket}/{key}'}")
+                    status = "success"
+                    return {
+                        "statusCode": 200,
+                        "body": json.dumps({"results": {"key": key, "bucket": result_bucket}, "cached": True}),
+                    }
+
+        reserve_input_space(inputs, probes, workspace)
+        with tracer.span("input_download", files=len(inputs)) as span:
+            span.add_bytes(sum(fetch_inputs(inputs, s3, workspace=workspace, probes=probes).values()))
+        workspace.sample()
+
+        if "noise" in inputs:
+            NOISE_AVAILABLE = True
+        if "signal" in inputs:
+            signal_opts = inputs["signal"]
+            SIGNAL_AVAILABLE = True
+            if signal_opts.get("vendor", "").lower() == "siemens":
+                # If vendor is mroptimum, we can use the signal options directly
+                logger.write("signal vendor is mroptimum, using options directly")
+                MULTIRAID = signal_opts.get("multiraid", False)
+
+        # 6b) Reuse calibration artifacts (coil sensitivity maps, noise covariance) of earlier jobs on the same data
+        harvests = []
+        artifact_cache = get_artifact_cache()
+        if artifact_cache is not None:
+            artifact_cache.release()
+            policy = harvest_policy()
+            for spec in ARTIFACT_SPECS:
+                artifact_key = artifact_cache.key(spec, task_info, inputs, probes)
+                if artifact_key is None:
+                    continue
+                with tracer.span("artifact_lookup", artifact=spec.name) as span:
+                    hit = artifact_cache.prepare(spec, artifact_key, task_info, workspace)
+                    span.attrs["hit"] = hit
+                if hit:
+                    logger.write(f"reusing cached {spec.name}, skipping its calibration")
+                    continue
+                requested = spec.output_flag in (savematlab, savecoils, savegfactor)
+                if policy == "always" or (policy == "requested" and requested):
+                    # (spec, key, remove the files from OUT because the user did not ask for them)
+                    harvests.append((spec, artifact_key, not requested))
 
         # 7) Write updated T → /tmp/<random>.json for mrotools.snr
         task_info["token"] = token
         task_info["pipelineid"] = pipelineid
 
-        mrotools_input_json_file = pick_random_path(suffix=".json")
+        mrotools_input_json_file = workspace.path(suffix=".json")
         with open(mrotools_input_json_file, "w") as f:
             json.dump(task_info, f)
         logger.write(f"writeJson for mrotools input: {mrotools_input_json_file}")
 
-        # 8) Prepare output folder under /tmp: /tmp/<random>/OUT
-        out_base = create_random_temp_dir()
+        # 8) Prepare output folder in the workspace: <workspace>/<random>/OUT
+        out_base = workspace.mkdir()
         out_dir = out_base / "OUT"
         out_dir.mkdir(parents=True)
         logger.write(f"output dir set to {out_dir}")
 
+        # 8b) Send OUT files to a per-job prefix as soon as mrotools has written them
+        # (MROLIVEUPLOAD); presigned result URLs name a single object, so they get the zip only
+        live_mode = liveupload.mode()
+        if live_mode != "false" and not (
+            info_json.get("presigned_upload_parts") or info_json.get("presigned_upload_url")
+        ):
+            live_prefix = f"MR Optimum/{user_id}/{uuid.uuid4().hex}/"
+            live = liveupload.LiveUpload(out_dir, s3.meta.client, result_bucket, live_prefix, log=logger.write).start()
+            logger.write(f"uploading outputs live to s3://{result_bucket}/{live_prefix}")
+
         # 9) Prepare a logfile path
-        log_path = pick_random_path(suffix=".log")
-
-        # 10) Run the mrotools.snr command
-        BashItObject = pn.BashIt()
-        # In Lambda we do "--no-parallel" because CPU cores are limited;
-        # in Fargate you can remove that flag or change to "--parallel" if desired.
-        # Here we keep it as "--no-parallel" by default, but you can override via ENV if needed.
-        parallel_flag = os.getenv("MROPARALLEL", "false").lower()
-        if parallel_flag in ("true", "1", "yes"):
-            parallel_arg = "--parallel"
-        else:
-            parallel_arg = "--no-parallel"
+        log_path = workspace.path(suffix=".log")
+
+        # 10) Run mrotools.snr (a subprocess by default, in-process with MROENGINE=inprocess)
+        # "--parallel" and the BLAS thread count follow the CPUs and memory actually
+        # granted to the container (cgroup quota); MROPARALLEL=true/false overrides
+        job_memory_mb = ((event.get("platform") or {}).get("prediction") or {}).get("peak_memory_mb")
+        parallelism = plan_parallelism(job_memory_mb)
+        logger.write(
+            f"parallelism: {'--parallel' if parallelism['parallel'] else '--no-parallel'} "
+            f"with {parallelism['threads']} BLAS thread(s) on {parallelism['cpus']} granted CPU(s), "
+            f"{parallelism['memory_mb']} MB free ({parallelism['reason']})"
+        )
+        tracer.properties["parallelism"] = parallelism
+        parallel_arg = "--parallel" if parallelism["parallel"] else "--no-parallel"
 
         # check noise and signal availability
-        print(f"NOISE_AVAILABLE: {NOISE_AVAILABLE}, SIGNAL_AVAILABLE: {SIGNAL_AVAILABLE}, MULTIRAID: {MULTIRAID}")
+        logger.write(f"NOISE_AVAILABLE: {NOISE_AVAILABLE}, SIGNAL_AVAILABLE: {SIGNAL_AVAILABLE}, MULTIRAID: {MULTIRAID}")
         if (NOISE_AVAILABLE or MULTIRAID or calculation_name.lower() == "mr") and SIGNAL_AVAILABLE:
             logger.write("noise and signal available, proceeding with computation")
         else:
@@ -312,66 +633,201 @@ def do_process(event, context=None, s3=None):
                 "Noise or signal not available, cannot proceed with computation"
             )
 
-        cmd = (
-            f"python -m mrotools.snr "
-            f"-j {mrotools_input_json_file} "
-            f"-o {out_dir} "
-            f"{parallel_arg} {savematlab} {savecoils} {savegfactor} "
-            f"--no-verbose "
-            f"-l {log_path}"
-        )
-        BashItObject.setCommand(cmd)
-        logger.write(f"running command: {cmd}")
-        BashItObject.run()
-
-        # 11) Inspect the generated log for errors
-        g = pn.Log()
-        g.appendFullLog(str(log_path))
-        if g.log and g.log[-1].get("what") == "ERROR":
-            # If the final log entry says "ERROR", treat as a computation failure
+        flags = [parallel_arg, savematlab, savecoils, savegfactor]
+        for spec, _, extra in harvests:
+            if extra:
+                # have mrotools write the artifact so it can be cached
+                flags = [spec.output_flag if f == f"--no-{spec.output_flag[2:]}" else f for f in flags]
+
+        # 10a) Estimate the peak memory from the raw data headers: run whole, run single
+        # slices with bounded memory, or refuse now instead of being OOM-killed later
+        if planner.enabled():
+            try:
+                memory_plan = planner.plan(task_info, inputs, info_json_output, parallelism["workers"])
+            except Exception as e:
+                logger.write(f"memory planning skipped: {e}")
+        if memory_plan is not None:
+            logger.write(f"memory plan: {memory_plan['mode']}, {memory_plan['reason']}")
+            tracer.properties["memory_plan"] = {k: memory_plan[k] for k in ("mode", "peak", "budget_mb")}
+            if memory_plan["mode"] == "refuse":
+                raise planner.PlanningError(memory_plan["reason"])
+
+        # Multi-slice jobs can run as groups of slices side by side (MROSLICEFANOUT)
+        n_slices = per_task = None
+        fanout_workers = parallelism["workers"]
+        if memory_plan is not None and memory_plan["mode"] == "sliced":
+            n_slices, per_task, fanout_workers = memory_plan["dims"]["slices"], 1, memory_plan["workers"]
+        elif fanout.enabled():
+            try:
+                n_slices = fanout.plan(task_info, inputs)
+            except Exception as e:
+                logger.write(f"slice fan-out skipped: {e}")
+        with tracer.span("compute") as span:
+            snr_run = None
+            if n_slices:
+                try:
+                    snr_run = fanout.run(
+                        task_info, inputs, n_slices, flags, out_dir, workspace,
+                        workers=fanout_workers, per_task=per_task, log=logger.write,
+                        labels=tracer.dimensions,
+                    )
+                    span.attrs["slices"] = n_slices
+                except fanout.FanoutError as e:
+                    if memory_plan is not None and memory_plan["mode"] == "sliced":
+                        # the whole job does not fit in memory: running it would only get it OOM-killed
+                        raise planner.PlanningError(
+                            f"needs ~{memory_plan['peak']['full_mb']} MB whole but only "
+                            f"{memory_plan['budget_mb']} MB is available, and it cannot run slice by slice: {e}"
+                        ) from e
+                    logger.write(f"slice fan-out failed ({e}), running the job whole")
+                    shutil.rmtree(out_dir)
+                    out_dir.mkdir()
+            if snr_run is None:
+                args = snr_args(mrotools_input_json_file, out_dir, log_path, flags)
+                snr_run = run_snr(
+                    args, log_path, log=logger.write, threads=parallelism["threads"],
+                    monitor=Monitor(log_path, labels=tracer.dimensions),
+                )
+            span.attrs["engine"] = snr_run.engine
+            if snr_run.failed:
+                span.status = "error"
+        logger.write(f"mrotools.snr finished: {snr_run.to_dict()}")
+
+        # 11) Inspect the outcome and the generated log for errors
+        if snr_run.failed:
+            # A raised exception, non-zero exit or a final "ERROR" log entry is a computation failure
             logger.write("ERROR in the computation")
-            logger.appendFullLog(str(log_path))
-            raise Exception("ERROR in the computation")
+            # entries of the mrotools log(s), already read by the runner
+            logger.log.extend(snr_run.log)
+            if snr_run.killed:
+                limit = memory_limit()
+                raise ComputationError(
+                    f"mrotools.snr was killed (SIGKILL), most likely out of memory: peak RSS "
+                    f"{peak_rss(snr_run.peak_rss) / 1e6:.0f} MB, container limit "
+                    + (f"{limit / 1e6:.0f} MB" if limit else "unknown")
+                    + (f", planned ~{memory_plan['peak']['full_mb']} MB" if memory_plan else ""),
+                    snr_run,
+                )
+            if snr_run.aborted:
+                raise ComputationError(f"ERROR in the computation: {snr_run.aborted}", snr_run)
+            raise ComputationError("ERROR in the computation", snr_run)
 
         logger.write("computation completed successfully")
-        logger.appendFullLog(str(log_path))
+        logger.log.extend(snr_run.log)
+
+        for spec, artifact_key, extra in harvests:
+            try:
+                stored = artifact_cache.harvest(spec, artifact_key, out_dir, workspace, strip=extra)
+                if stored:
+                    logger.write(f"cached {spec.name} ({stored} file(s)) for later jobs")
+                else:
+                    logger.write(f"no {spec.name} in the outputs to cache")
+            except Exception as e:
+                logger.write(f"could not cache {spec.name}: {e}")
 
         try:
             print("Fixing up info.json")
             info_json_path = out_dir / "info.json"
-            with open(info_json_path, "r") as f:
-                info_json_data = json.load(f)
+            info_json_data = serialization.load(info_json_path)
             info_json_data["user_id"] = user_id
-            with open(info_json_path, "w") as f:
-                json.dump(info_json_data, f)
+            # the archive/upload stage is still to come, so it is only in the EMF metrics
+            info_json_data["timings"] = tracer.to_dict()
+            headers = info_json_data.get("headers")
+            if isinstance(headers, dict) and "log" in headers:
+                headers["log"] = serialization.cap_log(headers["log"])
+            serialization.dump(info_json_data, info_json_path)
         except:
             traceback.print_exc()
             print("Failed to fix up info.json")
 
-        # 12) Zip the entire OUT folder
-        zip_path = Path(
-            shutil.make_archive(pick_random_path(suffix=""), "zip", str(out_dir))
-        )
-
-        logger.write(f"zipped output to {zip_path}")
+        # 11b) Downsampled previews of the maps, so the viewer's first screen loads from kilobytes
+        preview_manifest = None
+        if previews.enabled():
+            try:
+                with tracer.span("previews") as span:
+                    preview_manifest = previews.write(out_dir)
+                    if preview_manifest:
+                        span.attrs["maps"] = len(preview_manifest["maps"])
+                if preview_manifest:
+                    logger.write(f"wrote previews of {len(preview_manifest['maps'])} map(s)")
+            except Exception as e:
+                logger.write(f"could not write the previews: {e}")
 
-        if presigned_url := info_json.get("presigned_upload_url"):
-            # Upload the zip to the presigned URL
-            logger.write("Uploading to presigned url")
-            result = requests.put(presigned_url, data=open(zip_path, "rb"))
-            result.raise_for_status()
+        # 11c) Optional chunked copy of the maps, readable one slice per byte range
+        if chunkstore.enabled(info_json_output):
+            try:
+                with tracer.span("chunked_output") as span:
+                    manifest = chunkstore.write(out_dir)
+                    if manifest:
+                        span.add_bytes((out_dir / chunkstore.STORE_NAME).stat().st_size)
+                        span.attrs["arrays"] = len(manifest["arrays"])
+                logger.write(
+                    f"wrote {chunkstore.STORE_NAME} with {len(manifest['arrays'])} chunked map(s)"
+                    if manifest else "no maps to write as chunked arrays"
+                )
+            except Exception as e:
+                logger.write(f"could not write the chunked maps: {e}")
+
+        # 12) Stream a zip of the OUT folder straight into the upload (no archive on disk)
+        results = {}
+        if live is not None:
+            # only files new or changed since compute are still to go
+            with tracer.span("live_upload_finish") as span:
+                live_manifest = live.finish()
+                span.add_bytes(live_manifest["bytes"])
+                span.attrs["files"] = len(live_manifest["files"])
+                span.attrs["uploaded_live"] = len(live_manifest["uploaded_live"])
+            logger.write(
+                f"live upload complete: {len(live_manifest['uploaded_live'])} of {len(live_manifest['files'])} "
+                f"file(s) went up during compute, manifest s3://{result_bucket}/{live.manifest_key}"
+            )
+            results.update(prefix=live.prefix, manifest=live.manifest_key)
+        if live is not None and live_mode == "only":
+            key = live.manifest_key
+            logger.write(f"timings {json.dumps(tracer.to_dict())}")
+            status = "success"
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"results": {"key": key, "bucket": result_bucket, **results}}),
+            }
+        target, result_bucket, key, presigned_url = result_target(info_json, s3, result_bucket, user_id)
+        with tracer.span("archive_upload") as span, StreamingUpload.planned(
+            target, directory_size(out_dir)
+        ) as stream:
+            logger.write(
+                f"upload plan: {stream.part_size // (1024 * 1024)} MiB parts, "
+                f"{stream.ring} in flight"
+            )
+            # speed/size trade-off selectable per task: output.compression = fast|balanced|small
+            # previews and the array manifest lead the archive, for readers streaming it
+            zip_stats = zip_directory(
+                out_dir, stream, policy=info_json_output.get("compression"),
+                first=(*previews.leading_entries(preview_manifest), chunkstore.MANIFEST_NAME),
+            )
+            span.add_bytes(zip_stats["bytes_out"])
+            span.attrs["bytes_in"] = zip_stats["bytes_in"]
+        logger.write(
+            f"zipped {zip_stats['entries']} entries with policy {zip_stats['policy']} "
+            f"({zip_stats['deflated']} deflated, {zip_stats['stored']} stored, "
+            f"{zip_stats['bytes_in'] / 1e6:.1f} MB -> {zip_stats['bytes_out'] / 1e6:.1f} MB) while uploading"
+        )
+        if presigned_url:
             logger.write(f"uploaded zip to {presigned_url}")
-            key, result_bucket = parse_s3_url(presigned_url)
         else:
-            # 13) Upload zip to the "results" bucket
-            key = f"MR Optimum/{user_id}/{zip_path.name}"
-            s3.Bucket(result_bucket).upload_file(str(zip_path), key)
             logger.write(f"uploaded results to s3://{result_bucket}/{key}")
 
+        if dedupe_key:
+            try:
+                result_cache.publish(dedupe_key, result_bucket, key, zip_stats["bytes_out"])
+            except Exception as e:
+                logger.write(f"could not index the result for reuse: {e}")
+
         # 14) Return success (Lambda will interpret this as a 200)
+        logger.write(f"timings {json.dumps(tracer.to_dict())}")
+        status = "success"
         return {
             "statusCode": 200,
-            "body": json.dumps({"results": {"key": key, "bucket": result_bucket}}),
+            "body": json.dumps({"results": {"key": key, "bucket": result_bucket, **results}}),
         }
 
     except Exception as error:
@@ -381,15 +837,14 @@ def do_process(event, context=None, s3=None):
         # logger.write("EXCEPTION CAUGHT: " + str(e))
 
         # Prepare an "error" directory under /tmp so we can capture event / options / error.txt / info.json
-        err_base = create_random_temp_dir()
+        err_base = workspace.mkdir()
         error_dir = err_base / "ERROR_DIR"
         error_dir.mkdir(parents=True, exist_ok=True)
 
         # 1) Write event.json
         event_file = error_dir / "event.json"
         try:
-            with open(event_file, "w") as f:
-                json.dump(event, f, indent=4)
+            serialization.dump(event, event_file)
             logger.write(f"wrote event → {event_file}")
         except:
             traceback.print_exc()
@@ -398,8 +853,7 @@ def do_process(event, context=None, s3=None):
         # 2) Write options.json (the original J)
         opts_file = error_dir / "options.json"
         try:
-            with open(opts_file, "w") as f:
-                json.dump(info_json, f, indent=4)
+            serialization.dump(info_json, opts_file)
             logger.write(f"wrote options → {opts_file}")
         except:
             traceback.print_exc()
@@ -415,34 +869,31 @@ def do_process(event, context=None, s3=None):
         info_json_out = {
             "headers": {
                 "options": {"token": token, "pipelineid": pipelineid},
-                "log": logger.log,
+                "log": serialization.cap_log(logger.log),
             },
             "user_id": user_id,
+            "timings": tracer.to_dict(),
+            "peak_disk_bytes": workspace.sample(),
+            "memory_plan": memory_plan,
         }
         info_file = error_dir / "info.json"
         try:
-            with open(info_file, "w") as f:
-                json.dump(info_json_out, f, indent=4)
+            serialization.dump(info_json_out, info_file)
             logger.write(f"wrote info → {info_file}")
         except:
-            # If standard JSON fails, use sanitizer
-            write_json_file(str(info_file), info_json_out)
-            logger.write(f"wrote info via sanitizer → {info_file}")
-
-        # 5) Bundle up everything under ERROR_DIR into a zip
-        zip_fail_path = Path(
-            shutil.make_archive(
-                pick_random_path(suffix=""),
-                "zip",
-                str(error_dir),
-            )
-        )
-        logger.write(f"zipped failure bundle to {zip_fail_path}")
+            traceback.print_exc()
+            print(f"couldn't write info JSON at {info_file}")
 
-        # 6) Upload to the "failed" bucket
+        # 5) + 6) Stream a zip of ERROR_DIR into the "failed" bucket
         try:
-            key = f"MR Optimum/{user_id}/{zip_fail_path.name}"
-            s3.Bucket(failed_bucket).upload_file(str(zip_fail_path), key)
+            key = f"MR Optimum/{user_id}/{uuid.uuid4().hex}.zip"
+            if s3 is None:
+                s3 = clients.s3_resource()
+            target = S3MultipartTarget(s3.meta.client, failed_bucket, key)
+            with tracer.span("failure_bundle") as span, StreamingUpload.planned(
+                target, directory_size(error_dir)
+            ) as stream:
+                span.add_bytes(zip_directory(error_dir, stream)["bytes_out"])
             logger.write(f"uploaded failed bundle → s3://{failed_bucket}/{key}")
         except Exception as upload_err:
             traceback.print_exc()
@@ -457,27 +908,174 @@ def do_process(event, context=None, s3=None):
                 ),
             }
 
-        # 7) Return 500-like response
-        return {"statusCode": 500, "body": json.dumps({"error": error_formatted})}
+        # 7) Return 500-like response; a rejected job fails the same way on every retry
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": error_formatted}),
+            "retryable": not isinstance(error, (preflight.PreflightError, planner.PlanningError)),
+        }
+
+    finally:
+        if dedupe_key:
+            # duplicates waiting on this job compute themselves if it failed
+            result_cache.release(dedupe_key)
+        if live is not None and not live.finished:
+            # a failed job leaves no partial outputs and no manifest behind
+            live.abort()
+        # Remove every temp artifact of the job, on success and on failure
+        workspace.cleanup()
+        tracer.properties["peak_disk_bytes"] = workspace.peak_bytes
+        logger.write(f"job workspace removed, peak disk usage {workspace.peak_bytes / 1e6:.1f} MB")
+        emit_metrics(tracer, status)
+        if history.enabled():
+            history.record(
+                history.job_row(
+                    tracer,
+                    status,
+                    task_info,
+                    probes,
+                    identity=clients.deployment_identity(timeout=0),
+                    engine=snr_run.engine if snr_run else None,
+                    peak_rss_bytes=peak_rss(snr_run.peak_rss if snr_run else None),
+                    peak_disk_bytes=workspace.peak_bytes,
+                    dims=memory_plan["dims"] if memory_plan else None,
+                )
+            )
+
+
+# resolve the image/deployment identity while the container is still cold
+clients.prefetch_deployment_identity()
 
 
 def handler(event, context, s3=None):
     """
     AWS Lambda entry point. Calls `do_process(...)` and returns its dict directly.
     """
-    print(f"Received event: {json.dumps(event, indent=2)}")
+    print(f"Received event: {serialization.preview(event)}")
     return do_process(event, context, s3=s3)
 
 
+def run_worker(queue, idle_timeout=None, max_jobs=None, concurrency=None):
+    """
+    Process job events from `queue` back to back in this warm container.
+
+    A job's message is acked when it succeeds and dead-lettered when it fails
+    (its failure bundle is already uploaded by then); if the container dies
+    mid-job the message becomes visible again and another worker retries it.
+    On SQS without MROQUEUEDLQURL a failed job is left to the queue's redrive
+    policy, unless it was rejected (preflight, memory plan) and would only
+    fail again: that message is deleted.
+    Returns after `idle_timeout` seconds without work (MROWORKERIDLE, default
+    300), after `max_jobs` jobs, or when SIGTERM asks the task to stop.
+
+    With `concurrency` (MROJOBWORKERS) above 1, jobs run side by side in a
+    MultiJobExecutor instead of in this process.
+    """
+    if idle_timeout is None:
+        idle_timeout = float(os.getenv("MROWORKERIDLE", "300"))
+    if concurrency is None:
+        concurrency = int(os.getenv("MROJOBWORKERS", "1"))
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        # Fargate sends SIGTERM before stopping a task: finish the current jobs, take no new one
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    counts = {"processed": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    def _settle(message, heartbeat, result=None, error=None):
+        heartbeat.stop()
+        with counts_lock:
+            counts["processed"] += 1
+            if error is not None or result.get("statusCode") != 200:
+                counts["failed"] += 1
+        try:
+            if error is not None:
+                # the worker process died; let the queue redeliver (and dead-letter) it
+                print(f"{message!r} did not finish: {error}")
+                queue.release(message)
+            elif result.get("statusCode") == 200:
+                queue.ack(message)
+            else:
+                # without a dead-letter queue, only failures worth retrying stay for redelivery
+                queue.dead_letter(message, result.get("body", "")[:1024], final=not result.get("retryable", True))
+        except Exception as e:
+            # the receipt went stale (the job outlived its visibility and was redelivered):
+            # the message is no longer ours to settle
+            print(f"could not settle {message!r}: {e}")
+
+    executor = None
+    if concurrency > 1:
+        from multijob import MultiJobExecutor
+
+        executor = MultiJobExecutor(workers=concurrency)
+
+    submitted = 0
+    idle_since = time.monotonic()
+    try:
+        while not stop.is_set() and not (max_jobs and submitted >= max_jobs):
+            if executor is not None:
+                executor.wait_for_slot()
+                if executor.running:
+                    idle_since = time.monotonic()
+            idle = time.monotonic() - idle_since
+            if idle >= idle_timeout:
+                print(f"no job for {idle:.0f} s, stopping worker")
+                break
+            message = queue.receive(wait_seconds=min(20, idle_timeout - idle))
+            if message is None:
+                continue
+            try:
+                event = message.json()
+            except ValueError as e:
+                queue.dead_letter(message, f"invalid job event: {e}")
+                continue
+            if event.get("Event") == "s3:TestEvent":
+                # sent once by S3 when a bucket notification is configured
+                queue.ack(message)
+                continue
+
+            print(f"processing {message!r}")
+            submitted += 1
+            heartbeat = Heartbeat(queue, message).start()
+            if executor is not None:
+                future = executor.submit(event)
+                future.add_done_callback(
+                    lambda f, m=message, h=heartbeat: _settle(
+                        m, h, None if f.exception() else f.result(), f.exception()
+                    )
+                )
+                continue
+            try:
+                result = do_process(event, context=None)
+            except Exception:
+                result = {"statusCode": 500, "body": json.dumps({"error": traceback.format_exc()})}
+            _settle(message, heartbeat, result)
+            idle_since = time.monotonic()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    print(f"worker done: {counts['processed']} job(s), {counts['failed']} failed")
+    return counts
+
+
 def main():
     """
     Fargate/Step Functions entry point.
     Expects the raw S3-trigger JSON to be passed in via the FILE_EVENT environment variable.
     Exits with code 0 on success, or 1 on failure.
+
+    Without FILE_EVENT but with MROQUEUEURL set, runs as a long-lived worker that
+    takes job events from that queue until it has been idle for MROWORKERIDLE seconds.
     """
     event_str = os.environ.get("FILE_EVENT")
+    queue_url = os.environ.get("MROQUEUEURL")
+    if not event_str and queue_url:
+        run_worker(open_queue(queue_url))
+        sys.exit(0)
     if not event_str:
-        print("No FILE_EVENT provided. Exiting.")
+        print("No FILE_EVENT or MROQUEUEURL provided. Exiting.")
         sys.exit(1)
 
     try:
@@ -0,0 +1,366 @@
+"""
+Zip archives of job output folders, written to any writable stream.
+
+The archive layout matches `shutil.make_archive(base, "zip", root_dir)`: paths are
+relative to the folder and directories get their own entries.
+
+Files are deflated in parallel: each file is cut into blocks that worker threads
+compress independently (zlib releases the GIL), ending every block but the last
+with a sync flush so the raw deflate streams concatenate into one valid entry,
+the same trick pigz uses. Payloads that are already compressed (.nii.gz, .zip,
+images, ...) or that do not shrink on a sample are stored as-is.
+"""
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MiB = 1024 * 1024
+BLOCK_SIZE = 4 * MiB
+SAMPLE_SIZE = 256 * 1024
+# a sample that compresses to more than this ratio is treated as incompressible
+INCOMPRESSIBLE_RATIO = 0.95
+
+# policy -> deflate level
+POLICIES = {"fast": 1, "balanced": 6, "small": 9}
+DEFAULT_POLICY = "balanced"
+
+COMPRESSED_SUFFIXES = {
+    ".gz", ".tgz", ".zip", ".bz2", ".xz", ".zst", ".7z",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".npz", ".mp4",
+    # chunk-compressed and read by byte range, see chunkstore
+    ".h5",
+}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_MAX = 0xFFFFFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def _walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel = Path(dirpath).relative_to(root)
+        if rel != Path("."):
+            yield Path(dirpath), f"{rel.as_posix()}/"
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            yield path, (rel / name).as_posix()
+
+
+def iter_entries(root, first=()):
+    """
+    Yield (path, arcname) for every directory and file under `root`, sorted,
+    except that arcnames starting with a prefix in `first` come first, in the
+    order of `first`.
+    """
+    root = Path(root)
+    if not first:
+        yield from _walk(root)
+        return
+
+    def rank(entry):
+        return next((i for i, prefix in enumerate(first) if entry[1].startswith(prefix)), len(first))
+
+    # sorted() is stable, so each group keeps the walk order
+    yield from sorted(_walk(root), key=rank)
+
+
+def directory_size(root):
+    """Total size in bytes of the files under `root`."""
+    return sum(path.stat().st_size for path, arcname in iter_entries(root) if path.is_file())
+
+
+def resolve_policy(policy=None):
+    """Return a valid policy name from `policy`, MROZIPPOLICY or the default."""
+    policy = (policy or os.getenv("MROZIPPOLICY") or DEFAULT_POLICY).lower()
+    return policy if policy in POLICIES else DEFAULT_POLICY
+
+
+def is_incompressible(path, size):
+    """True if `path` is known or sampled to be already compressed."""
+    if path.suffix.lower() in COMPRESSED_SUFFIXES:
+        return True
+    if size < SAMPLE_SIZE:
+        return False
+    with open(path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) > INCOMPRESSIBLE_RATIO * len(sample)
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    dostime = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dosdate = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dostime, dosdate
+
+
+class ZipStreamWriter:
+    """
+    Minimal zip writer for non-seekable streams.
+
+    Stored entries are written with their CRC and sizes up front; deflated
+    entries are streamed block by block and closed with a data descriptor.
+    Zip64 records are emitted when sizes, offsets or the entry count need them.
+    """
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.offset = 0
+        self.entries = []
+        self._current = None
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def _local_header(self, name, flags, method, mtime, crc, csize, usize, zip64):
+        dostime, dosdate = _dos_datetime(mtime)
+        extra = b""
+        if zip64:
+            extra = struct.pack("<HHQQ", 1, 16, usize, csize)
+            csize = usize = ZIP_MAX
+        self._write(
+            struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                45 if zip64 else 20,
+                flags,
+                method,
+                dostime,
+                dosdate,
+                crc,
+                csize,
+                usize,
+                len(name),
+                len(extra),
+            )
+            + name
+            + extra
+        )
+
+    def _entry(self, arcname, mode, mtime, method, is_dir=False):
+        name = arcname.encode("utf-8")
+        flags = 0 if name.isascii() else FLAG_UTF8
+        attr = (mode & 0xFFFF) << 16
+        if is_dir:
+            attr |= 0x10
+        return {
+            "name": name,
+            "flags": flags,
+            "method": method,
+            "mtime": mtime,
+            "attr": attr,
+            "offset": self.offset,
+            "crc": 0,
+            "csize": 0,
+            "usize": 0,
+        }
+
+    def add_dir(self, arcname, st):
+        entry = self._entry(arcname, st.st_mode, st.st_mtime, ZIP_STORED, is_dir=True)
+        self._local_header(entry["name"], entry["flags"], ZIP_STORED, st.st_mtime, 0, 0, 0, False)
+        self.entries.append(entry)
+
+    def add_stored(self, path, arcname, st, crc):
+        entry = self._entry(arcname, st.st_mode, st.st_mtime, ZIP_STORED)
+        entry.update(crc=crc, csize=st.st_size, usize=st.st_size)
+        zip64 = st.st_size > ZIP64_LIMIT
+        self._local_header(
+            entry["name"], entry["flags"], ZIP_STORED, st.st_mtime, crc, st.st_size, st.st_size, zip64
+        )
+        with open(path, "rb") as f:
+            while block := f.read(BLOCK_SIZE):
+                self._write(block)
+        self.entries.append(entry)
+
+    def begin_deflated(self, arcname, st):
+        entry = self._entry(arcname, st.st_mode, st.st_mtime, ZIP_DEFLATED)
+        entry["flags"] |= FLAG_DATA_DESCRIPTOR
+        # same rule as zipfile: leave room for deflate expanding incompressible data
+        entry["zip64"] = st.st_size * 1.05 > ZIP64_LIMIT
+        self._local_header(
+            entry["name"], entry["flags"], ZIP_DEFLATED, st.st_mtime, 0, 0, 0, entry["zip64"]
+        )
+        self._current = entry
+
+    def write_block(self, raw, compressed):
+        entry = self._current
+        entry["crc"] = zlib.crc32(raw, entry["crc"])
+        entry["usize"] += len(raw)
+        entry["csize"] += len(compressed)
+        self._write(compressed)
+
+    def end_deflated(self):
+        entry = self._current
+        if entry["zip64"]:
+            descriptor = struct.pack("<IIQQ", 0x08074B50, entry["crc"], entry["csize"], entry["usize"])
+        else:
+            descriptor = struct.pack("<IIII", 0x08074B50, entry["crc"], entry["csize"], entry["usize"])
+        self._write(descriptor)
+        self.entries.append(entry)
+        self._current = None
+
+    def close(self):
+        cd_offset = self.offset
+        for e in self.entries:
+            usize, csize, offset = e["usize"], e["csize"], e["offset"]
+            extra_fields = []
+            if usize > ZIP64_LIMIT:
+                extra_fields.append(usize)
+                usize = ZIP_MAX
+            if csize > ZIP64_LIMIT:
+                extra_fields.append(csize)
+                csize = ZIP_MAX
+            if offset > ZIP64_LIMIT:
+                extra_fields.append(offset)
+                offset = ZIP_MAX
+            extra = b""
+            if extra_fields:
+                extra = struct.pack(f"<HH{len(extra_fields)}Q", 1, 8 * len(extra_fields), *extra_fields)
+            version = 45 if extra_fields or e.get("zip64") else 20
+            dostime, dosdate = _dos_datetime(e["mtime"])
+            self._write(
+                struct.pack(
+                    "<IHHHHHHIIIHHHHHII",
+                    0x02014B50,
+                    (3 << 8) | version,
+                    version,
+                    e["flags"],
+                    e["method"],
+                    dostime,
+                    dosdate,
+                    e["crc"],
+                    csize,
+                    usize,
+                    len(e["name"]),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    e["attr"],
+                    offset,
+                )
+                + e["name"]
+                + extra
+            )
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+        if count > 0xFFFF or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            zip64_eocd = self.offset
+            self._write(
+                struct.pack(
+                    "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset
+                )
+            )
+            self._write(struct.pack("<IIQI", 0x07064B50, 0, zip64_eocd, 1))
+        self._write(
+            struct.pack(
+                "<IHHHHIIH",
+                0x06054B50,
+                0,
+                0,
+                min(count, 0xFFFF),
+                min(count, 0xFFFF),
+                min(cd_size, ZIP_MAX),
+                min(cd_offset, ZIP_MAX),
+                0,
+            )
+        )
+
+
+def _crc_file(path):
+    crc = 0
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _deflate_block(path, offset, length, level, last):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        raw = f.read(length)
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    # a sync flush ends the block byte-aligned without marking the stream final
+    return raw, c.compress(raw) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _work_items(root, level, stats, first=()):
+    """Yield (kind, path, arcname, st, fn, args) in archive order."""
+    for path, arcname in iter_entries(root, first):
+        st = path.stat()
+        if arcname.endswith("/"):
+            yield "dir", path, arcname, st, None, None
+        elif is_incompressible(path, st.st_size):
+            stats["stored"] += 1
+            yield "stored", path, arcname, st, _crc_file, (path,)
+        else:
+            stats["deflated"] += 1
+            nblocks = max(1, -(-st.st_size // BLOCK_SIZE))
+            for i in range(nblocks):
+                last = i == nblocks - 1
+                kind = ("first" if i == 0 else "block") + ("+last" if last else "")
+                yield kind, path, arcname, st, _deflate_block, (path, i * BLOCK_SIZE, BLOCK_SIZE, level, last)
+
+
+def zip_directory(root, fileobj, policy=None, workers=None, first=()):
+    """
+    Zip everything under `root` into `fileobj` with parallel, content-aware compression.
+
+    `fileobj` does not need to be seekable, so it can be a StreamingUpload.
+    `policy` is one of POLICIES ("fast", "balanced", "small"). Entries whose
+    path starts with a prefix in `first` are written first, so a reader
+    streaming the zip gets them before the rest. Returns a dict of archive
+    statistics.
+    """
+    policy = resolve_policy(policy)
+    workers = workers or os.cpu_count() or 1
+    stats = {"policy": policy, "entries": 0, "stored": 0, "deflated": 0, "bytes_in": 0}
+    writer = ZipStreamWriter(fileobj)
+    # bounds the raw+compressed blocks held in memory
+    window = 2 * workers
+    items = _work_items(root, POLICIES[policy], stats, first)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip") as pool:
+
+        def fill():
+            while len(pending) < window:
+                item = next(items, None)
+                if item is None:
+                    return
+                fn, args = item[4], item[5]
+                pending.append((item, pool.submit(fn, *args) if fn else None))
+
+        fill()
+        while pending:
+            (kind, path, arcname, st, _, _), future = pending.popleft()
+            result = future.result() if future else None
+            if kind == "dir":
+                writer.add_dir(arcname, st)
+                stats["entries"] += 1
+            elif kind == "stored":
+                writer.add_stored(path, arcname, st, result)
+                stats["entries"] += 1
+                stats["bytes_in"] += st.st_size
+            else:
+                if kind.startswith("first"):
+                    writer.begin_deflated(arcname, st)
+                raw, compressed = result
+                writer.write_block(raw, compressed)
+                stats["bytes_in"] += len(raw)
+                if kind.endswith("+last"):
+                    writer.end_deflated()
+                    stats["entries"] += 1
+            fill()
+    writer.close()
+    stats["bytes_out"] = writer.offset
+    return stats
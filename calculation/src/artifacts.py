@@ -0,0 +1,279 @@
+"""
+Cache of intermediate calibration artifacts shared by jobs on the same data.
+
+Jobs of one study often reuse the same signal/noise scans and only sweep
+parameters that do not affect calibration (acceleration factors, boxSize, NR,
+...). The coil sensitivity maps, ESPIRiT in particular, and the noise
+covariance are the calibration part of such jobs and depend only on the input
+content and on a few options. They are cached here under a key made of:
+
+- the object identities (bucket/key/ETag) of the inputs the artifact is
+  computed from: signal and noise for the maps, the noise scan alone for the
+  covariance;
+- the options that shape the artifact (method, mask, correction, decimate,
+  multi-RAID);
+- the receive coils of the signal (TWIX header), so an artifact is only ever
+  reused for the same coils;
+- the mrotools version.
+
+After compute, `harvest` stores the artifact mrotools wrote to OUT with the
+SHA-256 of every file: the whole map set from --coilsens, and the covariance
+matrix taken out of the --matlab output. Before compute, `prepare` points a job
+with a cached artifact at it (`loadSensitivity` / `noiseCovariance`), but only
+when every file is byte-identical to what was harvested and the artifact is
+exactly one file mrotools can read; anything else is a miss, never a guess.
+Entries live in a size-bounded LRU directory (MROARTIFACTCACHEDIR,
+MROARTIFACTCACHEMAXBYTES).
+
+The cache is off unless MROARTIFACTCACHE=true: whether mrotools gives the same
+result from its own stored maps and covariance as from recomputing them
+depends on the mrotools build, so it has to be enabled knowingly.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import zipfile
+from pathlib import Path
+
+import twixfile
+from inputcache import InputCache, object_identity
+from resultcache import engine_version
+
+DEFAULT_CACHE_DIR = "/tmp/mro-artifact-cache"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# when to ask mrotools for maps the user did not request, only to fill the cache:
+# "requested" (default) harvests only what the job saves anyway, "always" adds
+# --coilsens and strips the extra files from the user's OUT again
+HARVEST_POLICIES = ("requested", "always", "never")
+# formats of a harvested artifact mrotools reads back as sensitivityMapSource
+LOAD_SUFFIXES = (".nii.gz", ".nii", ".mat")
+# file list with checksums stored next to the files of an artifact
+MANIFEST_NAME = "artifact.json"
+# names mrotools gives the noise covariance in its MATLAB output, compared lowercased without "_"
+COVARIANCE_NAMES = ("noisecovariance", "noisecov", "nc")
+COVARIANCE_FILE = "noise_covariance.mat"
+
+
+class ArtifactSpec:
+    """One kind of intermediate artifact and how it is keyed, found and loaded."""
+
+    def __init__(self, name, patterns, output_flag, inputs, key_options, load, collect=None):
+        self.name = name
+        # OUT files making up the artifact
+        self.patterns = patterns
+        # mrotools flag that makes it write the artifact to OUT
+        self.output_flag = output_flag
+        # input names the artifact is computed from
+        self.inputs = inputs
+        # recon options -> dict of options that shape the artifact, or None if not applicable
+        self.key_options = key_options
+        # (recon options, local path) -> None; makes mrotools load the artifact
+        self.load = load
+        # (out_dir, matching OUT files, workspace) -> [(name, path)] to store; the files themselves by default
+        self.collect = collect or _collect_files
+
+    def matches(self, path):
+        return any(fnmatch.fnmatch(path.name.lower(), p) for p in self.patterns)
+
+
+def _sensitivity_options(recon_opts):
+    sens = recon_opts.get("sensitivityMap")
+    if not isinstance(sens, dict):
+        return None
+    opts = sens.get("options") or {}
+    if opts.get("loadSensitivity"):
+        # the user supplies the maps
+        return None
+    return {
+        "method": opts.get("sensitivityMapMethod") or sens.get("name"),
+        "mask": opts.get("mask"),
+        "correction": recon_opts.get("correction") or sens.get("correction"),
+        "decimate": recon_opts.get("decimate", sens.get("decimate")),
+        "multiraid": recon_opts.get("signalMultiRaid"),
+    }
+
+
+def _noise_options(recon_opts):
+    noise = recon_opts.get("noise")
+    if not isinstance(noise, dict) or recon_opts.get("noiseCovariance"):
+        # no noise scan, or the user supplies the covariance
+        return None
+    return {
+        "vendor": (noise.get("options") or {}).get("vendor"),
+        "multiraid": (noise.get("options") or {}).get("multiraid"),
+    }
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def coil_set(inputs):
+    """Receive coils of the job's signal, or None if they cannot be read."""
+    signal = inputs.get("signal")
+    if signal is None or not twixfile.is_twix(signal):
+        return None
+    try:
+        return twixfile.coil_names(signal["filename"]) or None
+    except Exception:
+        return None
+
+
+def _load_sensitivity(recon_opts, path):
+    opts = recon_opts["sensitivityMap"].setdefault("options", {})
+    opts["loadSensitivity"] = True
+    # same shape as a downloaded input, see download_from_s3
+    opts["sensitivityMapSource"] = {
+        "type": "file",
+        "options": {"type": "local", "filename": str(path), "vendor": "MR Optimum"},
+    }
+
+
+def _load_noise_covariance(recon_opts, path):
+    # same shape as a downloaded input, see download_from_s3
+    recon_opts["noiseCovariance"] = {
+        "type": "file",
+        "options": {"type": "local", "filename": str(path), "vendor": "MR Optimum"},
+    }
+
+
+def _collect_files(out_dir, files, workspace):
+    return [(p.relative_to(out_dir).as_posix(), p) for p in files]
+
+
+def _collect_covariance(out_dir, files, workspace):
+    """The noise covariance out of mrotools' MATLAB output, as a .mat of its own."""
+    from scipy.io import loadmat, savemat
+
+    for path in files:
+        for name, value in loadmat(str(path)).items():
+            if name.startswith("__") or name.lower().replace("_", "") not in COVARIANCE_NAMES:
+                continue
+            if getattr(value, "ndim", 0) == 2 and value.shape[0] == value.shape[1] > 0:
+                target = workspace.path(".mat")
+                savemat(str(target), {"noiseCovariance": value})
+                return [(COVARIANCE_FILE, target)]
+    return []
+
+
+SENSITIVITY = ArtifactSpec(
+    "coil_sensitivity",
+    patterns=("*sensitivit*",),
+    output_flag="--coilsens",
+    inputs=("signal", "noise"),
+    key_options=_sensitivity_options,
+    load=_load_sensitivity,
+)
+NOISE_COVARIANCE = ArtifactSpec(
+    "noise_covariance",
+    patterns=("*.mat",),
+    output_flag="--matlab",
+    inputs=("noise",),
+    key_options=_noise_options,
+    load=_load_noise_covariance,
+    collect=_collect_covariance,
+)
+SPECS = (SENSITIVITY, NOISE_COVARIANCE)
+
+
+def harvest_policy():
+    policy = os.getenv("MROARTIFACTHARVEST", "requested").lower()
+    return policy if policy in HARVEST_POLICIES else "requested"
+
+
+class ArtifactCache:
+    """Size-bounded LRU store of artifacts, one zip per artifact."""
+
+    def __init__(self, root=None, max_bytes=None):
+        root = root or os.getenv("MROARTIFACTCACHEDIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.getenv("MROARTIFACTCACHEMAXBYTES", str(DEFAULT_MAX_BYTES)))
+        self.store = InputCache(root, max_bytes)
+
+    def key(self, spec, task_info, inputs, probes):
+        """Cache key of `spec` for this job, or None if it does not apply or an input has no identity."""
+        recon_opts = task_info["options"]["reconstructor"]["options"]
+        options = spec.key_options(recon_opts)
+        if options is None:
+            return None
+        identities = {}
+        for name in spec.inputs:
+            if name not in inputs:
+                continue
+            etag = (probes or {}).get(name, {}).get("etag")
+            identity = object_identity(inputs[name], None, etag)
+            if identity is None:
+                return None
+            identities[name] = identity
+        if not identities:
+            return None
+        canonical = json.dumps(
+            {
+                "artifact": spec.name,
+                "inputs": identities,
+                "options": options,
+                "coils": coil_set(inputs),
+                "engine": engine_version(),
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def prepare(self, spec, key, task_info, workspace):
+        """
+        Point the job at the cached artifact; returns True on a hit. An artifact
+        that fails its checksums or is not a single loadable file is not used.
+        """
+        entry = self.store.lookup(key, ".zip")
+        if entry is None:
+            return False
+        target = workspace.mkdir(f"artifact-{spec.name}")
+        with zipfile.ZipFile(entry) as z:
+            if MANIFEST_NAME not in z.namelist():
+                # stored before checksums were kept
+                return False
+            z.extractall(target)
+        manifest = json.loads((target / MANIFEST_NAME).read_text())
+        files = manifest.get("files") or {}
+        for name, sha in files.items():
+            path = target / name
+            if not path.is_file() or _sha256(path) != sha:
+                return False
+        loadable = [name for name in files if name.lower().endswith(LOAD_SUFFIXES)]
+        if len(loadable) != 1 or len(files) != 1:
+            # mrotools takes one file per artifact; a multi-file set has no single file to hand over
+            return False
+        spec.load(task_info["options"]["reconstructor"]["options"], target / loadable[0])
+        return True
+
+    def harvest(self, spec, key, out_dir, workspace, strip=False):
+        """
+        Store the artifact mrotools wrote to `out_dir`; with `strip` the OUT
+        files it came from are removed afterwards. Returns the number of files stored.
+        """
+        files = [p for p in Path(out_dir).rglob("*") if p.is_file() and spec.matches(p)]
+        parts = spec.collect(Path(out_dir), files, workspace) if files else []
+        if not parts:
+            return 0
+        bundle = workspace.path(".zip")
+        checksums = {name: _sha256(p) for name, p in parts}
+        # maps are mostly .nii.gz already, so they are stored as-is
+        with zipfile.ZipFile(bundle, "w", zipfile.ZIP_STORED) as z:
+            for name, p in parts:
+                z.write(p, name)
+            z.writestr(MANIFEST_NAME, json.dumps({"artifact": spec.name, "files": checksums}, sort_keys=True))
+        self.store.insert(key, bundle, ".zip")
+        if strip:
+            for p in files:
+                p.unlink()
+        return len(parts)
+
+    def release(self):
+        self.store.release()
@@ -0,0 +1,151 @@
+"""
+Chunked, range-readable copy of the result maps.
+
+The maps mrotools writes to OUT (SNR, noise, g-factor, coil sensitivities) are
+NIfTI files that a viewer has to download and decompress whole. With
+MROCHUNKED on (or `"chunked": true` in the job's output section), `write`
+also stores them in one HDF5 file, OUT/arrays.h5:
+
+- one dataset per map, chunked one slice per chunk and gzip-compressed chunk
+  by chunk, with the NIfTI geometry as attributes;
+- OUT/arrays.json, a small manifest with the shape, dtype, filters and the
+  byte offset and size of every chunk in arrays.h5.
+
+A reader can then fetch one slice with a single byte-range read and inflate
+it, without an HDF5 library. arrays.h5 is stored uncompressed in the result
+zip (see archive.COMPRESSED_SUFFIXES), so the offsets stay valid inside it
+after adding the zip entry's data offset.
+"""
+import fnmatch
+import json
+import os
+from pathlib import Path
+
+STORE_NAME = "arrays.h5"
+MANIFEST_NAME = "arrays.json"
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+# role -> OUT file name patterns, checked in this order
+ROLES = (
+    ("coil_sensitivity", ("*sensitivit*",)),
+    ("gfactor", ("*gfactor*", "*g-factor*", "*g_factor*")),
+    ("noise", ("*noise*",)),
+    ("snr", ("*snr*",)),
+)
+DEFAULT_LEVEL = 4
+
+
+def enabled(output=None):
+    if (output or {}).get("chunked"):
+        return True
+    return os.getenv("MROCHUNKED", "false").lower() in ("true", "1", "yes")
+
+
+def role(path):
+    """Which map an OUT file holds, or None if it is not one of the chunked maps."""
+    name = Path(path).name.lower()
+    if not name.endswith(NIFTI_SUFFIXES):
+        return None
+    for role_name, patterns in ROLES:
+        if any(fnmatch.fnmatch(name, p) for p in patterns):
+            return role_name
+    return None
+
+
+def maps(out_dir):
+    """Map files under `out_dir`, in path order."""
+    out_dir = Path(out_dir)
+    return sorted((p for p in out_dir.rglob("*") if p.is_file() and role(p)), key=lambda p: p.relative_to(out_dir))
+
+
+def map_name(relative):
+    """Name of the map at `relative` (path in OUT) without its suffix; subfolders are kept."""
+    name = relative.as_posix()
+    for suffix in NIFTI_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def read_map(path):
+    """Array of a NIfTI map with a leading slice axis, and its geometry."""
+    import SimpleITK as sitk
+
+    image = sitk.ReadImage(str(path))
+    array = sitk.GetArrayFromImage(image)
+    if image.GetDimension() == 2:
+        # a single slice: give it the slice axis the chunks are cut along
+        array = array[None, ...]
+    geometry = {
+        "origin": list(image.GetOrigin()),
+        "spacing": list(image.GetSpacing()),
+        "direction": list(image.GetDirection()),
+        # array axes are the image axes reversed: (slice, y, x[, component])
+        "axes": ["z", "y", "x"] + (["component"] if image.GetNumberOfComponentsPerPixel() > 1 else []),
+    }
+    return array, geometry
+
+
+def write(out_dir, level=None):
+    """
+    Write the maps found in `out_dir` to arrays.h5 and its manifest; returns
+    the manifest, or None if there is no map to store.
+    """
+    out_dir = Path(out_dir)
+    sources = maps(out_dir)
+    if not sources:
+        return None
+    level = int(os.getenv("MROCHUNKEDLEVEL", str(DEFAULT_LEVEL))) if level is None else level
+    store = out_dir / STORE_NAME
+    try:
+        manifest = _write(out_dir, store, sources, level)
+    except BaseException:
+        # no half-written store in the user's results
+        for name in (STORE_NAME, MANIFEST_NAME):
+            (out_dir / name).unlink(missing_ok=True)
+        raise
+    return manifest
+
+
+def _write(out_dir, store, sources, level):
+    import h5py
+
+    arrays = {}
+    with h5py.File(store, "w") as f:
+        for path in sources:
+            array, geometry = read_map(path)
+            # OUT subfolders become HDF5 groups
+            name = map_name(path.relative_to(out_dir))
+            dataset = f.create_dataset(
+                name, data=array, chunks=(1, *array.shape[1:]), compression="gzip", compression_opts=level
+            )
+            for key, value in geometry.items():
+                dataset.attrs[key] = value
+            arrays[name] = {
+                "role": role(path),
+                "source": path.relative_to(out_dir).as_posix(),
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+                "chunk_shape": [1, *array.shape[1:]],
+                "geometry": geometry,
+            }
+
+    # chunk addresses are final once the file is closed
+    with h5py.File(store, "r") as f:
+        for name, entry in arrays.items():
+            dsid = f[name].id
+            chunks = [dsid.get_chunk_info(i) for i in range(dsid.get_num_chunks())]
+            chunks.sort(key=lambda c: c.chunk_offset)
+            # [slice, byte offset, stored size, compressed]; HDF5 stores a chunk raw when
+            # deflate did not shrink it
+            entry["chunks"] = [[c.chunk_offset[0], c.byte_offset, c.size, c.filter_mask == 0] for c in chunks]
+
+    manifest = {
+        "format": "hdf5",
+        "file": STORE_NAME,
+        # every chunk is a zlib stream of the slice's bytes in C order
+        "compression": {"codec": "zlib", "level": level},
+        "arrays": arrays,
+    }
+    with open(out_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f)
+    return manifest
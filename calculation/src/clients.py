@@ -0,0 +1,137 @@
+"""
+Container-wide AWS clients, HTTP session and deployment identity.
+
+Everything here is created lazily on first use and then reused by every job
+handled by the same warm Lambda container or Fargate worker, so connection
+pools stay open between invocations and control-plane lookups happen once.
+"""
+import os
+import threading
+
+import boto3
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+
+# enough connections for the parallel range downloads and multipart uploads
+POOL_SIZE = 64
+
+_lock = threading.Lock()
+_s3_resource = None
+_lambda_client = None
+_sqs_client = None
+_http_session = None
+_identity = None
+_identity_ready = threading.Event()
+_identity_thread = None
+
+
+def _boto_config():
+    return Config(max_pool_connections=POOL_SIZE, retries={"mode": "adaptive", "max_attempts": 5})
+
+
+def s3_resource():
+    """Shared boto3 S3 resource; use `.meta.client` (thread-safe) from worker threads."""
+    global _s3_resource
+    with _lock:
+        if _s3_resource is None:
+            _s3_resource = boto3.resource("s3", config=_boto_config())
+        return _s3_resource
+
+
+def lambda_client():
+    global _lambda_client
+    with _lock:
+        if _lambda_client is None:
+            _lambda_client = boto3.client("lambda", config=_boto_config())
+        return _lambda_client
+
+
+def sqs_client():
+    global _sqs_client
+    with _lock:
+        if _sqs_client is None:
+            _sqs_client = boto3.client("sqs", config=_boto_config())
+        return _sqs_client
+
+
+def http_session():
+    """Shared requests.Session with a keep-alive pool sized for parallel transfers."""
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def _discover_deployment():
+    """Query Lambda GetFunction and/or the ECS metadata endpoint for the running image."""
+    identity = {"platform": "local", "image_uri": None, "images": [], "errors": []}
+    # 1) If running as Lambda, query get_function for ImageUri (requires lambda:GetFunction)
+    fn = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if fn:
+        identity["platform"] = "lambda"
+        try:
+            resp = lambda_client().get_function(FunctionName=fn)
+            identity["image_uri"] = resp.get("Code", {}).get("ImageUri")
+        except Exception as e:
+            identity["errors"].append(f"Could not get Lambda function config: {e}")
+
+    # 2) If running in ECS/Fargate, query metadata endpoint
+    meta_uri = os.environ.get("ECS_CONTAINER_METADATA_URI_V4") or os.environ.get("ECS_CONTAINER_METADATA_URI")
+    if meta_uri:
+        identity["platform"] = "fargate"
+        try:
+            r = http_session().get(meta_uri, timeout=5)
+            if r.status_code == 200:
+                md = r.json()
+                # v4/v3 metadata include Containers list or Image
+                containers = md.get("Containers") or md.get("Container") or [md]
+                for c in containers:
+                    img = c.get("Image") or c.get("ImageID")
+                    if img:
+                        identity["images"].append(img)
+                if identity["images"] and not identity["image_uri"]:
+                    identity["image_uri"] = identity["images"][0]
+            else:
+                identity["errors"].append(f"ECS metadata request returned status {r.status_code}")
+        except Exception as e:
+            identity["errors"].append(f"Could not read ECS metadata endpoint: {e}")
+    return identity
+
+
+def _resolve_identity():
+    global _identity
+    try:
+        _identity = _discover_deployment()
+    except Exception as e:
+        _identity = {"platform": "unknown", "image_uri": None, "images": [], "errors": [str(e)]}
+    finally:
+        _identity_ready.set()
+
+
+def prefetch_deployment_identity():
+    """Start discovering the deployment identity in the background (once per container)."""
+    global _identity_thread
+    with _lock:
+        if _identity_thread is None:
+            _identity_thread = threading.Thread(
+                target=_resolve_identity, name="deployment-identity", daemon=True
+            )
+            _identity_thread.start()
+
+
+def deployment_identity(timeout=5):
+    """
+    Cached image/deployment identity of this container.
+
+    Returns None if discovery has not finished within `timeout` seconds; the job
+    does not wait for the control plane longer than that.
+    """
+    prefetch_deployment_identity()
+    _identity_ready.wait(timeout)
+    return _identity
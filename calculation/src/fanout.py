@@ -0,0 +1,360 @@
+"""
+Slice fan-out of multi-slice jobs.
+
+mrotools.snr reconstructs the slices of a 2D multi-slice acquisition one after
+the other in a single process, so wall time grows with the slice count. With
+MROSLICEFANOUT on, do_process splits the signal file into groups of slices
+(twixfile.split_slices), runs one mrotools.snr per group side by side and
+merges the groups' OUT folders into the layout of a single run:
+
+- NIfTI maps are stacked along the slice axis, with the geometry of the first
+  group; a single-slice group's map may come back 2D, and is first placed in
+  3D from the slice positions of the TWIX header (slice spacing from the
+  distance between slice centres, slice axis along the slice normal);
+- MATLAB variables are stacked along their third axis (x, y, slice, ...);
+- info.json is the first group's, with the log entries of every group;
+- any other file must be identical in every group.
+
+A job that cannot be split, or whose outputs cannot be merged, raises
+FanoutError and do_process runs it whole.
+
+Groups run on a concurrent.futures executor: a thread pool launching one
+mrotools subprocess per group (MROSLICEWORKERS at a time, default as many as
+the granted CPUs and memory fit, see runner.plan_parallelism), or whatever
+the `module:callable` factory named by MROSLICEEXECUTOR returns.
+Such an executor receives picklable SliceTask objects whose paths are in the
+job workspace, so it has to share that filesystem.
+"""
+import copy
+import filecmp
+import importlib
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import twixfile
+from resources import effective_cpus
+from progress import Monitor
+from runner import SNRRun, run_snr, snr_args
+
+NIFTI_SUFFIXES = (".nii.gz", ".nii")
+
+
+class FanoutError(Exception):
+    """The job cannot be split into slices, or the slice outputs cannot be merged."""
+
+
+def enabled():
+    return os.getenv("MROSLICEFANOUT", "false").lower() in ("true", "1", "yes")
+
+
+def default_workers(planned=None):
+    return int(os.getenv("MROSLICEWORKERS", "0")) or planned or effective_cpus()
+
+
+def slice_groups(n_slices, workers, per_task=None):
+    """
+    Contiguous groups of slice indices, one per worker (or of at most
+    `per_task` slices each), whose sizes differ by one slice at most.
+    """
+    count = math.ceil(n_slices / per_task) if per_task else max(workers, 1)
+    count = max(1, min(count, n_slices))
+    size, extra = divmod(n_slices, count)
+    groups, start = [], 0
+    for i in range(count):
+        end = start + size + (i < extra)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def plan(task_info, inputs, dims=None):
+    """
+    Slice count of the job's signal; raises FanoutError when the job cannot be
+    fanned out. `dims` are the signal's twixfile.read_dims if already read.
+    """
+    signal = inputs.get("signal")
+    if signal is None or not twixfile.is_twix(signal):
+        raise FanoutError("signal is not Siemens TWIX data")
+    recon_opts = task_info["options"]["reconstructor"]["options"]
+    if ((recon_opts.get("sensitivityMap") or {}).get("options") or {}).get("loadSensitivity"):
+        # loaded maps cover every slice and cannot be split with the signal
+        raise FanoutError("coil sensitivity maps are loaded from a file")
+    dims = dims or twixfile.read_dims(signal["filename"])
+    if dims["partitions"] > 1:
+        raise FanoutError("3D acquisition")
+    if dims["slices"] < 2:
+        raise FanoutError("single slice")
+    return dims["slices"]
+
+
+class SliceTask:
+    """One group of slices: its mrotools input, output folder and log."""
+
+    def __init__(self, index, slices, input_json, out_dir, log_path, flags, threads=None, labels=None):
+        self.index = index
+        self.slices = slices
+        self.input_json = input_json
+        self.out_dir = out_dir
+        self.log_path = log_path
+        self.flags = flags
+        # BLAS/OpenMP threads of the group's process
+        self.threads = threads
+        # progress event labels
+        self.labels = dict(labels or {}, SliceGroup=index)
+
+    def args(self):
+        return snr_args(self.input_json, self.out_dir, self.log_path, self.flags)
+
+    def __repr__(self):
+        return f"SliceTask({self.index}, slices {self.slices[0]}-{self.slices[-1]})"
+
+
+def run_slice_task(task):
+    # in-process runs share sys.argv and module state, so every group gets its own process
+    # the monitor is made here, so that its sinks come from the worker's environment
+    monitor = Monitor(task.log_path, labels=task.labels)
+    return run_snr(task.args(), task.log_path, engine="subprocess", threads=task.threads, monitor=monitor)
+
+
+def open_executor(workers):
+    spec = os.getenv("MROSLICEEXECUTOR", "local")
+    if spec == "local":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="slice")
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)(workers)
+
+
+def _prepare(task_info, inputs, groups, flags, workspace, threads, labels):
+    signal = inputs["signal"]["filename"]
+    workspace.check_budget(twixfile.split_size(signal, groups), "slice split")
+    paths = twixfile.split_slices(signal, groups, workspace.mkdir("slices"))
+    tasks = []
+    for i, (group, path) in enumerate(zip(groups, paths)):
+        sub = copy.deepcopy(task_info)
+        sub["options"]["reconstructor"]["options"]["signal"]["options"]["filename"] = str(path)
+        base = workspace.mkdir(f"slices-{i}")
+        input_json = base / "task.json"
+        with open(input_json, "w") as f:
+            json.dump(sub, f)
+        out_dir = base / "OUT"
+        out_dir.mkdir()
+        tasks.append(SliceTask(i, group, input_json, out_dir, base / "snr.log", flags, threads, labels))
+    return tasks
+
+
+def run(
+    task_info, inputs, n_slices, flags, out_dir, workspace, workers=None, per_task=None, log=print, labels=None
+):
+    """
+    Compute the job as slice groups of `per_task` slices, `workers` at a time,
+    and merge their outputs into `out_dir`. Returns an SNRRun covering every
+    group; raises FanoutError if the job has to run whole instead. `labels`
+    tag the progress events of the groups.
+    """
+    workers = default_workers(workers)
+    per_task = per_task or int(os.getenv("MROSLICESPERTASK", "0")) or None
+    groups = slice_groups(n_slices, workers, per_task)
+    if len(groups) < 2:
+        raise FanoutError("every slice would end up in one group")
+    workers = min(workers, len(groups))
+    # the groups are the parallelism; mrotools' own workers would oversubscribe the CPUs
+    flags = ["--no-parallel" if f == "--parallel" else f for f in flags]
+    threads = max(1, effective_cpus() // workers)
+    try:
+        tasks = _prepare(task_info, inputs, groups, flags, workspace, threads, labels)
+        slices = twixfile.slice_positions(inputs["signal"]["filename"])
+    except Exception as e:
+        raise FanoutError(f"could not split the signal: {e}") from e
+    log(
+        f"fanning out {n_slices} slices as {len(tasks)} groups on {workers} worker(s), "
+        f"{threads} thread(s) each"
+    )
+
+    result = SNRRun("fanout", [], None)
+    start = time.monotonic()
+    runs = {}
+    with open_executor(workers) as executor:
+        futures = {executor.submit(run_slice_task, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                sub = future.result()
+            except Exception as e:
+                sub = SNRRun("subprocess", task.args(), task.log_path)
+                sub.exception = e
+                sub.returncode = 1
+            runs[task.index] = sub
+            if sub.failed:
+                log(f"{task!r} failed, cancelling the groups not started yet")
+                for f in futures:
+                    f.cancel()
+                break
+            log(f"{task!r} done in {sub.elapsed:.1f}s")
+    result.elapsed = time.monotonic() - start
+
+    for index in sorted(runs):
+        result.log.extend(runs[index].log)
+    # the largest group process; resources.peak_rss only sees this one
+    result.peak_rss = max((r.peak_rss or 0 for r in runs.values()), default=0) or None
+    failed = next((r for r in runs.values() if r.failed), None)
+    if failed is not None:
+        result.returncode = failed.returncode or 1
+        result.exception = failed.exception
+        result.traceback = failed.traceback
+        result.aborted = failed.aborted
+        return result
+    result.returncode = 0
+    try:
+        merge([task.out_dir for task in tasks], out_dir, groups, slices)
+    except FanoutError:
+        raise
+    except Exception as e:
+        raise FanoutError(f"could not merge the slice outputs: {e}") from e
+    return result
+
+
+def _files(directory):
+    return sorted(p.relative_to(directory) for p in Path(directory).rglob("*") if p.is_file())
+
+
+def merge(out_dirs, out_dir, groups, slices=None):
+    """
+    Merge the OUT folders of the slice groups (in slice order) into `out_dir`.
+    `slices` are the twixfile.slice_positions of the signal, needed for 2D maps.
+    """
+    names = _files(out_dirs[0])
+    if any(_files(d) != names for d in out_dirs[1:]):
+        raise FanoutError("slice groups wrote different files")
+    for name in names:
+        sources = [Path(d) / name for d in out_dirs]
+        target = Path(out_dir) / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        lower = name.name.lower()
+        if lower == "info.json":
+            _merge_info(sources, target, groups)
+        elif lower.endswith(NIFTI_SUFFIXES):
+            _merge_nifti(sources, target, groups, slices)
+        elif lower.endswith(".mat"):
+            _merge_mat(sources, target)
+        elif all(filecmp.cmp(sources[0], s, shallow=False) for s in sources[1:]):
+            shutil.copyfile(sources[0], target)
+        else:
+            raise FanoutError(f"no way to merge {name}")
+
+
+def _merge_info(sources, target, groups):
+    infos = []
+    for path in sources:
+        with open(path) as f:
+            infos.append(json.load(f))
+    merged = infos[0]
+    log = (merged.get("headers") or {}).get("log")
+    if isinstance(log, list):
+        for info in infos[1:]:
+            log.extend((info.get("headers") or {}).get("log") or [])
+    merged["slice_groups"] = groups
+    with open(target, "w") as f:
+        json.dump(merged, f)
+
+
+def _slice_axis(slices):
+    """Unit vector from one slice centre to the next and their distance."""
+    import numpy as np
+
+    if not slices or len(slices) < 2:
+        raise FanoutError("no slice positions to place 2D maps in 3D")
+    step = np.subtract(slices[1]["position"], slices[0]["position"])
+    spacing = float(np.linalg.norm(step))
+    if spacing == 0.0:
+        raise FanoutError("slices 0 and 1 have the same position")
+    return step / spacing, spacing
+
+
+def _volume_geometry(image, index, slices):
+    """
+    Origin, spacing and direction of the 2D map of slice `index` as a one-slice
+    volume: the map's in-plane axes made orthogonal to the slice axis, and its
+    origin moved along that axis to the slice centre.
+    """
+    import numpy as np
+
+    axis, spacing = _slice_axis(slices)
+    if abs(float(np.dot(axis, slices[index]["normal"]))) < 0.5:
+        raise FanoutError("slice centres are not stacked along the slice normal")
+    d = image.GetDirection()
+    # a map axis along the slice axis (e.g. sagittal slices) is replaced by a patient axis
+    candidates = (np.array([d[0], d[2], 0.0]), np.array([d[1], d[3], 0.0]), *np.eye(3))
+    columns = []
+    for column in candidates:
+        for previous in [axis, *columns]:
+            column = column - np.dot(column, previous) * previous
+        norm = np.linalg.norm(column)
+        if norm > 1e-6:
+            columns.append(column / norm)
+        if len(columns) == 2:
+            break
+    columns.append(axis)
+    origin = np.array([*image.GetOrigin(), 0.0])
+    origin += (np.dot(slices[index]["position"], axis) - np.dot(origin, axis)) * axis
+    direction = np.stack(columns, axis=1)
+    return (
+        tuple(float(c) for c in origin),
+        (*image.GetSpacing(), spacing),
+        tuple(float(c) for c in direction.ravel()),
+    )
+
+
+def _merge_nifti(sources, target, groups, slices):
+    import numpy as np
+    import SimpleITK as sitk
+
+    images = [sitk.ReadImage(str(p)) for p in sources]
+    vector = images[0].GetNumberOfComponentsPerPixel() > 1
+    arrays, geometries = [], []
+    for image, group in zip(images, groups):
+        array = sitk.GetArrayFromImage(image)
+        if image.GetDimension() == 2:
+            # single-slice groups may come back as 2D images
+            arrays.append(array[None, ...])
+            geometries.append(_volume_geometry(image, group[0], slices))
+        else:
+            arrays.append(array)
+            geometries.append((image.GetOrigin(), image.GetSpacing(), image.GetDirection()))
+    dims = {len(g[0]) for g in geometries}
+    if len(dims) > 1:
+        raise FanoutError(f"slice groups wrote {Path(target).name} with different dimensions")
+    # array axes are the image axes reversed, so the slice axis (z) is dim - 3
+    merged = sitk.GetImageFromArray(np.concatenate(arrays, axis=dims.pop() - 3), isVector=vector)
+    origin, spacing, direction = geometries[0]
+    merged.SetOrigin(origin)
+    merged.SetSpacing(spacing)
+    merged.SetDirection(direction)
+    sitk.WriteImage(merged, str(target))
+
+
+def _merge_mat(sources, target):
+    import numpy as np
+    from scipy.io import loadmat, savemat
+
+    mats = [loadmat(str(p)) for p in sources]
+    merged = {}
+    for name, value in mats[0].items():
+        if name.startswith("__"):
+            continue
+        values = [m[name] for m in mats]
+        if all(np.array_equal(value, v) for v in values[1:]):
+            # per-job data such as the noise covariance
+            merged[name] = value
+        elif max(v.ndim for v in values) >= 3:
+            # a single-slice group's map may come back without its slice axis
+            merged[name] = np.concatenate([v[:, :, None] if v.ndim == 2 else v for v in values], axis=2)
+        elif value.ndim == 2:
+            merged[name] = np.stack(values, axis=2)
+        else:
+            raise FanoutError(f"no way to merge {name} of {Path(target).name}")
+    savemat(str(target), merged, do_compression=True)
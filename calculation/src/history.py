@@ -0,0 +1,269 @@
+"""
+Append-only performance history of finished jobs.
+
+`do_process` adds one row per job to a SQLite database. The default,
+`<tmp>/mro-history.sqlite`, lives and dies with the container, which is enough
+for the jobs of one worker; to keep history across containers set MROHISTORYDB
+to a file on a mounted volume (EFS, a bind-mounted host directory). Rows are
+never updated, so several workers can share a database file; the default
+rollback journal is kept because WAL needs shared memory that network
+filesystems do not provide. The command line answers capacity questions from
+it:
+
+    python history.py summary --by pipeline --metric compute
+    python history.py regressions --by image --metric total_seconds
+    python history.py tail -n 20
+
+A "pipeline" is the task name and reconstructor (e.g. `pmr/sense`); "image" is
+the image URI the job ran from.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    pipeline_id TEXT,
+    task TEXT,
+    reconstructor TEXT,
+    status TEXT,
+    platform TEXT,
+    image_uri TEXT,
+    engine TEXT,
+    input_bytes INTEGER,
+    input_sizes TEXT,
+    dims TEXT,
+    total_seconds REAL,
+    stages TEXT,
+    peak_rss_bytes INTEGER,
+    peak_disk_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_pipeline ON jobs (task, reconstructor, recorded_at);
+CREATE INDEX IF NOT EXISTS jobs_image ON jobs (image_uri, recorded_at);
+"""
+
+COLUMNS = (
+    "job_id", "recorded_at", "pipeline_id", "task", "reconstructor", "status", "platform",
+    "image_uri", "engine", "input_bytes", "input_sizes", "dims", "total_seconds", "stages",
+    "peak_rss_bytes", "peak_disk_bytes",
+)
+# metrics that are columns; anything else is looked up as a stage name
+ROW_METRICS = ("total_seconds", "peak_rss_bytes", "peak_disk_bytes", "input_bytes")
+GROUPS = {
+    "pipeline": lambda r: f"{r['task']}/{r['reconstructor']}",
+    "image": lambda r: r["image_uri"] or "unknown",
+    "platform": lambda r: r["platform"] or "unknown",
+    "task": lambda r: r["task"],
+}
+
+
+_warned = False
+
+
+def enabled():
+    return os.getenv("MROHISTORY", "true").lower() in ("true", "1", "yes")
+
+
+def default_path():
+    return os.getenv("MROHISTORYDB") or os.path.join(tempfile.gettempdir(), "mro-history.sqlite")
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or default_path(), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def job_row(tracer, status, task_info=None, probes=None, identity=None, engine=None,
+            peak_rss_bytes=None, peak_disk_bytes=None, dims=None):
+    """Build the row of one job from what do_process has at hand."""
+    task_info = task_info or {}
+    task_opts = task_info.get("options") or {}
+    recon = task_opts.get("reconstructor") or {}
+    sizes = {name: p.get("size") for name, p in (probes or {}).items()}
+    timings = tracer.to_dict()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "recorded_at": time.time(),
+        "pipeline_id": tracer.properties.get("pipelineid"),
+        "task": task_info.get("name"),
+        "reconstructor": recon.get("name") or (recon.get("options") or {}).get("name"),
+        "status": status,
+        "platform": (identity or {}).get("platform"),
+        "image_uri": (identity or {}).get("image_uri"),
+        "engine": engine,
+        "input_bytes": sum(s for s in sizes.values() if s) or None,
+        "input_sizes": json.dumps(sizes),
+        "dims": json.dumps(dims or {"NR": recon.get("NR"), "slices": task_opts.get("slices")}),
+        "total_seconds": timings["total_seconds"],
+        "stages": json.dumps({name: s["seconds"] for name, s in timings["stages"].items()}),
+        "peak_rss_bytes": peak_rss_bytes,
+        "peak_disk_bytes": peak_disk_bytes,
+    }
+
+
+def record(row, path=None):
+    """Append `row`; history is best effort, so failures are reported and swallowed."""
+    global _warned
+    if path is None and not os.getenv("MROHISTORYDB") and not _warned:
+        _warned = True
+        print(f"job history goes to {default_path()} and ends with this container; set MROHISTORYDB to keep it")
+    try:
+        with closing(connect(path)) as conn, conn:
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [row.get(c) for c in COLUMNS],
+            )
+        return True
+    except Exception as e:
+        print(f"could not record job history: {e}")
+        return False
+
+
+def rows(path=None, since=None, status="success"):
+    with closing(connect(path)) as conn:
+        query = "SELECT * FROM jobs WHERE 1=1"
+        params = []
+        if since is not None:
+            query += " AND recorded_at >= ?"
+            params.append(since)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        return [dict(r) for r in conn.execute(query + " ORDER BY recorded_at", params)]
+
+
+def metric_value(row, metric):
+    if metric in ROW_METRICS:
+        return row[metric]
+    return json.loads(row["stages"] or "{}").get(metric)
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a non-empty list, q in [0, 100]."""
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(records, by, metric):
+    """{group: {"n", "p50", "p90", "p99", "max"}} of `metric` over `records`."""
+    groups = {}
+    for r in records:
+        value = metric_value(r, metric)
+        if value is not None:
+            groups.setdefault(GROUPS[by](r), []).append(value)
+    return {
+        group: {
+            "n": len(values),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values),
+        }
+        for group, values in sorted(groups.items())
+    }
+
+
+def regressions(records, by, metric, threshold=1.2, min_samples=3):
+    """
+    Compare, per pipeline, the median `metric` of each `by` group (e.g. image)
+    with the group seen before it. Returns the comparisons whose ratio reaches
+    `threshold`.
+    """
+    found = []
+    pipelines = {}
+    for r in records:
+        value = metric_value(r, metric)
+        if value is not None:
+            pipelines.setdefault(GROUPS["pipeline"](r), []).append((r, value))
+    for pipeline, items in sorted(pipelines.items()):
+        # groups in the order they first appeared
+        groups = {}
+        for r, value in items:
+            groups.setdefault(GROUPS[by](r), []).append(value)
+        ordered = [(g, v) for g, v in groups.items() if len(v) >= min_samples]
+        for (before, old), (after, new) in zip(ordered, ordered[1:]):
+            old_p50, new_p50 = percentile(old, 50), percentile(new, 50)
+            ratio = new_p50 / old_p50 if old_p50 else float("inf")
+            if ratio >= threshold:
+                found.append({
+                    "pipeline": pipeline,
+                    "before": before,
+                    "after": after,
+                    "before_p50": old_p50,
+                    "after_p50": new_p50,
+                    "ratio": round(ratio, 3),
+                })
+    return found
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.2f}" if value < 1e6 else f"{value:.4g}"
+    return str(value)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the MR Optimum job history")
+    parser.add_argument("--db", default=None, help=f"database file (default {default_path()})")
+    parser.add_argument("--days", type=float, help="only jobs from the last N days")
+    parser.add_argument("--status", default="success", help="job status to include ('' for all)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("summary", help="percentiles of a metric per group")
+    p.add_argument("--by", choices=sorted(GROUPS), default="pipeline")
+    p.add_argument("--metric", default="total_seconds",
+                   help=f"{', '.join(ROW_METRICS)} or a stage name (e.g. compute)")
+
+    p = sub.add_parser("regressions", help="groups whose median got worse than the previous one")
+    p.add_argument("--by", choices=sorted(GROUPS), default="image")
+    p.add_argument("--metric", default="total_seconds")
+    p.add_argument("--threshold", type=float, default=1.2)
+    p.add_argument("--min-samples", type=int, default=3)
+
+    p = sub.add_parser("tail", help="most recent jobs")
+    p.add_argument("-n", type=int, default=20)
+
+    a = parser.parse_args(argv)
+    since = time.time() - a.days * 86400 if a.days else None
+    records = rows(a.db, since=since, status=a.status or None)
+
+    if a.command == "summary":
+        print(f"{'group':<60} {'n':>5} {'p50':>12} {'p90':>12} {'p99':>12} {'max':>12}")
+        for group, s in summarize(records, a.by, a.metric).items():
+            print(f"{group:<60} {s['n']:>5} " + " ".join(f"{_format(s[k]):>12}" for k in ("p50", "p90", "p99", "max")))
+    elif a.command == "regressions":
+        found = regressions(records, a.by, a.metric, a.threshold, a.min_samples)
+        for f in found:
+            print(
+                f"{f['pipeline']}: {a.metric} p50 {_format(f['before_p50'])} -> {_format(f['after_p50'])} "
+                f"(x{f['ratio']}) from {f['before']} to {f['after']}"
+            )
+        if not found:
+            print("no regressions")
+        return 1 if found else 0
+    else:
+        for r in records[-a.n:]:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["recorded_at"]))
+            print(
+                f"{stamp} {r['task']}/{r['reconstructor']} {r['status']} {r['platform']} "
+                f"{_format(r['total_seconds'])}s rss={_format(r['peak_rss_bytes'])} {r['image_uri']}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,159 @@
+"""
+Content-addressed cache for downloaded job inputs.
+
+Warm Lambda containers (and long-lived Fargate workers) keep /tmp between
+invocations, so a resubmitted scan can be served from disk instead of being
+downloaded again. Entries are keyed by the S3 object identity
+(bucket/key/ETag) or, for presigned URLs, by the URL without its signature.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse
+
+DEFAULT_CACHE_DIR = "/tmp/mro-input-cache"
+# fraction of the cache filesystem the cache may use when no budget is configured
+DEFAULT_BUDGET_FRACTION = 0.5
+
+
+def default_max_bytes(root):
+    """Size budget of a cache at `root` when MROINPUTCACHEMAXBYTES is not set: half its disk."""
+    return int(shutil.disk_usage(root).total * DEFAULT_BUDGET_FRACTION)
+
+
+def object_identity(file_info, s3=None, etag=None):
+    """
+    Return a stable identity string for the object described by `file_info`,
+    or None if it cannot be determined (the input is then not cached).
+    `etag` may be passed when the object was already HEADed.
+    """
+    etag = etag or file_info.get("etag") or file_info.get("eTag") or file_info.get("ETag")
+    if "presigned_url" in file_info:
+        parsed = urlparse(file_info["presigned_url"])
+        # the query string only carries the signature, not the object identity
+        ident = f"url:{parsed.netloc}{parsed.path}"
+        return f"{ident}:{etag}" if etag else ident
+
+    bucket = file_info.get("bucket")
+    key = file_info.get("key")
+    if not bucket or not key:
+        return None
+    if etag is None and s3 is not None:
+        try:
+            etag = s3.meta.client.head_object(Bucket=bucket, Key=key)["ETag"]
+        except Exception:
+            return None
+    if etag is None:
+        return None
+    etag = etag.strip('"')
+    return f"s3:{bucket}/{key}:{etag}"
+
+
+class InputCache:
+    """
+    LRU file cache bounded by `max_bytes`.
+
+    Recency is tracked through file mtimes so that the order survives across
+    invocations. Entries handed out during the current job are pinned and never
+    evicted until `release()` is called.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = Path(root or os.getenv("MROINPUTCACHEDIR", DEFAULT_CACHE_DIR))
+        self.root.mkdir(parents=True, exist_ok=True)
+        if max_bytes is None:
+            max_bytes = int(os.getenv("MROINPUTCACHEMAXBYTES", "0"))
+        if not max_bytes:
+            max_bytes = default_max_bytes(self.root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pinned = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _entry_path(self, identity, suffix=""):
+        digest = hashlib.sha256(identity.encode("utf-8")).hexdigest()
+        return self.root / f"{digest}{suffix}"
+
+    def _entries(self):
+        return [p for p in self.root.iterdir() if p.is_file() and not p.name.startswith(".")]
+
+    def size(self):
+        return sum(p.stat().st_size for p in self._entries())
+
+    def contains(self, identity, suffix=""):
+        return self._entry_path(identity, suffix).exists()
+
+    def lookup(self, identity, suffix=""):
+        """Return the cached path for `identity` (and mark it recent), or None."""
+        path = self._entry_path(identity, suffix)
+        with self._lock:
+            if not path.exists():
+                self.misses += 1
+                return None
+            os.utime(path)
+            self._pinned.add(path)
+            self.hits += 1
+            return path
+
+    def insert(self, identity, src, suffix=""):
+        """
+        Move the downloaded file `src` into the cache and return its new path.
+        If the file cannot fit in the budget, `src` is returned unchanged.
+        """
+        src = Path(src)
+        nbytes = src.stat().st_size
+        if nbytes > self.max_bytes:
+            return src
+        path = self._entry_path(identity, suffix)
+        with self._lock:
+            self._evict(self.max_bytes - nbytes)
+            tmp = self.root / f".{uuid.uuid4().hex}"
+            try:
+                shutil.move(str(src), tmp)
+                os.replace(tmp, path)
+            except OSError:
+                tmp.unlink(missing_ok=True)
+                return src if src.exists() else path
+            self._pinned.add(path)
+        return path
+
+    def free_up(self, nbytes):
+        """Evict unpinned entries until `nbytes` have been released; returns bytes freed."""
+        with self._lock:
+            before = self.size()
+            self._evict(max(before - nbytes, 0))
+            return before - self.size()
+
+    def _evict(self, target_bytes):
+        entries = sorted(self._entries(), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        for p in entries:
+            if total <= target_bytes:
+                break
+            if p in self._pinned:
+                continue
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            self.evictions += 1
+
+    def release(self):
+        """Unpin every entry handed out since the last release."""
+        with self._lock:
+            self._pinned.clear()
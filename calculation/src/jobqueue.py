@@ -0,0 +1,331 @@
+"""
+Job queues with SQS semantics for the long-running worker mode.
+
+A received message stays invisible to other consumers for `visibility_timeout`
+seconds; the consumer acks it when the job is done, extends the timeout while
+it is still working, or lets it expire so another worker picks it up. After
+`max_receives` deliveries a message goes to the dead-letter queue.
+
+Backends share one duck-typed interface (send, receive, ack, extend, release,
+dead_letter) and are chosen by URL with `open_queue`:
+
+    https://sqs.<region>.amazonaws.com/<account>/<name>   Amazon SQS
+    file:///path/to/dir                                    directory on disk
+    memory://                                              in-process (tests)
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse
+
+DEFAULT_VISIBILITY_TIMEOUT = 900
+DEFAULT_MAX_RECEIVES = 3
+
+
+class Message:
+    """One delivery of a queued job event."""
+
+    def __init__(self, id, body, receipt, receive_count=1):
+        self.id = id
+        self.body = body
+        self.receipt = receipt
+        self.receive_count = receive_count
+
+    def json(self):
+        return json.loads(self.body)
+
+    def __repr__(self):
+        return f"Message({self.id!r}, receive_count={self.receive_count})"
+
+
+class SQSQueue:
+    """
+    Amazon SQS. Redelivery and dead-lettering after max receives come from the
+    queue's redrive policy; `dead_letter_url` (MROQUEUEDLQURL) is only used to
+    park jobs that failed for good, right away instead of after max receives.
+    """
+
+    def __init__(self, url, client=None, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+                 dead_letter_url=None):
+        self.url = url
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter_url = dead_letter_url
+        if client is None:
+            import clients
+
+            client = clients.sqs_client()
+        self.client = client
+
+    def send(self, body):
+        resp = self.client.send_message(QueueUrl=self.url, MessageBody=body)
+        return resp["MessageId"]
+
+    def receive(self, wait_seconds=20):
+        resp = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=min(int(wait_seconds), 20),
+            VisibilityTimeout=self.visibility_timeout,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        for m in resp.get("Messages", []):
+            count = int(m.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+            return Message(m["MessageId"], m["Body"], m["ReceiptHandle"], count)
+        return None
+
+    def ack(self, message):
+        self.client.delete_message(QueueUrl=self.url, ReceiptHandle=message.receipt)
+
+    def extend(self, message, seconds=None):
+        self.client.change_message_visibility(
+            QueueUrl=self.url,
+            ReceiptHandle=message.receipt,
+            VisibilityTimeout=self.visibility_timeout if seconds is None else seconds,
+        )
+
+    def release(self, message):
+        """Make the message visible again right away."""
+        self.extend(message, 0)
+
+    def dead_letter(self, message, reason=None, final=False):
+        """
+        Park the message in `dead_letter_url`. Without one it is left in flight
+        for the queue's redrive policy to retry and dead-letter, or deleted if
+        it is `final` (a failure that would only repeat on every delivery).
+        """
+        if not self.dead_letter_url:
+            if final:
+                self.ack(message)
+            return
+        self.client.send_message(
+            QueueUrl=self.dead_letter_url,
+            MessageBody=message.body,
+            MessageAttributes={
+                "reason": {"DataType": "String", "StringValue": (reason or "failed")[:1024]}
+            },
+        )
+        self.ack(message)
+
+
+class FileQueue:
+    """
+    Queue in a directory, safe for several worker processes on one host:
+    `ready/` holds visible messages, `inflight/` received ones (file mtime is
+    the visibility deadline) and `dead/` dead-lettered ones. Every state change
+    is an atomic rename.
+    """
+
+    def __init__(self, root, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+                 max_receives=DEFAULT_MAX_RECEIVES, poll_interval=0.5):
+        self.root = Path(root)
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self.poll_interval = poll_interval
+        for name in ("ready", "inflight", "dead"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def _dir(self, name):
+        return self.root / name
+
+    @staticmethod
+    def _read(path):
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write(path, record, visible_at=None):
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        if visible_at is not None:
+            os.utime(tmp, (visible_at, visible_at))
+        os.replace(tmp, path)
+
+    def send(self, body):
+        message_id = uuid.uuid4().hex
+        # names sort in send order
+        name = f"{time.time_ns():020d}-{message_id}.json"
+        self._write(self._dir("ready") / name, {"id": message_id, "body": body, "receive_count": 0})
+        return message_id
+
+    def _expire(self):
+        """Return expired in-flight messages to ready (or dead after max receives)."""
+        now = time.time()
+        for path in self._dir("inflight").glob("*.json"):
+            try:
+                if path.stat().st_mtime > now:
+                    continue
+                record = self._read(path)
+                target = "dead" if record["receive_count"] >= self.max_receives else "ready"
+                # drop the receipt token: <seq>-<id>.<token>.json -> <seq>-<id>.json
+                os.rename(path, self._dir(target) / f"{path.name.split('.')[0]}.json")
+            except (OSError, ValueError):
+                # another worker got there first
+                continue
+
+    def receive(self, wait_seconds=20):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            self._expire()
+            for path in sorted(self._dir("ready").glob("*.json")):
+                # a new receipt per delivery, so a stale one cannot ack a redelivery
+                inflight = self._dir("inflight") / f"{path.stem}.{uuid.uuid4().hex[:12]}.json"
+                visible_at = time.time() + self.visibility_timeout
+                try:
+                    # hidden before the move so that no worker sees it as expired
+                    os.utime(path, (visible_at, visible_at))
+                    os.rename(path, inflight)
+                except OSError:
+                    continue
+                record = self._read(inflight)
+                record["receive_count"] += 1
+                self._write(inflight, record, visible_at)
+                return Message(record["id"], record["body"], inflight.name, record["receive_count"])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def ack(self, message):
+        try:
+            (self._dir("inflight") / message.receipt).unlink()
+        except FileNotFoundError:
+            raise ValueError(f"receipt of {message!r} is no longer valid") from None
+
+    def extend(self, message, seconds=None):
+        visible_at = time.time() + (self.visibility_timeout if seconds is None else seconds)
+        os.utime(self._dir("inflight") / message.receipt, (visible_at, visible_at))
+
+    def release(self, message):
+        self.extend(message, 0)
+
+    def dead_letter(self, message, reason=None, final=False):
+        path = self._dir("inflight") / message.receipt
+        record = self._read(path)
+        record["reason"] = reason
+        self._write(self._dir("dead") / message.receipt, record)
+        path.unlink()
+
+    def dead(self):
+        """Bodies of the dead-lettered messages."""
+        return [self._read(p)["body"] for p in sorted(self._dir("dead").glob("*.json"))]
+
+
+class MemoryQueue:
+    """In-process queue with the same semantics, for tests and local runs."""
+
+    def __init__(self, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_receives=DEFAULT_MAX_RECEIVES):
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self._ready = []
+        self._inflight = {}
+        self.dead_letters = []
+        self._cond = threading.Condition()
+
+    def send(self, body):
+        message_id = uuid.uuid4().hex
+        with self._cond:
+            self._ready.append({"id": message_id, "body": body, "receive_count": 0})
+            self._cond.notify()
+        return message_id
+
+    def _expire(self):
+        now = time.monotonic()
+        for receipt, (record, visible_at) in list(self._inflight.items()):
+            if visible_at <= now:
+                del self._inflight[receipt]
+                if record["receive_count"] >= self.max_receives:
+                    self.dead_letters.append(record)
+                else:
+                    self._ready.append(record)
+
+    def receive(self, wait_seconds=20):
+        deadline = time.monotonic() + wait_seconds
+        with self._cond:
+            while True:
+                self._expire()
+                if self._ready:
+                    record = self._ready.pop(0)
+                    record["receive_count"] += 1
+                    receipt = uuid.uuid4().hex
+                    self._inflight[receipt] = (record, time.monotonic() + self.visibility_timeout)
+                    return Message(record["id"], record["body"], receipt, record["receive_count"])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # wake up for sends and for in-flight messages timing out
+                self._cond.wait(min(remaining, 0.5))
+
+    def ack(self, message):
+        with self._cond:
+            if self._inflight.pop(message.receipt, None) is None:
+                raise ValueError(f"receipt of {message!r} is no longer valid")
+
+    def extend(self, message, seconds=None):
+        with self._cond:
+            record, _ = self._inflight[message.receipt]
+            seconds = self.visibility_timeout if seconds is None else seconds
+            self._inflight[message.receipt] = (record, time.monotonic() + seconds)
+            self._cond.notify()
+
+    def release(self, message):
+        self.extend(message, 0)
+
+    def dead_letter(self, message, reason=None, final=False):
+        with self._cond:
+            record, _ = self._inflight.pop(message.receipt)
+            self.dead_letters.append(dict(record, reason=reason))
+
+
+def open_queue(url, visibility_timeout=None, max_receives=None):
+    """Queue backend for `url` (see module docstring)."""
+    visibility_timeout = visibility_timeout or int(
+        os.getenv("MROQUEUEVISIBILITY", str(DEFAULT_VISIBILITY_TIMEOUT))
+    )
+    max_receives = max_receives or int(os.getenv("MROQUEUEMAXRECEIVES", str(DEFAULT_MAX_RECEIVES)))
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return FileQueue(parsed.path, visibility_timeout, max_receives)
+    if parsed.scheme == "memory":
+        return MemoryQueue(visibility_timeout, max_receives)
+    if parsed.scheme in ("https", "http", "sqs"):
+        if parsed.scheme == "sqs":
+            url = f"https://{parsed.netloc}{parsed.path}"
+        return SQSQueue(url, visibility_timeout=visibility_timeout,
+                        dead_letter_url=os.getenv("MROQUEUEDLQURL"))
+    raise ValueError(f"unsupported queue URL: {url}")
+
+
+class Heartbeat:
+    """Keeps extending a message's visibility while its job is running."""
+
+    def __init__(self, queue, message, interval=None):
+        self.queue = queue
+        self.message = message
+        self.interval = interval or max(queue.visibility_timeout / 2, 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="queue-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.extend(self.message)
+            except Exception as e:
+                print(f"could not extend visibility of {self.message!r}: {e}")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -0,0 +1,180 @@
+"""
+Upload of the OUT folder while mrotools is still writing it.
+
+With MROLIVEUPLOAD on, a LiveUpload thread polls OUT during compute and sends
+every file that is complete (same size and mtime over two polls, untouched
+for MROLIVEUPLOADSETTLE seconds) to a per-job prefix in the results bucket,
+`<prefix><path in OUT>`, through the same StreamingUpload as the zip. After
+compute, `finish` uploads only what is new or changed since, deletes objects
+of files that left OUT (e.g. stripped artifacts), and writes
+`<prefix>_manifest.json` with one PutObject. That single write is the
+completion marker: a prefix without it is a job still running or one that
+failed.
+
+MROLIVEUPLOAD=true uploads the files and the zip as before; `only` skips the
+zip, so the job's tail after compute is the last file plus the manifest.
+Presigned result URLs name one object, so they always get the zip.
+"""
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+
+import serialization
+from upload import S3MultipartTarget, StreamingUpload
+
+MODES = ("false", "true", "only")
+MANIFEST_NAME = "_manifest.json"
+DEFAULT_INTERVAL = 2.0
+DEFAULT_SETTLE = 2.0
+DEFAULT_WORKERS = 4
+
+
+def mode():
+    value = os.getenv("MROLIVEUPLOAD", "false").lower()
+    return value if value in MODES else "false"
+
+
+def _content_type(path):
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+class LiveUpload:
+    """Mirror of an OUT folder under `bucket/prefix`, kept up to date while it is written."""
+
+    def __init__(self, out_dir, client, bucket, prefix, interval=None, settle=None, workers=None, log=print):
+        self.out_dir = Path(out_dir)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.interval = interval or float(os.getenv("MROLIVEUPLOADINTERVAL", str(DEFAULT_INTERVAL)))
+        self.settle = float(os.getenv("MROLIVEUPLOADSETTLE", str(DEFAULT_SETTLE))) if settle is None else settle
+        self.log = log
+        self.manifest_key = prefix + MANIFEST_NAME
+        self.finished = False
+        # path in OUT -> (size, mtime_ns) of the version in the bucket
+        self.uploaded = {}
+        # path in OUT -> ((size, mtime_ns), future) of uploads in flight
+        self._inflight = {}
+        # path in OUT -> (size, mtime_ns) at the previous poll
+        self._seen = {}
+        # paths with an object in the bucket, whatever its version
+        self._written = set()
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("MROLIVEUPLOADWORKERS", str(DEFAULT_WORKERS))),
+            thread_name_prefix="live-upload",
+        )
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="live-upload-watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.scan()
+            except Exception as e:
+                self.log(f"live upload scan failed: {e}")
+
+    def _files(self):
+        files = {}
+        for path in self.out_dir.rglob("*"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                files[path.relative_to(self.out_dir).as_posix()] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def _collect(self):
+        for rel, (sig, future) in list(self._inflight.items()):
+            if not future.done():
+                continue
+            del self._inflight[rel]
+            if future.exception() is not None:
+                self.log(f"live upload of {rel} failed, retrying later: {future.exception()}")
+            elif future.result():
+                self.uploaded[rel] = sig
+
+    def scan(self, final=False):
+        """Upload the files that are complete and not in the bucket yet; `final` takes every file as is."""
+        self._collect()
+        now = time.time_ns()
+        files = self._files()
+        for rel, sig in files.items():
+            # a file going up is looked at again once it is done, so versions never race
+            if self.uploaded.get(rel) == sig or rel in self._inflight:
+                continue
+            stable = self._seen.get(rel) == sig and now - sig[1] >= self.settle * 1e9
+            if final or stable:
+                self._inflight[rel] = (sig, self._pool.submit(self._upload, rel, sig))
+        self._seen = files
+        return files
+
+    def _upload(self, rel, sig):
+        path = self.out_dir / rel
+        target = S3MultipartTarget(self.client, self.bucket, self.prefix + rel, _content_type(path))
+        with open(path, "rb") as f, StreamingUpload.planned(target, sig[0]) as stream:
+            shutil.copyfileobj(f, stream, 1024 * 1024)
+        self._written.add(rel)
+        st = path.stat()
+        # rewritten while it was going up: the next scan sends it again
+        return (st.st_size, st.st_mtime_ns) == sig
+
+    def _stop_watching(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def finish(self):
+        """Upload what is left, drop objects of files no longer in OUT and write the manifest; returns it."""
+        self._stop_watching()
+        wait([future for _, future in self._inflight.values()])
+        self._collect()
+        live = dict(self.uploaded)
+        files = self.scan(final=True)
+        self._pool.shutdown(wait=True)
+        self._collect()
+        missing = [rel for rel, sig in files.items() if self.uploaded.get(rel) != sig]
+        if missing:
+            raise RuntimeError(f"live upload could not upload {', '.join(missing)}")
+        for rel in sorted(self._written - set(files)):
+            self.client.delete_object(Bucket=self.bucket, Key=self.prefix + rel)
+            self._written.discard(rel)
+            self.uploaded.pop(rel, None)
+        manifest = {
+            "bucket": self.bucket,
+            "prefix": self.prefix,
+            "files": [{"path": rel, "key": self.prefix + rel, "size": files[rel][0]} for rel in sorted(files)],
+            "bytes": sum(size for size, _ in files.values()),
+            # uploaded during compute, before finish was called
+            "uploaded_live": sorted(rel for rel, sig in live.items() if files.get(rel) == sig),
+        }
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.manifest_key,
+            Body=serialization.dumps(manifest).encode(),
+            ContentType="application/json",
+        )
+        self.finished = True
+        return manifest
+
+    def abort(self):
+        """Stop and remove what was uploaded, so that no partial result is left under the prefix."""
+        self._stop_watching()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._collect()
+        for rel in sorted(self._written):
+            try:
+                self.client.delete_object(Bucket=self.bucket, Key=self.prefix + rel)
+            except Exception as e:
+                self.log(f"could not delete s3://{self.bucket}/{self.prefix}{rel}: {e}")
+        self._written.clear()
+        self.uploaded.clear()
+        self.finished = True
@@ -0,0 +1,210 @@
+"""
+Several jobs at once in one container.
+
+Most SNR jobs run single-threaded, so a 4 vCPU Fargate task running one
+`do_process` at a time leaves most of its cores idle. MultiJobExecutor runs up to
+N jobs in a pool of worker processes. Each worker gets:
+
+- its own slice of the CPUs (sched_setaffinity) and a matching BLAS/OpenMP
+  thread limit, so concurrent jobs do not oversubscribe the cores;
+- its own scratch base directory and input cache, so workspaces and cache
+  eviction of one worker never touch another's files. The caches split one
+  budget (MROINPUTCACHEMAXBYTES, default half the disk) evenly between them.
+
+A job is only started when its memory estimate fits next to the jobs already
+running; a job bigger than the whole budget runs alone. Jobs themselves are
+unchanged: the same do_process runs in the worker.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from inputcache import default_max_bytes
+from resources import BLAS_THREAD_VARS, available_memory, effective_cpus
+
+MB = 1024 * 1024
+# used when a job carries no prediction and none can be made
+DEFAULT_JOB_MEMORY_MB = 2048
+# share of the free memory jobs may reserve
+MEMORY_SHARE = 0.9
+
+
+def partition_cpus(cpus, workers):
+    """Split `cpus` into `workers` contiguous, near-equal sets (shared round-robin if too few)."""
+    cpus = sorted(cpus)
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    size, extra = divmod(len(cpus), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+def estimate_job_memory_mb(event):
+    """
+    Peak memory of a job in MB: the platform selector's prediction if the state
+    machine attached one (`event["platform"]`), otherwise a fresh prediction.
+    """
+    prediction = (event.get("platform") or {}).get("prediction") if isinstance(event, dict) else None
+    if prediction and prediction.get("peak_memory_mb"):
+        return prediction["peak_memory_mb"]
+    try:
+        from platform_selector import S3ObjectStore, job_features, load_job, predict
+
+        store = S3ObjectStore()
+        prediction = predict(job_features(load_job(event, store), store))
+    except Exception as e:
+        print(f"could not estimate job memory: {e}")
+        prediction = None
+    if prediction:
+        return prediction["peak_memory_mb"]
+    return int(os.getenv("MROJOBMEMORYMB", str(DEFAULT_JOB_MEMORY_MB)))
+
+
+def _init_worker(slots, base_dir, cache_bytes):
+    slot, cpus = slots.get()
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (AttributeError, OSError) as e:
+        print(f"worker {slot}: could not pin to CPUs {cpus}: {e}")
+    worker_dir = Path(base_dir) / f"mro-worker-{slot}"
+    worker_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["MROWORKDIR"] = str(worker_dir)
+    os.environ["MROINPUTCACHEDIR"] = str(worker_dir / "input-cache")
+    os.environ["MROINPUTCACHEMAXBYTES"] = str(cache_bytes)
+    try:
+        # covers BLAS libraries already loaded when the main module was re-imported
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(len(cpus))
+    except ImportError:
+        pass
+    print(f"worker {slot} (pid {os.getpid()}) on CPUs {cpus}, scratch in {worker_dir}")
+
+
+def _run_job(event):
+    import app
+
+    return app.do_process(event, context=None)
+
+
+class MultiJobExecutor:
+    """
+    Process pool running up to `workers` jobs (default MROJOBWORKERS, else one
+    per granted CPU) within `memory_budget_mb` (default MROJOBMEMORYBUDGETMB,
+    else 90% of the free memory). `submit` blocks until the job is admitted.
+    """
+
+    def __init__(self, workers=None, memory_budget_mb=None, estimate=estimate_job_memory_mb,
+                 base_dir=None, log=print):
+        cpus = sorted(os.sched_getaffinity(0))
+        # the cgroup quota may grant fewer CPUs than the affinity mask lists
+        granted = min(effective_cpus(), len(cpus))
+        self.workers = workers or int(os.getenv("MROJOBWORKERS", "0")) or granted
+        self.cpu_sets = partition_cpus(cpus, self.workers)
+        if memory_budget_mb is None:
+            memory_budget_mb = int(os.getenv("MROJOBMEMORYBUDGETMB", "0")) or None
+        if memory_budget_mb is None:
+            memory_budget_mb = int((available_memory() or 4096 * MB) * MEMORY_SHARE / MB)
+        self.memory_budget_mb = memory_budget_mb
+        self.estimate = estimate
+        self.log = log
+        self.running = 0
+        self.reserved_mb = 0
+        self._cond = threading.Condition()
+
+        # the variables are read when BLAS loads, so they must be in place
+        # before the workers start; explicit user settings win
+        threads = max(1, granted // self.workers)
+        for var in BLAS_THREAD_VARS:
+            os.environ.setdefault(var, str(threads))
+
+        self.base_dir = Path(base_dir or os.getenv("MROWORKDIR") or tempfile.gettempdir())
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        # the workers' caches share one disk, so they share one budget
+        cache_total = int(os.getenv("MROINPUTCACHEMAXBYTES", "0")) or default_max_bytes(self.base_dir)
+        self.cache_bytes = max(1, cache_total // self.workers)
+        self._pool = self._start_pool()
+        log(
+            f"running up to {self.workers} jobs at once, {threads} thread(s) each, "
+            f"within {self.memory_budget_mb} MB"
+        )
+
+    def _start_pool(self):
+        # spawn, not fork: workers must not inherit the dispatcher's threads and locks
+        ctx = multiprocessing.get_context("spawn")
+        slots = ctx.Queue()
+        for slot, cpu_set in enumerate(self.cpu_sets):
+            slots.put((slot, cpu_set))
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(slots, str(self.base_dir), self.cache_bytes),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def _fits(self, memory_mb):
+        if self.running >= self.workers:
+            return False
+        # a job larger than the budget still runs, just alone
+        return self.running == 0 or self.reserved_mb + memory_mb <= self.memory_budget_mb
+
+    def wait_for_slot(self, timeout=None):
+        """Block until a worker is free; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.running < self.workers, timeout)
+
+    def wait_idle(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.running == 0, timeout)
+
+    def submit(self, event, memory_mb=None):
+        """Start `event` once it fits; returns a Future of do_process's result."""
+        if memory_mb is None:
+            memory_mb = self.estimate(event)
+        with self._cond:
+            if not self._fits(memory_mb):
+                self.log(
+                    f"job needs ~{memory_mb} MB, waiting ({self.reserved_mb} of "
+                    f"{self.memory_budget_mb} MB reserved by {self.running} running job(s))"
+                )
+            self._cond.wait_for(lambda: self._fits(memory_mb))
+            self.running += 1
+            self.reserved_mb += memory_mb
+        try:
+            try:
+                future = self._pool.submit(_run_job, event)
+            except BrokenProcessPool:
+                # a worker died (e.g. OOM-killed); its jobs have failed, start over
+                self.log("worker pool broken, restarting it")
+                self._pool.shutdown(wait=False)
+                self._pool = self._start_pool()
+                future = self._pool.submit(_run_job, event)
+        except BaseException:
+            self._release(memory_mb)
+            raise
+        future.add_done_callback(lambda f: self._release(memory_mb))
+        return future
+
+    def _release(self, memory_mb):
+        with self._cond:
+            self.running -= 1
+            self.reserved_mb -= memory_mb
+            self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
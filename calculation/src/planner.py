@@ -0,0 +1,137 @@
+"""
+Memory planning of a job from the headers of its raw data.
+
+A job whose working set does not fit is SIGKILLed by the kernel in the middle
+of mrotools.snr. Before compute, `plan` reads the TWIX header of the
+downloaded signal (slices), and estimates the peak memory of the job run
+whole and of one slice with the platform selector's model
+(platform_selector.peak_memory_mb, the same one that sized the Fargate task).
+It picks one of:
+
+- "full": the job fits the memory available, run it as usual;
+- "sliced": only single slices fit; run one slice per mrotools process
+  (fanout), as many at once as fit. If the split or the merge fails, the job
+  fails with the plan's reason rather than running whole into an OOM kill;
+- "refuse": not even the smallest way to run it fits in the container's
+  memory limit; fail right away with the platform size the job needs.
+
+The estimates are coarse priors, so a job that does not fit what is free
+but fits the limit is not refused: it runs single slices one at a time if it
+can be split, and whole otherwise.
+"""
+import math
+import os
+
+import fanout
+import twixfile
+from platform_selector import BASE_MEMORY_MB, FARGATE_MAX_MEMORY_MB, fargate_memory_mb, peak_memory_mb, task_features
+from resources import available_memory, total_memory
+
+MB = 1024 * 1024
+# twixtools holds a bit more than the file while splitting it
+SPLIT_OVERHEAD = 1.2
+# share of the free memory a job may plan to use
+DEFAULT_HEADROOM = 0.85
+
+
+class PlanningError(Exception):
+    """The job cannot run in the memory of this container."""
+
+
+def enabled():
+    return os.getenv("MROMEMORYPLAN", "true").lower() in ("true", "1", "yes")
+
+
+def estimate(dims, signal_bytes, other_bytes, task_info, output):
+    """
+    Peak memory in MB of the job run whole (`full_mb`), of one single-slice
+    process (`slice_mb`) and of splitting the signal into slices (`split_mb`).
+    `other_bytes` are the job's inputs besides the signal (noise, ...), which
+    every slice process reads whole.
+    """
+    features = task_features(task_info, output)
+    slice_bytes = signal_bytes / max(dims["slices"], 1)
+    return {
+        "full_mb": peak_memory_mb(signal_bytes + other_bytes, features),
+        "slice_mb": peak_memory_mb(slice_bytes + other_bytes, features),
+        "split_mb": math.ceil(BASE_MEMORY_MB + signal_bytes / MB * SPLIT_OVERHEAD),
+    }
+
+
+def plan(task_info, inputs, output, max_workers=1, available_bytes=None, limit_bytes=None):
+    """
+    Execution plan for a job whose inputs are downloaded, or None without a
+    TWIX signal to read the dimensions from. `max_workers` caps the slice
+    processes run at once.
+    """
+    signal = inputs.get("signal")
+    if signal is None or not twixfile.is_twix(signal):
+        return None
+    dims = twixfile.read_dims(signal["filename"])
+    other_bytes = sum(
+        os.path.getsize(file_info["filename"])
+        for name, file_info in inputs.items()
+        if name != "signal" and file_info.get("filename") and os.path.exists(file_info["filename"])
+    )
+    peak = estimate(dims, os.path.getsize(signal["filename"]), other_bytes, task_info, output)
+
+    if available_bytes is None:
+        available_bytes = available_memory()
+    if limit_bytes is None:
+        limit_bytes = total_memory()
+    if available_bytes is None:
+        return None
+    budget_mb = int(available_bytes / MB * float(os.getenv("MROMEMORYHEADROOM", str(DEFAULT_HEADROOM))))
+    result = {"dims": dims, "peak": peak, "budget_mb": budget_mb, "workers": 1}
+
+    if peak["full_mb"] <= budget_mb:
+        return dict(result, mode="full", reason=f"needs ~{peak['full_mb']} MB of {budget_mb} MB")
+    try:
+        fanout.plan(task_info, inputs, dims)
+        splittable = True
+    except fanout.FanoutError:
+        splittable = False
+    sliced_mb = max(peak["slice_mb"], peak["split_mb"])
+    if splittable and sliced_mb <= budget_mb:
+        workers = max(1, min(max_workers, budget_mb // peak["slice_mb"]))
+        return dict(
+            result,
+            mode="sliced",
+            workers=workers,
+            reason=(
+                f"needs ~{peak['full_mb']} MB whole but only {budget_mb} MB is available; "
+                f"running single slices of ~{peak['slice_mb']} MB, {workers} at a time"
+            ),
+        )
+    smallest_mb = min(peak["full_mb"], sliced_mb) if splittable else peak["full_mb"]
+    limit_mb = int(limit_bytes / MB) if limit_bytes else None
+    if limit_mb is None or smallest_mb <= limit_mb:
+        # the estimate may be off and the free memory grows as caches are dropped: try
+        if splittable and sliced_mb < peak["full_mb"]:
+            return dict(
+                result,
+                mode="sliced",
+                reason=(
+                    f"needs ~{peak['full_mb']} MB whole and ~{peak['slice_mb']} MB per slice, "
+                    f"more than the {budget_mb} MB available; running single slices one at a time"
+                ),
+            )
+        return dict(
+            result,
+            mode="full",
+            reason=f"needs ~{peak['full_mb']} MB, more than the {budget_mb} MB available; running it whole anyway",
+        )
+    recommended = fargate_memory_mb(peak["full_mb"])
+    if peak["full_mb"] > FARGATE_MAX_MEMORY_MB:
+        advice = f"more than the largest Fargate task ({FARGATE_MAX_MEMORY_MB} MB)"
+    else:
+        advice = f"a Fargate task with at least {recommended} MB"
+    return dict(
+        result,
+        mode="refuse",
+        recommended_mb=recommended,
+        reason=(
+            f"job needs at least ~{smallest_mb} MB of memory but this container is limited to "
+            f"{limit_mb} MB; it needs {advice}"
+        ),
+    )
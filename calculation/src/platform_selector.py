@@ -0,0 +1,371 @@
+"""
+Lambda vs Fargate routing for a job, based on what the job will cost to run.
+
+The Step Functions `SelectPlatform` state calls `lambda_handler` with the same
+event the job receives. Input sizes are read with HEAD requests (no data is
+downloaded) and combined with the reconstructor, NR, slice count and requested
+outputs into a predicted runtime, peak memory and scratch usage. The job goes to
+Lambda when that prediction fits the function's memory, timeout and ephemeral
+storage with some headroom, and Fargate is not cheaper (or faster, with
+MROPLATFORMPOLICY=latency); otherwise it goes to Fargate with a recommended task
+memory size.
+
+`lambda_handler` returns only the decision and the predicted peak memory
+(`state_output`): the state machine passes its result on to the Fargate task
+as a container override, which ECS caps at 8 KB.
+
+The coefficients below are deliberately coarse priors; object access goes through
+a small store interface so the selector can be exercised offline against
+`LocalObjectStore`.
+"""
+import json
+import math
+import os
+from pathlib import Path
+from urllib.parse import urlparse
+
+# deployment limits of RunJobLambda / RunJobTaskDefinition (see template.yaml)
+LAMBDA_MEMORY_MB = int(os.getenv("MROLAMBDAMEMORYMB", "4096"))
+LAMBDA_TIMEOUT_S = int(os.getenv("MROLAMBDATIMEOUT", "900"))
+LAMBDA_STORAGE_MB = int(os.getenv("MROLAMBDASTORAGEMB", "4096"))
+# Fargate memory sizes allowed for a 4 vCPU task
+FARGATE_MIN_MEMORY_MB = 8192
+# smallest size the selector asks for: the task definition's 16 GB until the
+# memory model has been checked against real jobs
+FARGATE_FLOOR_MB = max(int(os.getenv("MROFARGATEMINMEMORYMB", "16384")), FARGATE_MIN_MEMORY_MB)
+FARGATE_MAX_MEMORY_MB = 30720
+FARGATE_VCPU = 4
+# provisioning + image pull before a Fargate task starts working
+FARGATE_STARTUP_S = 60
+# a 4096 MB Lambda gets ~2.3 vCPUs; the Fargate task has 4
+FARGATE_SPEEDUP = 1.5
+# prices in USD (us-east-1, x86)
+LAMBDA_GB_SECOND = 0.0000166667
+FARGATE_VCPU_HOUR = 0.04048
+FARGATE_GB_HOUR = 0.004445
+
+# prediction must fit the limits with this much headroom
+SAFETY = 1.3
+MB = 1024 * 1024
+# interpreter + numpy/scipy/SimpleITK/twixtools before any data is loaded
+BASE_MEMORY_MB = 700
+# job startup, downloads and archive upload not proportional to compute
+BASE_RUNTIME_S = 20
+
+# reconstructor -> (peak memory as a multiple of the raw data size, compute seconds per GB per reconstruction)
+RECONSTRUCTORS = {
+    "rss": (4, 20),
+    "b1": (6, 40),
+    "sense": (10, 90),
+    "grappa": (10, 150),
+}
+DEFAULT_RECONSTRUCTOR = (8, 90)
+# ESPIRiT coil maps dominate the runtime of whatever reconstructor uses them
+ESPIRIT_MEMORY = 4
+ESPIRIT_RUNTIME = 6
+# pseudo multiple replica / multiple replica defaults of mrotools
+DEFAULT_NR = {"pmr": 20, "cr": 20, "mr": 1}
+# every replica keeps a reconstructed image around (small next to the raw data)
+REPLICA_MEMORY_SHARE = 0.05
+PER_SLICE_S = 2
+# tasks the old name-based rule sent to Fargate; used when input sizes are unknown
+FARGATE_TASKS = ("pmr", "mr")
+
+
+class S3ObjectStore:
+    """Object sizes and event JSON from S3 / presigned URLs."""
+
+    def __init__(self, client=None, session=None):
+        self._client = client
+        self._session = session
+
+    @property
+    def client(self):
+        if self._client is None:
+            import clients
+
+            self._client = clients.s3_resource().meta.client
+        return self._client
+
+    def size(self, file_info):
+        if "presigned_url" in file_info:
+            import clients
+            from transfer import probe_url
+
+            size, _ = probe_url(file_info["presigned_url"], self._session or clients.http_session())
+            return size
+        head = self.client.head_object(Bucket=file_info["bucket"], Key=file_info["key"])
+        return head.get("ContentLength")
+
+    def read_json(self, bucket, key):
+        body = self.client.get_object(Bucket=bucket, Key=key)["Body"]
+        return json.loads(body.read())
+
+
+class LocalObjectStore:
+    """
+    Stand-in for S3 backed by a directory: `bucket/key` lives at `root/bucket/key`
+    and a presigned URL at `root/<url path>`.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, file_info):
+        if "presigned_url" in file_info:
+            return self.root / urlparse(file_info["presigned_url"]).path.lstrip("/")
+        return self.root / file_info["bucket"] / file_info["key"]
+
+    def size(self, file_info):
+        path = self._path(file_info)
+        return path.stat().st_size if path.exists() else None
+
+    def read_json(self, bucket, key):
+        with open(self.root / bucket / key) as f:
+            return json.load(f)
+
+
+def _input_files(node):
+    """Yield the options of every S3 file entry anywhere under `node`."""
+    if isinstance(node, dict):
+        opts = node.get("options")
+        if node.get("type") == "file" and isinstance(opts, dict) and opts.get("type") == "s3":
+            yield opts
+            return
+        for value in node.values():
+            yield from _input_files(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _input_files(value)
+
+
+def _mask_method(recon_opts):
+    mask = recon_opts.get("mask")
+    if mask is None:
+        mask = ((recon_opts.get("sensitivityMap") or {}).get("options") or {}).get("mask")
+    method = mask.get("method") if isinstance(mask, dict) else None
+    return method.lower() if isinstance(method, str) else None
+
+
+def _slice_count(task_opts):
+    slices = task_opts.get("slices")
+    if isinstance(slices, list):
+        return len(slices)
+    if isinstance(slices, int):
+        return slices
+    return None
+
+
+def task_features(task, output):
+    """The model's inputs that come from the task and output sections alone (no input sizes)."""
+    task = task or {}
+    task_opts = task.get("options") or {}
+    recon = task_opts.get("reconstructor") or {}
+    recon_opts = recon.get("options") or {}
+    output = output or {}
+    task_name = (task.get("name") or "").lower()
+    nr = recon.get("NR") or recon_opts.get("NR") or task_opts.get("NR") or DEFAULT_NR.get(task_name, 1)
+    return {
+        "task": task_name,
+        "reconstructor": (recon_opts.get("name") or recon.get("name") or "").lower(),
+        "mask": _mask_method(recon_opts),
+        "nr": int(nr),
+        "slices": _slice_count(task_opts),
+        "outputs": {k: bool(output.get(k)) for k in ("coilsensitivity", "gfactor", "matlab")},
+    }
+
+
+def job_features(job, store):
+    """Everything the model needs from the job JSON plus HEADed input sizes."""
+    task = job.get("task") or {}
+    recon = (task.get("options") or {}).get("reconstructor") or {}
+    sizes = {}
+    for file_info in _input_files(recon):
+        name = file_info.get("filename") or file_info.get("key")
+        try:
+            sizes[name] = store.size(file_info)
+        except Exception:
+            sizes[name] = None
+    features = task_features(task, job.get("output") or task.get("output"))
+    features["input_sizes"] = sizes
+    return features
+
+
+def peak_memory_mb(input_bytes, features):
+    """
+    Predicted peak memory in MB of reconstructing `input_bytes` of raw data
+    with the job's `features`; the planner uses the same model per slice.
+    """
+    memory_factor, _ = RECONSTRUCTORS.get(features["reconstructor"], DEFAULT_RECONSTRUCTOR)
+    if features["mask"] == "espirit":
+        memory_factor += ESPIRIT_MEMORY
+    outputs = features["outputs"]
+    if outputs["coilsensitivity"]:
+        memory_factor += 1
+    if outputs["matlab"]:
+        memory_factor += 0.5
+    replicas = features["nr"] if features["task"] in ("pmr", "cr") else 1
+    memory = BASE_MEMORY_MB + input_bytes / MB * memory_factor * (1 + REPLICA_MEMORY_SHARE * replicas)
+    return math.ceil(memory)
+
+
+def predict(features):
+    """
+    Predicted {"runtime_seconds", "peak_memory_mb", "scratch_mb", "input_bytes"}
+    of a job on a 4096 MB Lambda, or None if an input size is unknown.
+    """
+    sizes = features["input_sizes"]
+    if not sizes or any(s is None for s in sizes.values()):
+        return None
+    input_bytes = sum(sizes.values())
+    data_gb = input_bytes / 1024**3
+
+    _, seconds_per_gb = RECONSTRUCTORS.get(features["reconstructor"], DEFAULT_RECONSTRUCTOR)
+    if features["mask"] == "espirit":
+        seconds_per_gb *= ESPIRIT_RUNTIME
+    # g-factor needs an extra pass over the unaccelerated reconstruction
+    gfactor = 1.5 if features["outputs"]["gfactor"] and features["reconstructor"] in ("sense", "grappa") else 1
+
+    replicas = features["nr"] if features["task"] in ("pmr", "cr") else 1
+    runtime = BASE_RUNTIME_S + data_gb * seconds_per_gb * replicas * gfactor
+    runtime += PER_SLICE_S * (features["slices"] or 1)
+    # inputs plus OUT, which is about as large as what was read
+    scratch = 2 * input_bytes / MB
+    return {
+        "runtime_seconds": round(runtime, 1),
+        "peak_memory_mb": peak_memory_mb(input_bytes, features),
+        "scratch_mb": math.ceil(scratch),
+        "input_bytes": input_bytes,
+    }
+
+
+def fargate_memory_mb(peak_memory_mb):
+    memory = math.ceil(peak_memory_mb * SAFETY / 1024) * 1024
+    return min(max(memory, FARGATE_FLOOR_MB), FARGATE_MAX_MEMORY_MB)
+
+
+def costs(prediction):
+    """Predicted (lambda, fargate) seconds and USD for `prediction`."""
+    lambda_s = prediction["runtime_seconds"]
+    fargate_s = FARGATE_STARTUP_S + lambda_s / FARGATE_SPEEDUP
+    fargate_gb = fargate_memory_mb(prediction["peak_memory_mb"]) / 1024
+    return {
+        "lambda": {
+            "seconds": round(lambda_s, 1),
+            "usd": round(LAMBDA_GB_SECOND * LAMBDA_MEMORY_MB / 1024 * lambda_s, 5),
+        },
+        "fargate": {
+            "seconds": round(fargate_s, 1),
+            "usd": round((FARGATE_VCPU * FARGATE_VCPU_HOUR + fargate_gb * FARGATE_GB_HOUR) * fargate_s / 3600, 5),
+        },
+    }
+
+
+def fits_lambda(prediction):
+    """Reasons the prediction does not fit RunJobLambda (empty if it does)."""
+    reasons = []
+    if prediction["peak_memory_mb"] * SAFETY > LAMBDA_MEMORY_MB:
+        reasons.append(f"needs ~{prediction['peak_memory_mb']} MB of memory")
+    if prediction["runtime_seconds"] * SAFETY > LAMBDA_TIMEOUT_S:
+        reasons.append(f"runs ~{prediction['runtime_seconds']:.0f} s")
+    if prediction["scratch_mb"] * SAFETY > LAMBDA_STORAGE_MB:
+        reasons.append(f"needs ~{prediction['scratch_mb']} MB of scratch space")
+    return reasons
+
+
+def select_platform(job, store=None, policy=None):
+    """
+    Decide where `job` runs. Returns the dict stored at `$.platform` by the state
+    machine: {"useFargate", "platform", "memoryMB", "fargateMemory", "reason", ...}.
+    """
+    store = store or S3ObjectStore()
+    policy = (policy or os.getenv("MROPLATFORMPOLICY") or "cost").lower()
+    features = job_features(job, store)
+    prediction = predict(features)
+
+    if prediction is None:
+        # sizes unknown (e.g. no HEAD permission): fall back to the name/mask rule
+        use_fargate = features["task"] in FARGATE_TASKS or features["mask"] == "espirit"
+        return {
+            "useFargate": use_fargate,
+            "platform": "fargate" if use_fargate else "lambda",
+            "memoryMB": FARGATE_FLOOR_MB if use_fargate else LAMBDA_MEMORY_MB,
+            "fargateMemory": str(FARGATE_FLOOR_MB),
+            "reason": "input sizes unknown, routed by task name",
+            "features": features,
+        }
+
+    estimates = costs(prediction)
+    too_big = fits_lambda(prediction)
+    if too_big:
+        use_fargate = True
+        reason = "does not fit Lambda: " + ", ".join(too_big)
+    else:
+        key = "seconds" if policy == "latency" else "usd"
+        use_fargate = estimates["fargate"][key] < estimates["lambda"][key]
+        reason = f"{'fargate' if use_fargate else 'lambda'} is {'faster' if key == 'seconds' else 'cheaper'}"
+
+    fargate_memory = fargate_memory_mb(prediction["peak_memory_mb"])
+    if use_fargate and prediction["peak_memory_mb"] * SAFETY > FARGATE_MAX_MEMORY_MB:
+        reason += f"; predicted memory exceeds the largest Fargate size ({FARGATE_MAX_MEMORY_MB} MB)"
+    lambda_memory = max(1024, math.ceil(prediction["peak_memory_mb"] * SAFETY / 64) * 64)
+    return {
+        "useFargate": use_fargate,
+        "platform": "fargate" if use_fargate else "lambda",
+        "memoryMB": fargate_memory if use_fargate else lambda_memory,
+        # ECS task overrides take the memory as a string
+        "fargateMemory": str(fargate_memory),
+        "reason": reason,
+        "prediction": prediction,
+        "estimates": estimates,
+        "features": features,
+    }
+
+
+def load_job(event, store):
+    """The job JSON for a Step Functions input (S3 notification or direct payload)."""
+    records = event.get("Records") if isinstance(event, dict) else None
+    if records and "s3" in records[0]:
+        s3_info = records[0]["s3"]
+        return store.read_json(s3_info["bucket"]["name"], s3_info["object"]["key"])
+    return event
+
+
+def state_output(decision):
+    """
+    The part of a decision the state machine carries on under `$.platform`.
+    The whole state becomes the FILE_EVENT container override of the Fargate
+    task, and ECS caps overrides at 8 KB, so features and estimates stay in
+    the log; the job only reads the predicted peak memory.
+    """
+    output = {k: decision[k] for k in ("useFargate", "platform", "memoryMB", "fargateMemory", "reason") if k in decision}
+    peak = (decision.get("prediction") or {}).get("peak_memory_mb")
+    if peak is not None:
+        output["prediction"] = {"peak_memory_mb": peak}
+    return output
+
+
+def lambda_handler(event, context=None, store=None):
+    store = store or S3ObjectStore()
+    try:
+        job = load_job(event, store)
+    except Exception as e:
+        print(f"could not read the job JSON, defaulting to Lambda: {e}")
+        return {"useFargate": False, "platform": "lambda", "reason": f"job unreadable: {e}"}
+    decision = select_platform(job, store)
+    print(json.dumps({k: v for k, v in decision.items() if k != "features"}, default=str))
+    return state_output(decision)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show where a job would run")
+    parser.add_argument("job", help="job JSON file")
+    parser.add_argument("--local-root", help="resolve inputs under this directory instead of S3")
+    parser.add_argument("--policy", choices=("cost", "latency"))
+    a = parser.parse_args()
+    with open(a.job) as f:
+        job = json.load(f)
+    store = LocalObjectStore(a.local_root) if a.local_root else S3ObjectStore()
+    print(json.dumps(select_platform(job, store, a.policy), indent=2, default=str))
@@ -0,0 +1,172 @@
+"""
+Checks run on a job before any input byte is transferred.
+
+`validate` checks the job JSON against what the pipeline supports (file
+entries and where they come from, numeric options, output flags), and
+`check_inputs` looks at the HEAD results of the inputs (existence, plausible
+sizes). A job failing either is rejected with every problem found, within the
+time of a few HEAD requests instead of after a multi-GB download.
+Task and reconstructor names are left to mrotools, which may know more than
+this module: a task name outside TASKS or a reconstructor without cost priors
+in platform_selector.RECONSTRUCTORS is only logged.
+
+Set MROPREFLIGHT=false to skip both.
+"""
+import os
+
+import twixfile
+from platform_selector import RECONSTRUCTORS
+
+# task names mrotools.snr is known to compute; others are passed on with a warning
+TASKS = ("ac", "mr", "pmr", "cr")
+# output flag -> mrotools option
+OUTPUT_FLAGS = {"matlab": "matlab", "coilsensitivity": "coilsens", "gfactor": "gfactor"}
+# true/false options of the output section handled by the app itself
+OUTPUT_SWITCHES = ("chunked",)
+# options that must be positive integers wherever they appear
+POSITIVE_INTS = ("NR", "boxSize")
+# a TWIX file holds at least its header and one measurement header
+MIN_TWIX_BYTES = 16 * 1024
+
+
+class PreflightError(Exception):
+    """The job is invalid; `problems` lists everything that is wrong with it."""
+
+    def __init__(self, problems):
+        super().__init__("job rejected before download: " + "; ".join(problems))
+        self.problems = problems
+
+
+def enabled():
+    return os.getenv("MROPREFLIGHT", "true").lower() in ("true", "1", "yes")
+
+
+def output_flags(output):
+    """mrotools flags for the job's `output` section, in matlab, coilsens, gfactor order."""
+    return [
+        f"--{flag}" if output.get(key) else f"--no-{flag}" for key, flag in OUTPUT_FLAGS.items()
+    ]
+
+
+def _file_problems(where, entry):
+    if not isinstance(entry, dict) or entry.get("type") != "file":
+        return [f"{where}: not a file entry"]
+    opts = entry.get("options")
+    if not isinstance(opts, dict):
+        return [f"{where}.options: missing"]
+    problems = []
+    if not isinstance(opts.get("filename"), str) or not opts["filename"]:
+        problems.append(f"{where}.options.filename: missing")
+    if opts.get("type") == "s3":
+        if not opts.get("presigned_url") and not (opts.get("bucket") and opts.get("key")):
+            problems.append(f"{where}.options: needs bucket and key, or presigned_url")
+    elif opts.get("type") != "local":
+        problems.append(f"{where}.options.type: {opts.get('type')!r} is not s3 or local")
+    return problems
+
+
+def _options(entry):
+    opts = entry.get("options") if isinstance(entry, dict) else None
+    return opts if isinstance(opts, dict) else {}
+
+
+def _download_problems(where, entry):
+    # a local file is not on the worker: do_process only treats downloaded inputs as available
+    if _options(entry).get("type") == "local":
+        return [f"{where}.options.type: 'local' files are not available to the job, upload it to S3"]
+    return []
+
+
+def _positive_int_problems(where, options):
+    problems = []
+    for key in POSITIVE_INTS:
+        if key in options and options[key] is not None:
+            value = options[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                problems.append(f"{where}.{key}: {value!r} is not a positive integer")
+    return problems
+
+
+def validate(task_info, output, log=print):
+    """Problems with the task and output sections of a job (empty if it is valid)."""
+    if not isinstance(task_info, dict):
+        return ["task: missing"]
+    problems = []
+    name = str(task_info.get("name") or "").lower()
+    if not name:
+        problems.append("task.name: missing")
+    elif name not in TASKS:
+        log(f"task {name!r} is not one of {', '.join(TASKS)}; leaving it to mrotools")
+    task_opts = task_info.get("options")
+    recon = task_opts.get("reconstructor") if isinstance(task_opts, dict) else None
+    if not isinstance(recon, dict) or not isinstance(recon.get("options"), dict):
+        return problems + ["task.options.reconstructor.options: missing"]
+    recon_opts = recon["options"]
+    recon_name = str(recon.get("name") or recon_opts.get("name") or "").lower()
+    if not recon_name:
+        problems.append("reconstructor.name: missing")
+    elif recon_name not in RECONSTRUCTORS:
+        # RECONSTRUCTORS holds cost priors, not what mrotools accepts
+        log(f"reconstructor {recon_name!r} has no cost priors; the platform selector sizes it with the defaults")
+    problems += _positive_int_problems("task.options", task_opts)
+    problems += _positive_int_problems("reconstructor", recon)
+    problems += _positive_int_problems("reconstructor.options", recon_opts)
+
+    # same rules do_process applies after the download: only S3 inputs count as
+    # available, and noise is needed unless the signal is multi-RAID or the task is mr
+    if "signal" in recon_opts:
+        problems += _file_problems("signal", recon_opts["signal"])
+        problems += _download_problems("signal", recon_opts["signal"])
+    else:
+        problems.append("signal: missing")
+    signal_opts = _options(recon_opts.get("signal"))
+    multiraid = (signal_opts.get("vendor") or "").lower() == "siemens" and signal_opts.get("multiraid")
+    noise_needed = not multiraid and name != "mr"
+    if "noise" in recon_opts:
+        problems += _file_problems("noise", recon_opts["noise"])
+        if noise_needed:
+            problems += _download_problems("noise", recon_opts["noise"])
+    elif noise_needed:
+        problems.append("noise: missing (needed unless the signal is multi-RAID or the task is mr)")
+
+    sens = recon_opts.get("sensitivityMap")
+    if sens is not None:
+        sens_opts = sens.get("options") if isinstance(sens, dict) else None
+        if not isinstance(sens_opts, dict):
+            problems.append("sensitivityMap.options: missing")
+        elif sens_opts.get("loadSensitivity"):
+            problems += _file_problems(
+                "sensitivityMap.options.sensitivityMapSource", sens_opts.get("sensitivityMapSource")
+            )
+
+    for entry in task_info.get("files") or []:
+        file_name = entry.get("name") if isinstance(entry, dict) else entry
+        if isinstance(file_name, str) and file_name not in recon_opts:
+            problems.append(f"files: {file_name!r} is listed but not in the reconstructor options")
+
+    if not isinstance(output, dict):
+        problems.append("output: not an object")
+    else:
+        for key in (*OUTPUT_FLAGS, *OUTPUT_SWITCHES):
+            if output.get(key) is not None and output[key] not in (True, False):
+                problems.append(f"output.{key}: {output[key]!r} is not true or false")
+    return problems
+
+
+def check_inputs(inputs, probes):
+    """Problems with the HEAD results (app.probe_inputs) of the job's inputs."""
+    problems = []
+    for name, file_info in inputs.items():
+        probe = probes.get(name) or {}
+        # presigned URLs without their signature
+        where = (file_info.get("presigned_url") or "").split("?")[0]
+        where = where or f"s3://{file_info.get('bucket')}/{file_info.get('key')}"
+        if probe.get("error"):
+            problems.append(f"{name}: {where} is not readable ({probe['error']})")
+            continue
+        size = probe.get("size")
+        if size == 0:
+            problems.append(f"{name}: {where} is empty")
+        elif size is not None and twixfile.is_twix(file_info) and size < MIN_TWIX_BYTES:
+            problems.append(f"{name}: {where} has {size} bytes, too small for Siemens raw data")
+    return problems
@@ -0,0 +1,169 @@
+"""
+Preview pyramid of the result maps for the web viewer.
+
+With MROPREVIEWS on (off by default), after compute `write` downsamples
+every map in OUT (see chunkstore.role) in plane by block averages at each
+MROPREVIEWLEVELS factor (default 1/2, 1/4, 1/8), keeping every slice, and
+stores each level as raw little-endian C-order bytes in OUT/previews/:
+
+- uint8 (default), scaled to the map's p1-p99 window, so a thumbnail is drawn
+  without any windowing of its own;
+- or float16 values (MROPREVIEWDTYPE=float16).
+
+OUT/previews.json describes every map: its full shape, percentile stats of the
+full-resolution data, the window and the levels, coarsest first. The result
+zip starts with previews.json and previews/, so the first view needs only the
+first few kilobytes of the archive.
+
+Complex maps are shown by magnitude and multi-component maps (coil
+sensitivities) by the root sum of squares of their components.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import chunkstore
+import serialization
+
+PREVIEW_DIR = "previews"
+MANIFEST_NAME = "previews.json"
+DEFAULT_LEVELS = (2, 4, 8)
+DTYPES = {"uint8": ("<u1", "u8"), "float16": ("<f2", "f16")}
+PERCENTILES = (1, 5, 50, 95, 99)
+# the percentiles are computed from at most this many voxels
+STATS_SAMPLE = 1_000_000
+
+
+def enabled():
+    return os.getenv("MROPREVIEWS", "false").lower() in ("true", "1", "yes")
+
+
+def levels():
+    spec = os.getenv("MROPREVIEWLEVELS", "")
+    factors = [int(f) for f in spec.split(",") if f.strip()] or DEFAULT_LEVELS
+    return sorted({f for f in factors if f > 1})
+
+
+def _magnitude(array):
+    import numpy as np
+
+    if array.ndim == 4:
+        return np.sqrt(np.sum(np.abs(array) ** 2, axis=-1, dtype=np.float64)).astype(np.float32)
+    return np.abs(array).astype(np.float32) if np.iscomplexobj(array) else array.astype(np.float32)
+
+
+def downsample(array, factor):
+    """Block mean of a (slice, y, x) array over `factor` x `factor` in-plane blocks, ignoring NaN/inf."""
+    import numpy as np
+
+    z, h, w = array.shape
+    h, w = h // factor * factor, w // factor * factor
+    blocks = array[:, :h, :w].reshape(z, h // factor, factor, w // factor, factor)
+    finite = np.isfinite(blocks)
+    count = finite.sum(axis=(2, 4))
+    total = np.where(finite, blocks, 0).sum(axis=(2, 4), dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (total / count).astype(np.float32)
+
+
+def stats(array):
+    """min, max, mean and percentiles of the finite voxels of `array`, or None if there are none."""
+    import numpy as np
+
+    values = array[np.isfinite(array)]
+    if not values.size:
+        return None
+    sample = values[:: max(1, values.size // STATS_SAMPLE)]
+    return {
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "mean": float(values.mean()),
+        "percentiles": {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(sample, PERCENTILES))},
+    }
+
+
+def encode(level, window, dtype):
+    import numpy as np
+
+    if dtype == "float16":
+        return level.astype(DTYPES[dtype][0])
+    lo, hi = window
+    scaled = (level - lo) / ((hi - lo) or 1.0) * 255
+    return np.nan_to_num(np.clip(np.rint(scaled), 0, 255), nan=0).astype(DTYPES[dtype][0])
+
+
+def write(out_dir, factors=None, dtype=None):
+    """Write the preview levels of the maps in `out_dir` and their manifest; returns the manifest or None."""
+    out_dir = Path(out_dir)
+    factors = factors or levels()
+    dtype = dtype or os.getenv("MROPREVIEWDTYPE", "uint8")
+    if dtype not in DTYPES:
+        dtype = "uint8"
+    sources = chunkstore.maps(out_dir)
+    if not sources or not factors:
+        return None
+    try:
+        return _write(out_dir, sources, factors, dtype)
+    except BaseException:
+        # no half-written previews in the user's results
+        shutil.rmtree(out_dir / PREVIEW_DIR, ignore_errors=True)
+        (out_dir / MANIFEST_NAME).unlink(missing_ok=True)
+        raise
+
+
+def _write(out_dir, sources, factors, dtype):
+    preview_dir = out_dir / PREVIEW_DIR
+    preview_dir.mkdir(exist_ok=True)
+    entries = {}
+    for path in sources:
+        array, geometry = chunkstore.read_map(path)
+        array = _magnitude(array)
+        summary = stats(array)
+        if summary is None:
+            continue
+        window = [summary["percentiles"]["p1"], summary["percentiles"]["p99"]]
+        name = chunkstore.map_name(path.relative_to(out_dir))
+        entry = {
+            "role": chunkstore.role(path),
+            "source": path.relative_to(out_dir).as_posix(),
+            "shape": list(array.shape),
+            # the previews have no component axis
+            "geometry": {k: v for k, v in geometry.items() if k != "axes"},
+            "stats": summary,
+            "window": window,
+            "levels": [],
+        }
+        for factor in sorted(factors, reverse=True):
+            if min(array.shape[1:]) < factor:
+                continue
+            data = encode(downsample(array, factor), window, dtype)
+            target = preview_dir / f"{name.replace('/', '_')}.x{factor}.{DTYPES[dtype][1]}"
+            data.tofile(target)
+            entry["levels"].append(
+                {
+                    "factor": factor,
+                    "shape": list(data.shape),
+                    "file": target.relative_to(out_dir).as_posix(),
+                    "bytes": target.stat().st_size,
+                }
+            )
+        entries[name] = entry
+    if not entries:
+        return None
+    manifest = {
+        "dtype": dtype,
+        "byte_order": "little",
+        "axes": ["z", "y", "x"],
+        # uint8 levels map back to values as window[0] + v / 255 * (window[1] - window[0])
+        "maps": entries,
+    }
+    serialization.dump(manifest, out_dir / MANIFEST_NAME)
+    return manifest
+
+
+def leading_entries(manifest):
+    """Archive paths to put first in the result zip: the manifest, then the levels coarsest first."""
+    if not manifest:
+        return ()
+    files = [(-level["factor"], level["file"]) for entry in manifest["maps"].values() for level in entry["levels"]]
+    return (MANIFEST_NAME, *(name for _, name in sorted(files)), f"{PREVIEW_DIR}/")
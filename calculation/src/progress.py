@@ -0,0 +1,175 @@
+"""
+Live progress of a running mrotools.snr.
+
+A Monitor follows the run while it is in flight: the lines the child prints on
+stdout, and the pynico log file, re-read whenever it changes. Both are turned
+into progress events
+
+    {"stage", "index", "total", "percent", "text", "source", "elapsed", "labels"}
+
+delivered to the sinks named by MROPROGRESS (comma-separated):
+
+- `emf`: one CloudWatch EMF line per event on stdout (metric `Progress`);
+- `file:<path>`: one JSON line per event appended to <path>;
+- `module:callable`: the callable is called with every event.
+
+The first ERROR entry of the log sets `error`, which the subprocess engine
+(runner's default) uses to stop the child instead of waiting for it to exit.
+With MROENGINE=inprocess the error is recorded but the run goes on until it
+returns.
+"""
+import importlib
+import json
+import os
+import re
+import threading
+import time
+
+from pynico_eros_montin import pynico as pn
+
+from tracing import DEFAULT_NAMESPACE
+
+# "slice 3/12", "replica 7 of 100", "pseudo-replica 7/100"
+COUNTER = re.compile(
+    r"\b(?P<stage>slice|pseudo[- ]?replica|replica|repetition|coil|channel)s?\s*#?\s*"
+    r"(?P<index>\d+)\s*(?:/|of)\s*(?P<total>\d+)",
+    re.IGNORECASE,
+)
+PERCENT = re.compile(r"(?P<percent>\d+(?:\.\d+)?)\s*%")
+# seconds between two reads of the log file
+DEFAULT_INTERVAL = 1.0
+
+
+def parse(text, source):
+    """Progress event of one stdout line or log message, or None if it carries no progress."""
+    text = str(text).strip()
+    if not text:
+        return None
+    event = {"stage": None, "index": None, "total": None, "percent": None, "text": text, "source": source}
+    match = COUNTER.search(text)
+    if match:
+        index, total = int(match["index"]), int(match["total"])
+        event.update(stage=re.sub(r"[- ]", "", match["stage"].lower()), index=index, total=total)
+        if total:
+            event["percent"] = round(100.0 * min(index, total) / total, 1)
+    match = PERCENT.search(text)
+    if match:
+        event["percent"] = min(float(match["percent"]), 100.0)
+    if source == "log":
+        # every log entry is a milestone, whether or not it counts anything
+        return event
+    return event if event["stage"] or event["percent"] is not None else None
+
+
+def _entry_text(entry):
+    if not isinstance(entry, dict):
+        return str(entry)
+    return " ".join(str(entry[k]) for k in ("what", "text", "type") if entry.get(k))
+
+
+def emf_sink(namespace=DEFAULT_NAMESPACE):
+    def emit(event):
+        if event["percent"] is None:
+            return
+        dims = sorted(k for k in event.get("labels", {}))
+        record = {"Progress": event["percent"], "ProgressStage": event["stage"] or "run"}
+        record.update(event.get("labels", {}))
+        record["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {"Namespace": namespace, "Dimensions": [dims], "Metrics": [{"Name": "Progress", "Unit": "Percent"}]}
+            ],
+        }
+        print(json.dumps(record, default=str), flush=True)
+
+    return emit
+
+
+def file_sink(path):
+    lock = threading.Lock()
+
+    def emit(event):
+        with lock, open(path, "a") as f:
+            f.write(json.dumps(event, default=str) + "\n")
+
+    return emit
+
+
+def sinks_from_env():
+    sinks = []
+    for spec in filter(None, (s.strip() for s in os.getenv("MROPROGRESS", "").split(","))):
+        if spec == "emf":
+            sinks.append(emf_sink())
+        elif spec.startswith("file:"):
+            sinks.append(file_sink(spec[len("file:"):]))
+        else:
+            module, _, name = spec.partition(":")
+            sinks.append(getattr(importlib.import_module(module), name))
+    return sinks
+
+
+class Monitor:
+    """Progress events and first error of one mrotools.snr run."""
+
+    def __init__(self, log_path, sinks=None, labels=None, interval=None):
+        self.log_path = log_path
+        self.sinks = sinks_from_env() if sinks is None else sinks
+        self.labels = dict(labels or {})
+        self.interval = interval or float(os.getenv("MROPROGRESSINTERVAL", str(DEFAULT_INTERVAL)))
+        self.error = None
+        self.last = None
+        self.events = 0
+        self._entries = 0
+        self._stat = None
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+
+    def emit(self, event):
+        event["elapsed"] = round(time.monotonic() - self._t0, 3)
+        event["labels"] = self.labels
+        with self._lock:
+            self.last = event
+            self.events += 1
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                print(f"progress sink failed: {e}")
+
+    def feed_stdout(self, line):
+        event = parse(line, "stdout")
+        if event is not None:
+            self.emit(event)
+
+    def poll_log(self):
+        """Emit the entries appended to the log file since the last call."""
+        try:
+            st = os.stat(self.log_path)
+        except (OSError, TypeError):
+            return
+        if (st.st_size, st.st_mtime_ns) == self._stat:
+            return
+        g = pn.Log()
+        try:
+            g.appendFullLog(str(self.log_path))
+        except Exception:
+            # caught mid-write, read it again next time
+            return
+        self._stat = (st.st_size, st.st_mtime_ns)
+        for entry in g.log[self._entries:]:
+            event = parse(_entry_text(entry), "log")
+            if event is not None:
+                self.emit(event)
+            if self.error is None and isinstance(entry, dict) and entry.get("what") == "ERROR":
+                self.error = event["text"] if event else "ERROR"
+        self._entries = max(self._entries, len(g.log))
+
+    def watch(self, stop):
+        """Poll the log file until the `stop` event is set (run in a thread)."""
+        while not stop.wait(self.interval):
+            self.poll_log()
+        self.poll_log()
+
+    def to_dict(self):
+        last = self.last or {}
+        return {"events": self.events, "stage": last.get("stage"), "percent": last.get("percent"), "error": self.error}
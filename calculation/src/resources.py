@@ -0,0 +1,152 @@
+"""
+Container resource detection (memory and CPUs actually granted to this job).
+"""
+import os
+import resource
+from pathlib import Path
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+# thread pools of numpy's BLAS and of OpenMP-based libraries
+BLAS_THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+def _read_int(path):
+    try:
+        value = Path(path).read_text().strip()
+    except OSError:
+        return None
+    if value in ("max", ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def memory_limit():
+    """Memory limit of this container in bytes (cgroup v2/v1), or None if unlimited."""
+    limit = _read_int(CGROUP_ROOT / "memory.max")
+    if limit is None:
+        limit = _read_int(CGROUP_ROOT / "memory" / "memory.limit_in_bytes")
+        # cgroup v1 reports "unlimited" as a huge page-aligned number
+        if limit is not None and limit >= 1 << 60:
+            limit = None
+    return limit
+
+
+def cpu_quota():
+    """CPUs granted by the cgroup CPU quota (cgroup v2/v1) as a float, or None if unlimited."""
+    try:
+        quota, period = (CGROUP_ROOT / "cpu.max").read_text().split()
+    except (OSError, ValueError):
+        quota = _read_int(CGROUP_ROOT / "cpu" / "cpu.cfs_quota_us")
+        period = _read_int(CGROUP_ROOT / "cpu" / "cpu.cfs_period_us")
+        # v1 reports "no quota" as -1
+        if quota is None or quota <= 0 or not period:
+            return None
+        return quota / period
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def effective_cpus():
+    """
+    CPUs this process can keep busy: its affinity mask capped by the cgroup
+    quota, rounded down (MROCPUS overrides).
+    """
+    override = int(os.getenv("MROCPUS", "0"))
+    if override:
+        return override
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return cpus
+
+
+def _meminfo(field):
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def total_memory():
+    """Bytes of memory this container can ever use: its cgroup limit, or the host's memory."""
+    return memory_limit() or _meminfo("MemTotal")
+
+
+def _memory_stat(*fields):
+    """First of `fields` found in the cgroup's memory.stat (v2, then v1), in bytes."""
+    for path in (CGROUP_ROOT / "memory.stat", CGROUP_ROOT / "memory" / "memory.stat"):
+        try:
+            with open(path) as f:
+                stats = dict(line.split() for line in f if len(line.split()) == 2)
+        except (OSError, ValueError):
+            continue
+        for field in fields:
+            if field in stats:
+                return int(stats[field])
+    return None
+
+
+def available_memory():
+    """Bytes this process can still allocate before hitting the container or host limit."""
+    candidates = []
+    host = _meminfo("MemAvailable")
+    if host is not None:
+        candidates.append(host)
+    limit = memory_limit()
+    if limit is not None:
+        used = _read_int(CGROUP_ROOT / "memory.current")
+        if used is None:
+            used = _read_int(CGROUP_ROOT / "memory" / "memory.usage_in_bytes")
+        # the page cache of the inputs just downloaded is charged to the cgroup,
+        # but the kernel drops it before it OOM-kills anything
+        cache = _memory_stat("inactive_file", "total_inactive_file") or 0
+        candidates.append(max(limit - max((used or 0) - cache, 0), 0))
+    return min(candidates) if candidates else None
+
+
+def reset_peak_rss():
+    """
+    Reset this process's peak RSS (VmHWM) so the next reading covers one job only
+    on a reused container. Returns False where the kernel does not allow it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss(child_peak=None):
+    """
+    Peak resident memory in bytes of this process since reset_peak_rss, or
+    `child_peak` (a subprocess's own peak, see runner.SNRRun.peak_rss) if larger.
+    """
+    peak = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return max(peak, child_peak or 0)
@@ -0,0 +1,347 @@
+"""
+Deduplication of identical jobs.
+
+A job's result key is a hash of its normalized task options (top-level volatile
+fields such as ids, tokens and aliases dropped; every S3 input replaced by its object
+identity, i.e. bucket/key/ETag), its output flags, the mrotools version and, by
+default, the submitting user. The result index maps that key to the result zip
+of the first job that computed it; a resubmission gets a copy of that zip
+instead of running mrotools.snr again.
+
+Concurrent duplicates are collapsed with an in-flight lock: the first job takes
+the lock and computes, the others wait for the index entry to appear, for at
+most MRORESULTWAIT seconds (default 60) so a duplicate never holds a container
+much longer than computing would.
+
+The index lives under MRORESULTCACHE, either `s3://bucket/prefix` (shared by
+every container, locks via conditional PUT) or `file:///dir` (one host).
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse
+
+from inputcache import object_identity
+
+# task fields that differ between otherwise identical submissions (top level / `task` only)
+VOLATILE_KEYS = {"id", "queued", "token", "pipelineid", "pipeline", "alias", "platform", "user_id"}
+# file fields that only say where an input is, not what it is
+LOCATION_KEYS = {"bucket", "key", "presigned_url", "filename", "etag", "eTag", "ETag"}
+DEFAULT_LOCK_TTL = 3600
+DEFAULT_WAIT = 60
+POLL_INTERVAL = 5
+COPY_CHUNK = 8 * 1024 * 1024
+
+
+def engine_version():
+    """mrotools version plus the git commit it was installed from, when pip recorded one."""
+    from importlib import metadata
+
+    try:
+        dist = metadata.distribution("mrotools")
+    except metadata.PackageNotFoundError:
+        return os.getenv("MRORESULTCACHEVERSION", "unknown")
+    version = dist.version
+    try:
+        commit = json.loads(dist.read_text("direct_url.json") or "{}").get("vcs_info", {}).get("commit_id")
+    except ValueError:
+        commit = None
+    return "+".join(v for v in (version, commit, os.getenv("MRORESULTCACHEVERSION")) if v)
+
+
+def _normalize(node, identify, top=True):
+    """
+    Canonical form of a task or output dict. Volatile keys are dropped only at
+    the top level and under `task`: deeper down, `id` names a method (e.g.
+    reconstructor.id, sensitivityMap.id) and is part of what is computed.
+    """
+    if isinstance(node, dict):
+        opts = node.get("options")
+        if node.get("type") == "file" and isinstance(opts, dict) and opts.get("type") == "s3":
+            identity = identify(opts)
+            if identity is None:
+                raise LookupError("input without a stable identity")
+            opts = {k: v for k, v in opts.items() if k not in LOCATION_KEYS}
+            opts["identity"] = identity
+            # the id of a file entry is its upload record; the identity says what it holds
+            node = {k: v for k, v in node.items() if k != "id"}
+            node["options"] = opts
+        return {
+            k: _normalize(v, identify, top=top and k == "task")
+            for k, v in node.items()
+            if not (top and k in VOLATILE_KEYS)
+        }
+    if isinstance(node, list):
+        return [_normalize(v, identify, top=False) for v in node]
+    return node
+
+
+def result_key(task_info, output, inputs=None, probes=None, s3=None, user_id=None):
+    """
+    Hash identifying the result of a job, or None if an input has no stable
+    identity (no ETag), in which case the job is not deduplicated.
+
+    `inputs`/`probes` are collect_inputs / probe_inputs output; inputs not
+    covered there are HEADed through `s3`.
+    """
+    etags = {}
+    for name, file_info in (inputs or {}).items():
+        etag = (probes or {}).get(name, {}).get("etag")
+        if etag:
+            etags[file_info.get("presigned_url") or (file_info.get("bucket"), file_info.get("key"))] = etag
+
+    def identify(file_info):
+        where = file_info.get("presigned_url") or (file_info.get("bucket"), file_info.get("key"))
+        etag = etags.get(where)
+        if "presigned_url" in file_info and not etag:
+            # a URL without an ETag may point at changed content
+            return None
+        return object_identity(file_info, s3, etag)
+
+    try:
+        task = _normalize(task_info, identify)
+    except LookupError:
+        return None
+    scope = os.getenv("MRORESULTCACHESCOPE", "user")
+    canonical = json.dumps(
+        {
+            "task": task,
+            "output": _normalize(output or {}, identify),
+            "engine": engine_version(),
+            "user": user_id if scope == "user" else None,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _lock_body(ttl):
+    return {"owner": uuid.uuid4().hex, "expires": time.time() + ttl}
+
+
+class FileResultIndex:
+    """Index entries and locks as files in a directory (one host, many processes)."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(self.root / f"{key}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        tmp = self.root / f".{key}.{uuid.uuid4().hex}"
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.root / f"{key}.json")
+
+    def delete(self, key):
+        (self.root / f"{key}.json").unlink(missing_ok=True)
+
+    def _read_lock(self, key):
+        try:
+            with open(self.root / f"{key}.lock") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def try_lock(self, key, ttl):
+        """Return the lock owner token, or None if someone else holds a live lock."""
+        path = self.root / f"{key}.lock"
+        for _ in range(2):
+            body = _lock_body(ttl)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                held = self._read_lock(key)
+                if held is not None and held["expires"] > time.time():
+                    return None
+                # the holder died without unlocking
+                path.unlink(missing_ok=True)
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(body, f)
+            return body["owner"]
+        return None
+
+    def locked(self, key):
+        held = self._read_lock(key)
+        return held is not None and held["expires"] > time.time()
+
+    def unlock(self, key, owner):
+        held = self._read_lock(key)
+        if held is not None and held["owner"] == owner:
+            (self.root / f"{key}.lock").unlink(missing_ok=True)
+
+
+class S3ResultIndex:
+    """
+    Index entries and locks as objects under `s3://bucket/prefix`. A lock is
+    taken with a conditional PUT (If-None-Match: *), so only one job wins.
+    """
+
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key, ext):
+        return f"{self.prefix}/{key}.{ext}" if self.prefix else f"{key}.{ext}"
+
+    def _get_json(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound"):
+                return None
+            raise
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    def get(self, key):
+        return self._get_json(self._key(key, "json"))
+
+    def put(self, key, entry):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._key(key, "json"), Body=json.dumps(entry).encode("utf-8")
+        )
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key, "json"))
+
+    def try_lock(self, key, ttl):
+        from botocore.exceptions import ClientError
+
+        for _ in range(2):
+            body = _lock_body(ttl)
+            try:
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=self._key(key, "lock"),
+                    Body=json.dumps(body).encode("utf-8"),
+                    IfNoneMatch="*",
+                )
+                return body["owner"]
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+            held = self._get_json(self._key(key, "lock"))
+            if held is not None and held["expires"] > time.time():
+                return None
+            # expired (or vanished between the PUT and the GET): clear it and retry once
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(key, "lock"))
+        return None
+
+    def locked(self, key):
+        held = self._get_json(self._key(key, "lock"))
+        return held is not None and held["expires"] > time.time()
+
+    def unlock(self, key, owner):
+        held = self._get_json(self._key(key, "lock"))
+        if held is not None and held["owner"] == owner:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(key, "lock"))
+
+
+class ResultCache:
+    """Looks up, waits for, and publishes deduplicated results."""
+
+    def __init__(self, index, client, lock_ttl=None, log=print):
+        self.index = index
+        self.client = client
+        self.lock_ttl = lock_ttl or int(os.getenv("MRORESULTLOCKTTL", str(DEFAULT_LOCK_TTL)))
+        self.log = log
+        self._owners = {}
+
+    def lookup(self, key):
+        """The index entry for `key` if its result object still exists."""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        try:
+            self.client.head_object(Bucket=entry["bucket"], Key=entry["key"])
+        except Exception as e:
+            self.log(f"cached result s3://{entry['bucket']}/{entry['key']} is gone ({e}), forgetting it")
+            self.index.delete(key)
+            return None
+        return entry
+
+    def claim(self, key, wait_seconds=DEFAULT_WAIT, poll=POLL_INTERVAL):
+        """
+        Return the cached entry for `key`, or None once this job holds the
+        in-flight lock and must compute it. Waits while another job computes
+        the same key; after `wait_seconds` gives up and returns None without
+        the lock (the job then computes on its own).
+        """
+        deadline = time.monotonic() + max(wait_seconds, 0)
+        waited = False
+        while True:
+            entry = self.lookup(key)
+            if entry is not None:
+                return entry
+            owner = self.index.try_lock(key, self.lock_ttl)
+            if owner is not None:
+                self._owners[key] = owner
+                return None
+            if time.monotonic() >= deadline:
+                self.log("gave up waiting for the identical job in flight, computing")
+                return None
+            if not waited:
+                self.log("an identical job is being computed, waiting for its result")
+                waited = True
+            time.sleep(poll)
+
+    def publish(self, key, bucket, object_key, size=None):
+        self.index.put(
+            key, {"bucket": bucket, "key": object_key, "size": size, "created": time.time()}
+        )
+
+    def release(self, key):
+        owner = self._owners.pop(key, None)
+        if owner is not None:
+            try:
+                self.index.unlock(key, owner)
+            except Exception as e:
+                self.log(f"could not release result lock: {e}")
+
+    def copy_to(self, entry, target):
+        """Deliver the cached zip to an upload target; server-side copy when both are in S3."""
+        from upload import S3MultipartTarget, StreamingUpload
+
+        source = {"Bucket": entry["bucket"], "Key": entry["key"]}
+        if isinstance(target, S3MultipartTarget):
+            self.client.copy(source, target.bucket, target.key)
+            return entry.get("size")
+        body = self.client.get_object(**source)["Body"]
+        with StreamingUpload.planned(target, entry.get("size")) as stream:
+            for chunk in body.iter_chunks(COPY_CHUNK):
+                stream.write(chunk)
+        return stream.bytes_written
+
+
+def open_result_cache(client, url=None, log=print):
+    """ResultCache for MRORESULTCACHE (or `url`), or None when deduplication is off."""
+    url = url if url is not None else os.getenv("MRORESULTCACHE", "")
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        index = S3ResultIndex(client, parsed.netloc, parsed.path)
+    elif parsed.scheme == "file":
+        index = FileResultIndex(parsed.path)
+    else:
+        raise ValueError(f"unsupported result cache URL: {url}")
+    return ResultCache(index, client, log=log)
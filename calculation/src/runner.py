@@ -0,0 +1,329 @@
+"""
+Execution engines for `mrotools.snr`.
+
+By default mrotools.snr runs as `python -m mrotools.snr` in a session of its
+own, so that stopping it also stops the worker pool of --parallel. The
+in-process engine (MROENGINE=inprocess) runs the entry point inside the
+already warm handler interpreter instead, so numpy/mrotools are imported once
+per container rather than once per job.
+
+The in-process engine is not the default: it cannot be stopped at the first
+error, an OOM kill there takes the handler (and the failure report) with it,
+and the --parallel pool it starts outlives nothing that could clean it up.
+Nor does it return more than the subprocess: mrotools.snr is a command-line
+module whose only results are OUT and its log, so either engine fills SNRRun
+from the exit status (or the exception raised in-process) and that log.
+
+`plan_parallelism` sizes the compute stage to the CPUs and memory the
+container was actually granted (cgroup quota, not the host's core count) and
+`run_snr` caps the BLAS/OpenMP thread pools to match, so mrotools' workers and
+numpy's threads do not oversubscribe the vCPUs.
+
+While mrotools runs, a progress.Monitor follows its stdout and log file. Only
+the subprocess engine, the default, stops mrotools at the first ERROR log
+entry: an in-process run cannot be interrupted from another thread, so its
+errors are reported once it returns on its own.
+"""
+import importlib.util
+import os
+import runpy
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from pynico_eros_montin import pynico as pn
+
+from progress import Monitor
+from resources import BLAS_THREAD_VARS, available_memory, effective_cpus
+
+SNR_MODULE = "mrotools.snr"
+ENGINES = ("inprocess", "subprocess")
+MB = 1024 * 1024
+# memory a parallel mrotools worker is assumed to need when the job has no prediction
+DEFAULT_WORKER_MEMORY_MB = 2048
+# seconds a stopped mrotools gets to exit before it is killed
+STOP_GRACE = 10
+# seconds between checks whether mrotools exited
+WAIT_POLL = 0.05
+
+
+class ComputationError(Exception):
+    """mrotools.snr reported a failure (non-zero exit, exception or ERROR log entry)."""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class SNRRun:
+    """Structured outcome of one mrotools.snr execution."""
+
+    def __init__(self, engine, args, log_path):
+        self.engine = engine
+        self.args = list(args)
+        self.log_path = log_path
+        self.returncode = None
+        self.exception = None
+        self.traceback = None
+        self.log = []
+        self.elapsed = 0.0
+        # ERROR log entry the run was stopped at, before it exited on its own
+        self.aborted = None
+        self.progress = None
+        # peak RSS in bytes of the mrotools process (and the children it waited for); subprocess engine only
+        self.peak_rss = None
+
+    @property
+    def killed(self):
+        """Killed by SIGKILL, which in a container almost always means out of memory."""
+        # a shell reports a child's signal as 128 + signum
+        return self.aborted is None and self.returncode in (-signal.SIGKILL, 128 + signal.SIGKILL)
+
+    @property
+    def failed(self):
+        if self.aborted or self.exception is not None or self.returncode not in (0, None):
+            return True
+        return bool(self.log) and self.log[-1].get("what") == "ERROR"
+
+    def to_dict(self):
+        return {
+            "engine": self.engine,
+            "returncode": self.returncode,
+            "killed": self.killed,
+            "aborted": self.aborted,
+            "error": None if self.exception is None else repr(self.exception),
+            "elapsed": self.elapsed,
+            "progress": self.progress,
+            "peak_rss": self.peak_rss,
+        }
+
+
+def snr_args(input_json, out_dir, log_path, flags=()):
+    """Command-line arguments for mrotools.snr (without the interpreter/module part)."""
+    return ["-j", str(input_json), "-o", str(out_dir), *flags, "--no-verbose", "-l", str(log_path)]
+
+
+def default_engine():
+    engine = os.getenv("MROENGINE", "subprocess").lower()
+    return engine if engine in ENGINES else "subprocess"
+
+
+def plan_parallelism(job_memory_mb=None):
+    """
+    Decide how the compute stage uses the container: {"parallel", "workers",
+    "threads", "cpus", "memory_mb", "reason"}. `workers` is how many job
+    processes fit the granted CPUs and memory (each needing `job_memory_mb`,
+    default MROPARALLELWORKERMB), `threads` the BLAS threads of a single
+    mrotools run.
+
+    MROPARALLEL=true/false forces mrotools' --parallel on or off. The default
+    `auto` turns it on when a worker fits on every CPU, since mrotools sizes
+    its pool from the CPU count.
+    """
+    cpus = effective_cpus()
+    worker_mb = job_memory_mb or int(os.getenv("MROPARALLELWORKERMB", str(DEFAULT_WORKER_MEMORY_MB)))
+    available = available_memory()
+    workers = cpus
+    if available is not None:
+        workers = max(1, min(cpus, int(available / MB // worker_mb)))
+    setting = os.getenv("MROPARALLEL", "auto").lower()
+    if setting in ("true", "1", "yes"):
+        parallel, reason = True, "forced by MROPARALLEL"
+    elif setting in ("false", "0", "no"):
+        parallel, reason = False, "forced off by MROPARALLEL"
+    elif cpus < 2:
+        parallel, reason = False, "one CPU granted"
+    elif workers < cpus:
+        parallel, reason = False, f"memory for {workers} of {cpus} workers of {worker_mb} MB only"
+    else:
+        parallel, reason = True, f"{cpus} workers of {worker_mb} MB fit"
+    return {
+        "parallel": parallel,
+        "workers": workers,
+        # mrotools' pool already has a process per CPU
+        "threads": 1 if parallel else cpus,
+        "cpus": cpus,
+        "memory_mb": None if available is None else int(available / MB),
+        "reason": reason,
+    }
+
+
+def thread_env(threads):
+    """BLAS/OpenMP thread limits for `threads`; variables set explicitly in the environment win."""
+    return {var: os.environ.get(var) or str(threads) for var in BLAS_THREAD_VARS}
+
+
+@contextmanager
+def _limited_threads(threads):
+    """Cap the thread pools of this interpreter while mrotools runs in-process."""
+    saved = {var: os.environ.get(var) for var in BLAS_THREAD_VARS}
+    os.environ.update(thread_env(threads))
+    try:
+        try:
+            # BLAS libraries loaded already do not look at the variables again
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            yield
+        else:
+            with threadpool_limits(threads):
+                yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _read_log(run):
+    if run.log_path and os.path.exists(run.log_path):
+        g = pn.Log()
+        g.appendFullLog(str(run.log_path))
+        run.log = g.log
+
+
+def _run_inprocess(run):
+    saved_argv = sys.argv
+    sys.argv = [SNR_MODULE, *run.args]
+    try:
+        runpy.run_module(SNR_MODULE, run_name="__main__", alter_sys=True)
+        run.returncode = 0
+    except SystemExit as e:
+        run.returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        run.exception = e
+        run.traceback = traceback.format_exc()
+        run.returncode = 1
+    finally:
+        sys.argv = saved_argv
+
+
+def _inprocess_available():
+    try:
+        return importlib.util.find_spec(SNR_MODULE) is not None
+    except ImportError:
+        return False
+
+
+def _pump(stream, monitor):
+    # pass the child's output on to our own stdout (CloudWatch) as it comes
+    for line in stream:
+        sys.stdout.write(line)
+        monitor.feed_stdout(line)
+    stream.close()
+
+
+def _signal_group(proc, signum):
+    try:
+        os.killpg(proc.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _wait(proc, run, timeout=None):
+    """
+    Wait up to `timeout` seconds (None: until it exits) for `proc`; returns
+    True once it exited. It is reaped with wait4 so that `run` gets the peak
+    RSS of this run alone, which RUSAGE_CHILDREN, a maximum over every child
+    the container ever had, cannot give.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            run.peak_rss = usage.ru_maxrss * 1024
+            return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(WAIT_POLL if deadline is None else min(WAIT_POLL, max(deadline - time.monotonic(), 0)))
+
+
+def _stop(proc, run):
+    # the whole session: mrotools and the pool workers of --parallel
+    _signal_group(proc, signal.SIGTERM)
+    if not _wait(proc, run, STOP_GRACE):
+        _signal_group(proc, signal.SIGKILL)
+        _wait(proc, run)
+
+
+def _run_subprocess(run, monitor, threads=None):
+    env = dict(os.environ, **thread_env(threads)) if threads else None
+    proc = subprocess.Popen(
+        [sys.executable, "-m", SNR_MODULE, *run.args],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        start_new_session=True,
+    )
+    reader = threading.Thread(target=_pump, args=(proc.stdout, monitor), daemon=True)
+    reader.start()
+    while not _wait(proc, run, monitor.interval):
+        monitor.poll_log()
+        if monitor.error is not None:
+            run.aborted = monitor.error
+            _stop(proc, run)
+            break
+    # pool workers left behind would hold stdout open and the reader with it
+    _signal_group(proc, signal.SIGKILL)
+    reader.join()
+    monitor.poll_log()
+    # the exit status tells an OOM kill apart from a failure mrotools logged itself
+    run.returncode = proc.returncode
+
+
+def _watch_inprocess(run, monitor, threads=None):
+    stop = threading.Event()
+    watcher = threading.Thread(target=monitor.watch, args=(stop,), daemon=True)
+    watcher.start()
+    try:
+        if threads:
+            with _limited_threads(threads):
+                _run_inprocess(run)
+        else:
+            _run_inprocess(run)
+    finally:
+        stop.set()
+        watcher.join()
+
+
+def run_snr(args, log_path, engine=None, log=print, threads=None, monitor=None):
+    """
+    Run mrotools.snr with `args` and return an SNRRun, with BLAS/OpenMP pools
+    capped at `threads` if given. `monitor` (default: a progress.Monitor on
+    `log_path` with the MROPROGRESS sinks) receives its progress.
+
+    `engine` defaults to MROENGINE (subprocess); the in-process engine falls
+    back to the subprocess when mrotools cannot be imported in this interpreter.
+    """
+    engine = engine or default_engine()
+    run = SNRRun(engine, args, log_path)
+    monitor = monitor or Monitor(log_path)
+    start = time.monotonic()
+    if engine == "inprocess":
+        if _inprocess_available():
+            log(f"running {SNR_MODULE} in-process: {' '.join(run.args)}")
+            log("in-process runs are only observed: an ERROR in the log does not stop them")
+            _watch_inprocess(run, monitor, threads)
+            if monitor.error is not None:
+                log(f"{SNR_MODULE} logged an error while it ran in-process: {monitor.error}")
+        else:
+            log(f"{SNR_MODULE} not importable in-process, falling back to subprocess")
+            run.engine = "subprocess"
+    if run.engine == "subprocess":
+        log(f"running command: python -m {SNR_MODULE} {' '.join(run.args)}")
+        _run_subprocess(run, monitor, threads)
+        if run.aborted:
+            log(f"stopped {SNR_MODULE} at the first error in its log: {run.aborted}")
+    run.elapsed = time.monotonic() - start
+    run.progress = monitor.to_dict()
+    _read_log(run)
+    if run.traceback:
+        log(run.traceback)
+    return run
@@ -0,0 +1,158 @@
+"""
+JSON encoding of events, logs and failure bundles.
+
+Uses orjson when it is installed (several times faster than the json module,
+numpy arrays and scalars natively) and the json module otherwise; both turn
+numpy values, paths, sets and anything else unknown into plain JSON instead
+of failing, so no recursive pre-pass over the data is needed. The output
+matches the json module's: orjson writes NaN and infinities as null, so when
+its output has a null and the data a non-finite float, the json module writes
+it instead (NaN, Infinity); `load` reads both.
+
+Verbose mrotools logs can run to many MB. `cap_log` and `cap_text` cut them in
+the middle, keeping the start (setup, options) and the end (where the error
+is): MROLOGMAXENTRIES entries per log, MROLOGMAXCHARS characters per message
+and MROPRINTMAXCHARS characters per printed line.
+"""
+import json
+import math
+import os
+from pathlib import PurePath
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_CHARS = 20000
+DEFAULT_MAX_PRINT_CHARS = 100000
+
+
+def _default(obj):
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    # numpy without importing it: arrays and scalars both have tolist()
+    if hasattr(obj, "tolist") and hasattr(obj, "dtype"):
+        return obj.tolist()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _non_finite(obj):
+    """True if `obj` holds a NaN or infinite float, which orjson would write as null."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return any(_non_finite(v) for v in obj)
+    if hasattr(obj, "dtype") and hasattr(obj, "tolist") and obj.dtype.kind in "fc":
+        import numpy as np
+
+        return not np.isfinite(obj).all()
+    return False
+
+
+def _orjson(obj):
+    """orjson's encoding of `obj`, or None where the json module has to write it."""
+    try:
+        data = orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # integers beyond 64 bits, nesting deeper than orjson allows
+        return None
+    # only data with a null can have lost a NaN
+    if b"null" in data:
+        try:
+            if _non_finite(obj):
+                return None
+        except RecursionError:
+            return None
+    return data
+
+
+def dumps(obj):
+    """Compact JSON text of `obj`."""
+    if orjson is not None:
+        data = _orjson(obj)
+        if data is not None:
+            return data.decode()
+    return json.dumps(obj, default=_default)
+
+
+def dump(obj, path):
+    """
+    Write `obj` as JSON to `path`: orjson's output in one write, or the json
+    module's chunks as they are encoded, never a Python string of the whole.
+    """
+    if orjson is not None:
+        data = _orjson(obj)
+        if data is not None:
+            with open(path, "wb") as f:
+                f.write(data)
+            return
+    with open(path, "w", encoding="utf-8") as f:
+        # json.dump writes the chunks of iterencode as they are produced
+        json.dump(obj, f, default=_default)
+
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity, written by the json module, are not JSON to orjson
+            pass
+    return json.loads(data)
+
+
+def cap_text(text, max_chars=None):
+    """`text` cut to `max_chars` (default MROLOGMAXCHARS) by dropping its middle."""
+    if max_chars is None:
+        max_chars = int(os.getenv("MROLOGMAXCHARS", str(DEFAULT_MAX_CHARS)))
+    if not isinstance(text, str) or max_chars <= 0 or len(text) <= max_chars:
+        return text
+    head = max_chars // 2
+    tail = max_chars - head
+    return f"{text[:head]}\n... [{len(text) - max_chars} characters omitted] ...\n{text[-tail:]}"
+
+
+def _cap_entry(entry, max_chars):
+    if isinstance(entry, str):
+        return cap_text(entry, max_chars)
+    if isinstance(entry, dict):
+        return {k: cap_text(v, max_chars) if isinstance(v, str) else v for k, v in entry.items()}
+    return entry
+
+
+def cap_log(entries, max_entries=None, max_chars=None):
+    """
+    A copy of the log `entries` with at most `max_entries` entries (default
+    MROLOGMAXENTRIES; the middle ones are replaced by a single marker) and
+    their messages capped by `cap_text`.
+    """
+    if not isinstance(entries, list):
+        return entries
+    if max_entries is None:
+        max_entries = int(os.getenv("MROLOGMAXENTRIES", str(DEFAULT_MAX_ENTRIES)))
+    if max_chars is None:
+        max_chars = int(os.getenv("MROLOGMAXCHARS", str(DEFAULT_MAX_CHARS)))
+    if 0 < max_entries < len(entries):
+        head = max_entries // 2
+        tail = max_entries - head
+        marker = {"what": f"{len(entries) - max_entries} log entries omitted", "type": "truncated"}
+        entries = entries[:head] + [marker] + entries[len(entries) - tail:]
+    return [_cap_entry(e, max_chars) for e in entries]
+
+
+def preview(obj):
+    """`obj` as text for stdout (JSON unless it is a string), capped at MROPRINTMAXCHARS characters."""
+    text = obj if isinstance(obj, str) else dumps(obj)
+    return cap_text(text, int(os.getenv("MROPRINTMAXCHARS", str(DEFAULT_MAX_PRINT_CHARS))))
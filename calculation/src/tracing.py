@@ -0,0 +1,110 @@
+"""
+Per-stage timing spans for a job, exported to info.json and as CloudWatch
+Embedded Metric Format (EMF) lines on stdout.
+
+EMF lines are plain JSON printed to the log stream, which CloudWatch turns into
+metrics without any API call from the job itself.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+DEFAULT_NAMESPACE = "MROptimum"
+
+
+class Span:
+    """Wall time and bytes moved by one stage."""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.bytes = 0
+        self.status = "ok"
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        self.seconds = None
+
+    def add_bytes(self, n):
+        self.bytes += n or 0
+
+    def finish(self):
+        self.seconds = time.monotonic() - self._t0
+
+    def to_dict(self):
+        seconds = self.seconds if self.seconds is not None else time.monotonic() - self._t0
+        out = {"seconds": round(seconds, 4), "status": self.status}
+        if self.bytes:
+            out["bytes"] = self.bytes
+            out["throughput_mbps"] = round(self.bytes / 1e6 / max(seconds, 1e-6), 3)
+        out.update(self.attrs)
+        return out
+
+
+class Tracer:
+    """Collects the spans of one job in the order they started."""
+
+    def __init__(self, **dimensions):
+        self.dimensions = {k: str(v) for k, v in dimensions.items() if v is not None}
+        self.properties = {}
+        self.spans = []
+        self._t0 = time.monotonic()
+
+    def set_dimensions(self, **dimensions):
+        self.dimensions.update({k: str(v) for k, v in dimensions.items() if v is not None})
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = Span(name, **attrs)
+        self.spans.append(span)
+        try:
+            yield span
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            span.finish()
+
+    def elapsed(self):
+        return time.monotonic() - self._t0
+
+    def to_dict(self):
+        return {
+            "total_seconds": round(self.elapsed(), 4),
+            "stages": {s.name: s.to_dict() for s in self.spans},
+        }
+
+    def emf_records(self, namespace=DEFAULT_NAMESPACE, status=None):
+        """One EMF record per stage plus one for the whole job."""
+        now = int(time.time() * 1000)
+        dim_names = sorted(self.dimensions)
+        records = []
+        for s in self.spans:
+            d = s.to_dict()
+            metrics = [{"Name": "Duration", "Unit": "Seconds"}]
+            record = {"Stage": s.name, "Duration": d["seconds"], "StageStatus": d["status"]}
+            if s.bytes:
+                metrics += [
+                    {"Name": "Bytes", "Unit": "Bytes"},
+                    {"Name": "Throughput", "Unit": "Megabytes/Second"},
+                ]
+                record.update(Bytes=d["bytes"], Throughput=d["throughput_mbps"])
+            records.append((record, metrics, [dim_names + ["Stage"]]))
+        total = {"Stage": "job", "Duration": round(self.elapsed(), 4), "JobStatus": status}
+        records.append((total, [{"Name": "Duration", "Unit": "Seconds"}], [dim_names + ["Stage"]]))
+
+        lines = []
+        for record, metrics, dims in records:
+            record.update(self.dimensions)
+            record.update(self.properties)
+            record["_aws"] = {
+                "Timestamp": now,
+                "CloudWatchMetrics": [
+                    {"Namespace": namespace, "Dimensions": dims, "Metrics": metrics}
+                ],
+            }
+            lines.append(record)
+        return lines
+
+    def emit_emf(self, namespace=DEFAULT_NAMESPACE, status=None):
+        for record in self.emf_records(namespace, status):
+            print(json.dumps(record, default=str))
@@ -0,0 +1,224 @@
+"""
+Parallel transfers for large job inputs.
+
+Presigned URLs are fetched with concurrent HTTP Range requests written straight
+into a preallocated file with os.pwrite; failed ranges are retried from the last
+byte written rather than restarting the object. The boto3 path gets the same
+behaviour through a tuned TransferConfig.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import requests
+from boto3.s3.transfer import TransferConfig
+
+MiB = 1024 * 1024
+DEFAULT_PART_SIZE = 64 * MiB
+DEFAULT_CONCURRENCY = 8
+# size of the blocks handed from the socket to pwrite
+READ_CHUNK = 1 * MiB
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TransferCancelled(Exception):
+    """Raised inside a download when a sibling transfer has failed."""
+
+
+class TransientHTTPError(Exception):
+    """A retryable HTTP status returned for a range request."""
+
+
+def default_part_size():
+    return int(os.getenv("MRODOWNLOADPARTSIZE", "0")) or DEFAULT_PART_SIZE
+
+
+def default_concurrency():
+    return int(os.getenv("MRODOWNLOADCONCURRENCY", "0")) or DEFAULT_CONCURRENCY
+
+
+def s3_transfer_config():
+    """TransferConfig matching the presigned downloader's part size and concurrency."""
+    size = default_part_size()
+    return TransferConfig(
+        multipart_threshold=size,
+        multipart_chunksize=size,
+        max_concurrency=default_concurrency(),
+        io_chunksize=READ_CHUNK,
+        use_threads=True,
+    )
+
+
+def _parse_content_range(value):
+    # "bytes 0-0/12345" -> 12345
+    try:
+        total = value.rsplit("/", 1)[1]
+        return None if total == "*" else int(total)
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def probe_url(url, session=None, timeout=30):
+    """
+    Return (size, etag) of the object behind a presigned GET URL.
+
+    HEAD is not covered by a GET signature, so a one-byte Range request is used.
+    """
+    session = session or requests.Session()
+    resp = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout)
+    with resp:
+        if resp.status_code == 206:
+            size = _parse_content_range(resp.headers.get("Content-Range"))
+        elif resp.status_code == 200:
+            length = resp.headers.get("Content-Length")
+            size = int(length) if length is not None else None
+        elif resp.status_code == 416:
+            # the range of an empty object is not satisfiable
+            size = 0
+        else:
+            raise Exception(f"Failed to probe file. HTTP status code: {resp.status_code}")
+        return size, resp.headers.get("ETag")
+
+
+class RangeDownloader:
+    """
+    Download a URL into `dest` with up to `workers` concurrent Range requests.
+
+    `callback(nbytes)` is called as data lands on disk; setting `cancel_event`
+    aborts every range with TransferCancelled.
+    """
+
+    def __init__(
+        self,
+        session=None,
+        part_size=None,
+        workers=None,
+        retries=5,
+        timeout=60,
+        cancel_event=None,
+        callback=None,
+    ):
+        self.session = session or requests.Session()
+        self.part_size = part_size or default_part_size()
+        self.workers = workers or default_concurrency()
+        self.retries = retries
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.callback = callback
+
+    def _check_cancel(self, failed=None):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise TransferCancelled("download cancelled")
+        if failed is not None and failed.is_set():
+            raise TransferCancelled("another range of the download failed")
+
+    def _write_stream(self, response, fd, offset, progress, failed=None):
+        """pwrite the body of `response` at `offset`; returns bytes written."""
+        written = 0
+        for chunk in response.iter_content(chunk_size=READ_CHUNK):
+            self._check_cancel(failed)
+            view = memoryview(chunk)
+            while view:
+                n = os.pwrite(fd, view, offset + written)
+                view = view[n:]
+                written += n
+            progress(len(chunk))
+        return written
+
+    def download(self, url, dest):
+        """Download `url` into `dest` and return the number of bytes written."""
+        lock = threading.Lock()
+        total_written = 0
+
+        def progress(n):
+            nonlocal total_written
+            with lock:
+                total_written += n
+            if self.callback is not None:
+                self.callback(n)
+
+        probe = self.session.get(
+            url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout
+        )
+        if probe.status_code == 416:
+            # an empty object has no byte 0 to ask for: get it whole instead
+            probe.close()
+            probe = self.session.get(url, stream=True, timeout=self.timeout)
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            with probe:
+                if probe.status_code == 200:
+                    # server ignored the Range header: stream the body we already have
+                    self._write_stream(probe, fd, 0, progress)
+                    return total_written
+                if probe.status_code != 206:
+                    raise Exception(
+                        f"Failed to download file. HTTP status code: {probe.status_code}"
+                    )
+                size = _parse_content_range(probe.headers.get("Content-Range"))
+            if size is None:
+                raise Exception("Server did not report the object size")
+
+            if hasattr(os, "posix_fallocate") and size:
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+
+            # remaining[start] = next offset still to fetch for the range at `start`
+            ranges = [(s, min(s + self.part_size, size) - 1) for s in range(0, size, self.part_size)]
+            remaining = {start: start for start, _ in ranges}
+            self._fetch_ranges(url, fd, ranges, remaining, progress)
+            return total_written
+        finally:
+            os.close(fd)
+
+    def _fetch_range(self, url, fd, start, end, remaining, progress, failed=None):
+        attempt = 0
+        while remaining[start] <= end:
+            self._check_cancel(failed)
+            offset = remaining[start]
+            try:
+                resp = self.session.get(
+                    url,
+                    headers={"Range": f"bytes={offset}-{end}"},
+                    stream=True,
+                    timeout=self.timeout,
+                )
+                if resp.status_code in RETRY_STATUS:
+                    raise TransientHTTPError(f"HTTP {resp.status_code}")
+                if resp.status_code != 206:
+                    raise Exception(
+                        f"Failed to download range {offset}-{end}. "
+                        f"HTTP status code: {resp.status_code}"
+                    )
+                def advance(n):
+                    remaining[start] += n
+                    progress(n)
+
+                with resp:
+                    self._write_stream(resp, fd, offset, advance, failed)
+                if remaining[start] <= end:
+                    raise TransientHTTPError(f"short read for range {offset}-{end}")
+            except (requests.RequestException, TransientHTTPError):
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                # resume from the last byte written on the next attempt
+                time.sleep(min(2**attempt * 0.25, 8))
+
+    def _fetch_ranges(self, url, fd, ranges, remaining, progress):
+        # set when a range fails; the caller's cancel_event is only read
+        failed_event = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="range") as pool:
+            futures = [
+                pool.submit(self._fetch_range, url, fd, start, end, remaining, progress, failed_event)
+                for start, end in ranges
+            ]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [f for f in done if f.exception() is not None]
+            if failed:
+                failed_event.set()
+                for f in pending:
+                    f.cancel()
+                raise failed[0].exception()
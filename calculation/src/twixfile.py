@@ -0,0 +1,261 @@
+"""
+Siemens TWIX (.dat) raw data: header dimensions and per-slice splitting.
+
+Only the last measurement of a file is the imaging scan; in multi-RAID files
+the earlier ones are adjustment scans (noise, calibration) and are kept as-is.
+Splitting copies the file MDB by MDB, patching counters in the copied bytes,
+so its memory use does not grow with the size of the file.
+"""
+import os
+import re
+import struct
+from pathlib import Path
+
+TWIX_SUFFIXES = (".dat",)
+# MDBs that close a measurement or carry sync data, whatever their counters say
+CONTROL_FLAGS = ("ACQEND", "SYNCDATA")
+# space reserved for the multi-RAID header at the start of a VD/VE file
+RAID_HEADER_SIZE = 10240
+# scans start on 512-byte boundaries, MDBs after a 32-byte aligned protocol header
+SCAN_ALIGN = 512
+HEADER_ALIGN = 32
+COPY_CHUNK = 1024 * 1024
+SLICE_ENTRY = re.compile(r"sSliceArray\.asSlice\[(?P<index>\d+)\](?P<rest>.*)$")
+SLICE_ORDER = re.compile(r"sSliceArray\.(?P<name>anAsc|anPos)\[(?P<index>\d+)\]\s*=\s*(?P<value>\d+)")
+SLICE_SIZE = re.compile(r"(?P<name>sSliceArray\.lSize\s*=\s*)(?P<value>\d+)")
+NSLC = re.compile(r'(<ParamLong\."NSlc">\s*\{\s*)\d+')
+
+
+def is_twix(file_info):
+    """True if an input entry (collect_inputs options) is Siemens raw data."""
+    vendor = (file_info.get("vendor") or "").lower()
+    return vendor == "siemens" and Path(file_info.get("filename", "")).suffix.lower() in TWIX_SUFFIXES
+
+
+def read_dims(path):
+    """
+    Acquisition dimensions from the protocol header of the imaging measurement,
+    without reading any k-space data.
+    """
+    import twixtools
+
+    twix = twixtools.read_twix(
+        str(path), parse_data=False, parse_pmu=False, parse_geometry=False, verbose=False
+    )
+    yaps = twix[-1]["hdr"]["MeasYaps"]
+    kspace = yaps.get("sKSpace", {})
+    coils = (yaps.get("sCoilSelectMeas", {}).get("aRxCoilSelectData") or [{}])[0].get("asList") or []
+    return {
+        "measurements": len(twix),
+        "slices": int(yaps.get("sSliceArray", {}).get("lSize", 1)),
+        "partitions": int(kspace.get("lPartitions", 1)),
+        "columns": kspace.get("lBaseResolution"),
+        "lines": kspace.get("lPhaseEncodingLines"),
+        "channels": len(coils) or None,
+        "repetitions": int(yaps.get("lRepetitions", 0)) + 1,
+        "averages": int(yaps.get("lAverages", 1)),
+    }
+
+
+def slice_positions(path):
+    """
+    Centre and unit normal of every slice of the imaging measurement
+    (sSliceArray.asSlice), in slice index order, as (sag, cor, tra) patient
+    coordinates in mm.
+    """
+    import twixtools
+
+    twix = twixtools.read_twix(
+        str(path), parse_data=False, parse_pmu=False, parse_geometry=False, verbose=False
+    )
+    slice_array = twix[-1]["hdr"]["MeasYaps"].get("sSliceArray", {})
+    slices = []
+    # the protocol leaves out entries that are 0
+    for entry in (slice_array.get("asSlice") or [])[: int(slice_array.get("lSize", 1))]:
+        entry = entry or {}
+        position = [float((entry.get("sPosition") or {}).get(k, 0.0)) for k in ("dSag", "dCor", "dTra")]
+        normal = [float((entry.get("sNormal") or {}).get(k, 0.0)) for k in ("dSag", "dCor", "dTra")]
+        norm = sum(c * c for c in normal) ** 0.5
+        slices.append({"position": position, "normal": [c / norm for c in normal] if norm else [0.0, 0.0, 1.0]})
+    return slices
+
+
+def coil_names(path):
+    """Receive coil elements of the imaging measurement in channel order (empty if unknown)."""
+    import twixtools
+
+    twix = twixtools.read_twix(
+        str(path), parse_data=False, parse_pmu=False, parse_geometry=False, verbose=False
+    )
+    yaps = twix[-1]["hdr"]["MeasYaps"]
+    coils = (yaps.get("sCoilSelectMeas", {}).get("aRxCoilSelectData") or [{}])[0].get("asList") or []
+    return [
+        str((c.get("sCoilElementID") or {}).get("tElement") or c.get("lRxChannelConnected") or i)
+        for i, c in enumerate(coils)
+    ]
+
+
+def split_size(path, groups):
+    """Bytes split_slices writes for `groups`: the imaging scan once, the scans before it once per group."""
+    import numpy as np
+    from twixtools import hdr_def, helpers
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        version_is_ve, _ = helpers.idea_version_check(f)
+        if not version_is_ve:
+            return size
+        raid = np.fromfile(f, dtype=hdr_def.MultiRaidFileHeader, count=1)[0]
+        start = int(raid["entry"][int(raid["hdr"]["count_"]) - 1]["off_"])
+        f.seek(start)
+        hdr_len = int(np.fromfile(f, dtype=hdr_def.SingleMeasInit, count=1)[0]["hdr_len"])
+    # everything up to the imaging scan's MDBs is repeated in every part
+    return size + (len(groups) - 1) * (start + hdr_len)
+
+
+def _slice_protocol(text, group):
+    """Protocol text (ASCCONV and XProtocol) with the slice array cut down to `group`, renumbered from 0."""
+    renumber = {s: n for n, s in enumerate(group)}
+    orders = {"anAsc": {}, "anPos": {}}
+    lines = []
+    for line in text.split("\n"):
+        match = SLICE_ENTRY.match(line)
+        if match:
+            if int(match["index"]) in renumber:
+                lines.append(f"sSliceArray.asSlice[{renumber[int(match['index'])]}]{match['rest']}")
+            continue
+        match = SLICE_ORDER.match(line)
+        if match:
+            orders[match["name"]][int(match["index"])] = int(match["value"])
+            continue
+        lines.append(line)
+    if not any(SLICE_SIZE.match(line) for line in lines):
+        return NSLC.sub(lambda m: f"{m[1]}{len(group)}", text)
+    out = []
+    for line in lines:
+        match = SLICE_SIZE.match(line)
+        if not match:
+            out.append(line)
+            continue
+        n_slices = int(match["value"])
+        out.append(f"{match['name']}{len(group)}")
+        for name, order in orders.items():
+            # entries that are 0 are left out of the protocol
+            kept = [renumber[v] for v in (order.get(i, 0) for i in range(n_slices)) if v in renumber]
+            out.extend(f"sSliceArray.{name}[{i}]\t = {v}" for i, v in enumerate(kept) if v)
+    text = "\n".join(out)
+    return NSLC.sub(lambda m: f"{m[1]}{len(group)}", text)
+
+
+def _slice_header(hdr, group):
+    """Measurement header bytes (read_twix's hdr_str) with every protocol buffer cut down to `group`."""
+    n_buffers = struct.unpack_from("<I", hdr, 4)[0]
+    pos = 8
+    body = []
+    for _ in range(n_buffers):
+        end = hdr.index(b"\0", pos)
+        length = struct.unpack_from("<I", hdr, end + 1)[0]
+        data = hdr[end + 5 : end + 5 + length]
+        data = _slice_protocol(data.decode("latin1"), group).encode("latin1")
+        body.append(hdr[pos : end + 1] + struct.pack("<I", len(data)) + data)
+        pos = end + 5 + length
+    body = b"".join(body)
+    padding = b"\0" * (-(8 + len(body)) % HEADER_ALIGN)
+    return struct.pack("<II", 8 + len(body) + len(padding), n_buffers) + body + padding
+
+
+def _copy_mdb(src, dst, mdb, scan_counter, sli=None, length=None):
+    """
+    Copy one MDB (`length` bytes, default its DMA length) from `src` to `dst`
+    with its scan counter (and slice counter) replaced.
+    """
+    import ctypes
+
+    from twixtools import mdh_def
+
+    src.seek(int(mdb.mem_pos))
+    block = bytearray(src.read(int(mdb.dma_len) if length is None else length))
+    if mdb.is_flag_set("SYNCDATA"):
+        # sync data keeps its counters, as in twixtools.write_twix
+        dst.write(block)
+        return False
+    mdh = mdh_def.Scan_header.from_buffer(block)
+    mdh.ScanCounter = scan_counter
+    if sli is not None:
+        mdh.Counter.Sli = sli
+    if not mdb.is_flag_set("ACQEND"):
+        for c in range(mdh.UsedChannels):
+            offset = ctypes.sizeof(mdh_def.Scan_header) + c * int(mdb.block_len)
+            mdh_def.Channel_header.from_buffer(block, offset).ScanCounter = scan_counter
+    dst.write(block)
+    return True
+
+
+def _copy_range(src, dst, start, length):
+    src.seek(start)
+    while length > 0:
+        chunk = src.read(min(length, COPY_CHUNK))
+        if not chunk:
+            raise ValueError("TWIX file is shorter than its header says")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _align(f):
+    f.write(b"\0" * (-f.tell() % SCAN_ALIGN))
+
+
+def split_slices(path, groups, out_dir):
+    """
+    Write one TWIX file per group of slice indices into `out_dir` and return
+    their paths. The file is copied MDB by MDB, never loading k-space data as a
+    whole: each part keeps the scans before the imaging one as they are, and of
+    the imaging scan the MDBs of its slices, renumbered from 0, under a
+    protocol whose slice array (sSliceArray, NSlc) lists only those slices.
+    Only VD/VE files (multi-RAID header) can be split.
+    """
+    import numpy as np
+    import twixtools
+    from twixtools import hdr_def
+
+    twix = twixtools.read_twix(
+        str(path), keep_acqend=True, parse_pmu=False, parse_geometry=False, verbose=False
+    )
+    meas = twix[-1]
+    if "raidfile_hdr" not in meas:
+        raise ValueError("only VD/VE TWIX files can be split")
+    with open(path, "rb") as f:
+        raid = np.fromfile(f, dtype=hdr_def.MultiRaidFileHeader, count=1)[0]
+    n_scans = int(raid["hdr"]["count_"])
+    scan_end = int(raid["entry"][n_scans - 1]["off_"]) + int(raid["entry"][n_scans - 1]["len_"])
+    hdr = meas["hdr_str"].tobytes()
+    control = [any(mdb.is_flag_set(flag) for flag in CONTROL_FLAGS) for mdb in meas["mdb"]]
+    paths = []
+    with open(path, "rb") as src:
+        for i, group in enumerate(groups):
+            renumber = {s: n for n, s in enumerate(group)}
+            target = Path(out_dir) / f"{Path(path).stem}-slices{i}.dat"
+            part = raid.copy()
+            with open(target, "wb") as dst:
+                dst.write(b"\0" * RAID_HEADER_SIZE)
+                for k in range(n_scans - 1):
+                    part["entry"][k]["off_"] = dst.tell()
+                    _copy_range(src, dst, int(raid["entry"][k]["off_"]), int(raid["entry"][k]["len_"]))
+                    _align(dst)
+                start = dst.tell()
+                dst.write(_slice_header(hdr, group))
+                counter = 1
+                for mdb, is_control in zip(meas["mdb"], control):
+                    sli = mdb.mdh.Counter.Sli
+                    if mdb.is_flag_set("ACQEND"):
+                        # its DMA length does not cover its header: it runs to the end of the scan
+                        _copy_mdb(src, dst, mdb, counter, length=scan_end - int(mdb.mem_pos))
+                    elif is_control or sli in renumber:
+                        counter += _copy_mdb(src, dst, mdb, counter, None if is_control else renumber[sli])
+                part["entry"][n_scans - 1]["off_"] = start
+                part["entry"][n_scans - 1]["len_"] = dst.tell() - start
+                _align(dst)
+                dst.seek(0)
+                dst.write(part.tobytes())
+            paths.append(target)
+    return paths
@@ -0,0 +1,342 @@
+"""
+Streaming, adaptive uploads for job results and failure bundles.
+
+StreamingUpload is a write-only file object: bytes written to it are cut into
+parts that are handed to an upload target while the producer keeps writing, so
+an archive can be compressed straight into S3 without ever existing on disk.
+Part size and concurrency are picked by `plan_upload` from the expected size
+and the memory left in the container; each part is retried on its own.
+"""
+import math
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import requests
+
+from resources import available_memory
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+# S3 multipart limits
+MIN_PART_SIZE = 5 * MiB
+MAX_PART_SIZE = 5 * GiB
+MAX_PARTS = 10000
+DEFAULT_PART_SIZE = 16 * MiB
+# aim for at least this many parts so that they can go out concurrently
+TARGET_PARTS = 8
+MAX_CONCURRENCY = 16
+# share of the free memory the ring of buffered parts may occupy
+MEMORY_SHARE = 0.25
+DEFAULT_RETRIES = 5
+# presigned single PUTs need a Content-Length, so the body is spooled; this much stays in memory
+PRESIGNED_SPOOL_BYTES = 256 * MiB
+
+
+def plan_upload(size_hint=None, memory=None, max_parts=MAX_PARTS):
+    """
+    Return (part_size, concurrency) for an upload of about `size_hint` bytes.
+
+    Parts are large enough to stay under `max_parts` and small enough that the
+    artifact splits into TARGET_PARTS; concurrency is capped so the buffered parts
+    fit in MEMORY_SHARE of the available memory.
+    """
+    if memory is None:
+        memory = available_memory() or 1 * GiB
+    part_size = DEFAULT_PART_SIZE
+    if size_hint:
+        part_size = max(math.ceil(size_hint / TARGET_PARTS), MIN_PART_SIZE)
+        part_size = min(part_size, 128 * MiB)
+        # 1% slack: zip headers can make the archive slightly larger than its inputs
+        part_size = max(part_size, math.ceil(size_hint * 1.01 / max_parts))
+    part_size = min(max(part_size, MIN_PART_SIZE), MAX_PART_SIZE)
+    # round up to whole MiB so part boundaries are easy to reason about
+    part_size = math.ceil(part_size / MiB) * MiB
+
+    concurrency = int(memory * MEMORY_SHARE // part_size)
+    if size_hint:
+        concurrency = min(concurrency, math.ceil(size_hint / part_size))
+    concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+    return part_size, concurrency
+
+
+class S3MultipartTarget:
+    """Upload parts to `bucket/key` with an S3 multipart upload."""
+
+    def __init__(self, client, bucket, key, content_type="application/zip"):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.upload_id = None
+        self.parts = {}
+
+    def begin(self):
+        resp = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+        )
+        self.upload_id = resp["UploadId"]
+
+    def put_part(self, number, data):
+        resp = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        self.parts[number] = resp["ETag"]
+
+    def put_single(self, data):
+        """Small artifacts go up in one PutObject instead of three multipart calls."""
+        self.client.put_object(
+            Bucket=self.bucket, Key=self.key, Body=data, ContentType=self.content_type
+        )
+
+    def complete(self):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [{"PartNumber": n, "ETag": self.parts[n]} for n in sorted(self.parts)]
+            },
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+
+class PresignedPutTarget:
+    """
+    Upload to a single presigned PUT URL.
+
+    S3 rejects chunked PUTs without a Content-Length, so parts are collected in a
+    spooled buffer (memory first, disk only past PRESIGNED_SPOOL_BYTES) and sent
+    in one request when the stream is closed.
+    """
+
+    # parts must arrive in order because they are appended to one body
+    sequential = True
+
+    def __init__(self, url, session=None, spool_bytes=PRESIGNED_SPOOL_BYTES, retries=DEFAULT_RETRIES):
+        self.url = url
+        self.session = session or requests
+        self.spool_bytes = spool_bytes
+        self.retries = retries
+        self.body = None
+
+    def begin(self):
+        self.body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+
+    def put_part(self, number, data):
+        self.body.write(data)
+
+    def complete(self):
+        try:
+            size = self.body.tell()
+
+            def _put():
+                self.body.seek(0)
+                result = self.session.put(
+                    self.url, data=self.body, headers={"Content-Length": str(size)}
+                )
+                result.raise_for_status()
+
+            _with_retries(_put, self.retries)
+        finally:
+            self.body.close()
+
+    def abort(self):
+        if self.body is not None:
+            self.body.close()
+
+
+class PresignedMultipartTarget:
+    """
+    Upload to a multipart upload created by the caller, who supplies one presigned
+    URL per part plus presigned CompleteMultipartUpload (and optionally Abort) URLs.
+    """
+
+    def __init__(self, part_urls, complete_url, abort_url=None, part_size=None, session=None):
+        self.part_urls = list(part_urls)
+        self.complete_url = complete_url
+        self.abort_url = abort_url
+        # set when the caller has already decided how the object is split
+        self.part_size = part_size
+        self.session = session or requests
+        self.parts = {}
+
+    @classmethod
+    def from_event(cls, spec, session=None):
+        """Build from the job's `presigned_upload_parts` block."""
+        return cls(
+            spec["part_urls"],
+            spec["complete_url"],
+            abort_url=spec.get("abort_url"),
+            part_size=spec.get("part_size"),
+            session=session,
+        )
+
+    @property
+    def max_parts(self):
+        return len(self.part_urls)
+
+    def begin(self):
+        pass
+
+    def put_part(self, number, data):
+        if number > len(self.part_urls):
+            raise ValueError(
+                f"result needs more than the {len(self.part_urls)} presigned parts provided"
+            )
+        result = self.session.put(self.part_urls[number - 1], data=data)
+        result.raise_for_status()
+        self.parts[number] = result.headers["ETag"]
+
+    def complete(self):
+        body = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{escape(self.parts[n])}</ETag></Part>"
+            for n in sorted(self.parts)
+        )
+        result = self.session.post(
+            self.complete_url,
+            data=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>",
+        )
+        result.raise_for_status()
+        # S3 can report a failed completion inside a 200 response
+        if b"<Error>" in result.content:
+            raise Exception(f"CompleteMultipartUpload failed: {result.text}")
+
+    def abort(self):
+        if self.abort_url:
+            self.session.delete(self.abort_url)
+
+
+def _with_retries(fn, retries):
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except ValueError:
+            # not transient
+            raise
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                raise
+            time.sleep(min(2**attempt * 0.25, 8))
+
+
+class StreamingUpload:
+    """
+    Write-only file object feeding `target` in `part_size` parts.
+
+    At most `ring` parts are buffered or uploading at any time; `write` blocks
+    when the ring is full. A failed part is retried on its own up to `retries`
+    times. Use as a context manager: a clean exit completes the upload, an
+    exception aborts it.
+    """
+
+    def __init__(self, target, part_size=DEFAULT_PART_SIZE, ring=4, retries=DEFAULT_RETRIES):
+        self.target = target
+        self.part_size = part_size
+        self.ring = ring
+        self.retries = retries
+        sequential = getattr(target, "sequential", False)
+        self._slots = threading.BoundedSemaphore(ring)
+        self._pool = ThreadPoolExecutor(max_workers=1 if sequential else ring)
+        self._buffer = bytearray()
+        self._futures = []
+        self._next_part = 1
+        self._started = False
+        self.bytes_written = 0
+        self.closed = False
+
+    @classmethod
+    def planned(cls, target, size_hint=None, **kwargs):
+        """StreamingUpload with part size and concurrency chosen by `plan_upload`."""
+        part_size, ring = plan_upload(size_hint, max_parts=getattr(target, "max_parts", MAX_PARTS))
+        part_size = getattr(target, "part_size", None) or part_size
+        return cls(target, part_size=part_size, ring=ring, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        # keep one part back so that a small artifact can still go up in one request
+        while len(self._buffer) > self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _submit(self, part):
+        if not self._started:
+            self.target.begin()
+            self._started = True
+        self._slots.acquire()
+        number = self._next_part
+        self._next_part += 1
+
+        def _upload():
+            try:
+                _with_retries(lambda: self.target.put_part(number, part), self.retries)
+            finally:
+                self._slots.release()
+
+        future = self._pool.submit(_upload)
+        self._futures.append(future)
+        # surface failures early instead of buffering the rest of the archive
+        for f in self._futures:
+            if f.done() and f.exception() is not None:
+                raise f.exception()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self._started and hasattr(self.target, "put_single"):
+                data = bytes(self._buffer)
+                _with_retries(lambda: self.target.put_single(data), self.retries)
+            else:
+                if self._buffer or self._next_part == 1:
+                    self._submit(bytes(self._buffer))
+                self._pool.shutdown(wait=True)
+                for f in self._futures:
+                    f.result()
+                self.target.complete()
+            self._buffer = bytearray()
+        except BaseException:
+            self.abort()
+            raise
+        self._pool.shutdown(wait=True)
+        self.closed = True
+
+    def abort(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self.closed = True
+        try:
+            self.target.abort()
+        except Exception as e:
+            print(f"failed to abort upload: {e}")
@@ -0,0 +1,171 @@
+"""
+Per-job scratch workspace.
+
+Every temporary artifact of a job (event JSON, mrotools input/log, OUT folder,
+failure bundle, partial downloads) lives under one directory that is removed
+when the job ends, so warm containers do not slowly fill their ephemeral
+storage. The workspace also checks free space before downloads start and keeps
+track of the job's peak disk usage.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+PREFIX = "mro-job-"
+OWNER_FILE = ".owner"
+# a workspace without an owner this young may be one another process is creating
+OWNERLESS_GRACE = 300
+
+# workspaces owned by this process; anything else with our pid is a leftover
+_active = set()
+_active_lock = threading.Lock()
+
+
+class WorkspaceFullError(Exception):
+    """Not enough ephemeral storage (or workspace budget) for the job."""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale(base, log=print):
+    """
+    Remove workspaces left behind by jobs that were killed before cleaning up
+    (e.g. a Lambda timeout on a container that is later reused).
+    """
+    removed = 0
+    for path in Path(base).glob(f"{PREFIX}*"):
+        try:
+            pid = int((path / OWNER_FILE).read_text())
+        except (OSError, ValueError):
+            pid = None
+        with _active_lock:
+            if path in _active:
+                continue
+        if pid is None:
+            try:
+                if time.time() - path.stat().st_mtime < OWNERLESS_GRACE:
+                    continue
+            except OSError:
+                continue
+        if pid is None or pid == os.getpid() or not _pid_alive(pid):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        log(f"removed {removed} stale job workspace(s) from {base}")
+    return removed
+
+
+def directory_usage(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class JobWorkspace:
+    """
+    Directory owning all temporary files of one job.
+
+    `budget_bytes` caps how much the job may write (default: MROTMPBUDGETBYTES,
+    otherwise only the free space of the filesystem counts). Use as a context
+    manager or call `cleanup()` explicitly.
+    """
+
+    def __init__(self, base=None, budget_bytes=None, monitor_interval=2.0, log=print):
+        self.base = Path(base or os.getenv("MROWORKDIR") or tempfile.gettempdir())
+        self.base.mkdir(parents=True, exist_ok=True)
+        sweep_stale(self.base, log=log)
+        self.root = Path(tempfile.mkdtemp(prefix=PREFIX, dir=self.base))
+        with _active_lock:
+            _active.add(self.root)
+        # other processes sweeping now see either no owner (and a young directory) or ours
+        owner = self.root / f"{OWNER_FILE}.{uuid.uuid4().hex}"
+        owner.write_text(str(os.getpid()))
+        os.replace(owner, self.root / OWNER_FILE)
+        if budget_bytes is None:
+            budget_bytes = int(os.getenv("MROTMPBUDGETBYTES", "0")) or None
+        self.budget_bytes = budget_bytes
+        self.peak_bytes = 0
+        self.log = log
+        self._stop = threading.Event()
+        self._monitor = None
+        if monitor_interval:
+            self._monitor = threading.Thread(
+                target=self._watch, args=(monitor_interval,), name="workspace-monitor", daemon=True
+            )
+            self._monitor.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+    def path(self, suffix=""):
+        """A fresh, unused file path inside the workspace."""
+        return self.root / f"{uuid.uuid4().hex}{suffix}"
+
+    def mkdir(self, name=None):
+        directory = self.root / (name or uuid.uuid4().hex)
+        directory.mkdir(parents=True)
+        return directory
+
+    def usage(self):
+        return directory_usage(self.root)
+
+    def sample(self):
+        """Record the current usage and return it."""
+        used = self.usage()
+        self.peak_bytes = max(self.peak_bytes, used)
+        return used
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            self.sample()
+
+    def available(self):
+        """Bytes the job may still write: free space, further capped by the budget."""
+        free = shutil.disk_usage(self.root).free
+        if self.budget_bytes is not None:
+            free = min(free, max(self.budget_bytes - self.usage(), 0))
+        return free
+
+    def check_budget(self, required_bytes, what="job"):
+        """Raise WorkspaceFullError if `required_bytes` cannot be written."""
+        available = self.available()
+        if required_bytes > available:
+            raise WorkspaceFullError(
+                f"{what} needs {required_bytes / 1e6:.1f} MB of scratch space but only "
+                f"{available / 1e6:.1f} MB is available in {self.base}"
+                + (f" (budget {self.budget_bytes / 1e6:.1f} MB)" if self.budget_bytes else "")
+            )
+        return available
+
+    def cleanup(self):
+        """Stop monitoring and delete everything in the workspace."""
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        if self.root.exists():
+            self.sample()
+            shutil.rmtree(self.root, ignore_errors=True)
+        with _active_lock:
+            _active.discard(self.root)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app modules are flat files in calculation/src, as in the container image
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,61 @@
+import io
+import os
+import zipfile
+
+import archive
+
+
+def _tree(root):
+    root.mkdir()
+    (root / "maps").mkdir()
+    (root / "empty").mkdir()
+    (root / "info.json").write_text('{"a": 1}' * 1000)
+    (root / "maps" / "snr.nii.gz").write_bytes(os.urandom(50_000))
+    # several blocks, so the deflate streams of the workers are concatenated
+    (root / "maps" / "noise.raw").write_bytes(bytes(range(256)) * 40_000)
+    return root
+
+
+def test_zip_directory_round_trip(tmp_path, monkeypatch):
+    root = _tree(tmp_path / "out")
+    buf = io.BytesIO()
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 64 * 1024)
+    stats = archive.zip_directory(root, buf, policy="fast", workers=4)
+    with zipfile.ZipFile(buf) as z:
+        assert z.testzip() is None
+        infos = {i.filename: i for i in z.infolist()}
+        assert set(infos) == {"empty/", "maps/", "info.json", "maps/snr.nii.gz", "maps/noise.raw"}
+        for name in ("info.json", "maps/snr.nii.gz", "maps/noise.raw"):
+            assert z.read(name) == (root / name).read_bytes()
+    assert infos["maps/snr.nii.gz"].compress_type == zipfile.ZIP_STORED
+    assert infos["maps/noise.raw"].compress_type == zipfile.ZIP_DEFLATED
+    assert stats["entries"] == 5
+    assert stats["bytes_out"] == len(buf.getvalue())
+
+
+def test_zip_directory_first_entries(tmp_path):
+    root = _tree(tmp_path / "out")
+    buf = io.BytesIO()
+    archive.zip_directory(root, buf, first=("maps/snr.nii.gz", "info.json"))
+    with zipfile.ZipFile(buf) as z:
+        assert z.namelist()[:2] == ["maps/snr.nii.gz", "info.json"]
+
+
+def test_zip_directory_unseekable_stream(tmp_path):
+    root = _tree(tmp_path / "out")
+
+    class Stream(io.RawIOBase):
+        def __init__(self):
+            self.data = bytearray()
+
+        def writable(self):
+            return True
+
+        def write(self, b):
+            self.data += b
+            return len(b)
+
+    stream = Stream()
+    archive.zip_directory(root, stream)
+    with zipfile.ZipFile(io.BytesIO(bytes(stream.data))) as z:
+        assert z.read("info.json") == (root / "info.json").read_bytes()
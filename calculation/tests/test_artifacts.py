@@ -0,0 +1,97 @@
+import copy
+
+import pytest
+
+import artifacts
+import workspace
+
+
+def _task(noise=True):
+    recon = {
+        "sensitivityMap": {"name": "inner", "options": {"sensitivityMapMethod": "inner"}},
+        "signal": {"type": "file", "options": {"type": "s3", "filename": "s.dat"}},
+    }
+    if noise:
+        recon["noise"] = {"type": "file", "options": {"type": "s3", "filename": "n.dat", "vendor": "MR Optimum"}}
+    return {"name": "ac", "options": {"reconstructor": {"options": recon}}}
+
+
+def _inputs(signal_etag="s1", noise_etag="n1"):
+    return {
+        "signal": {"bucket": "b", "key": "s.dat", "etag": signal_etag, "filename": "/tmp/s.dat"},
+        "noise": {"bucket": "b", "key": "n.dat", "etag": noise_etag, "filename": "/tmp/n.dat"},
+    }
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "engine_version", lambda: "1")
+    return artifacts.ArtifactCache(tmp_path / "cache", 10 * 1024 * 1024)
+
+
+@pytest.fixture
+def ws(tmp_path):
+    with workspace.JobWorkspace(tmp_path / "ws", log=lambda m: None) as w:
+        yield w
+
+
+def test_covariance_is_keyed_on_the_noise_scan_only(cache):
+    noise = cache.key(artifacts.NOISE_COVARIANCE, _task(), _inputs(), None)
+    assert noise is not None
+    assert cache.key(artifacts.NOISE_COVARIANCE, _task(), _inputs(signal_etag="s2"), None) == noise
+    assert cache.key(artifacts.NOISE_COVARIANCE, _task(), _inputs(noise_etag="n2"), None) != noise
+    # the maps depend on both scans
+    maps = cache.key(artifacts.SENSITIVITY, _task(), _inputs(), None)
+    assert cache.key(artifacts.SENSITIVITY, _task(), _inputs(signal_etag="s2"), None) != maps
+
+
+def test_covariance_needs_a_noise_scan(cache):
+    assert cache.key(artifacts.NOISE_COVARIANCE, _task(noise=False), _inputs(), None) is None
+    supplied = _task()
+    artifacts._load_noise_covariance(supplied["options"]["reconstructor"]["options"], "/tmp/nc.mat")
+    assert cache.key(artifacts.NOISE_COVARIANCE, supplied, _inputs(), None) is None
+
+
+def test_sensitivity_round_trip(cache, ws, tmp_path):
+    out = tmp_path / "OUT"
+    out.mkdir()
+    (out / "CoilSensitivities.nii.gz").write_bytes(b"maps")
+    (out / "SNR.nii.gz").write_bytes(b"snr")
+    assert cache.harvest(artifacts.SENSITIVITY, "k", out, ws, strip=True) == 1
+    assert not (out / "CoilSensitivities.nii.gz").exists() and (out / "SNR.nii.gz").exists()
+    task = _task()
+    assert cache.prepare(artifacts.SENSITIVITY, "k", task, ws)
+    opts = task["options"]["reconstructor"]["options"]["sensitivityMap"]["options"]
+    assert opts["loadSensitivity"] is True
+    with open(opts["sensitivityMapSource"]["options"]["filename"], "rb") as f:
+        assert f.read() == b"maps"
+    assert not cache.prepare(artifacts.SENSITIVITY, "other", _task(), ws)
+
+
+def test_covariance_round_trip(cache, ws, tmp_path):
+    np = pytest.importorskip("numpy")
+    scipy_io = pytest.importorskip("scipy.io")
+    covariance = np.array([[2.0, 0.5j], [-0.5j, 1.0]])
+    out = tmp_path / "OUT"
+    out.mkdir()
+    scipy_io.savemat(str(out / "results.mat"), {"SNR": np.ones((4, 4)), "NC": covariance})
+    assert cache.harvest(artifacts.NOISE_COVARIANCE, "k", out, ws) == 1
+    assert (out / "results.mat").exists()
+    task = _task()
+    before = copy.deepcopy(task)
+    assert cache.prepare(artifacts.NOISE_COVARIANCE, "k", task, ws)
+    recon = task["options"]["reconstructor"]["options"]
+    # the noise scan stays in place, the covariance is handed over next to it
+    assert recon["noise"] == before["options"]["reconstructor"]["options"]["noise"]
+    stored = scipy_io.loadmat(recon["noiseCovariance"]["options"]["filename"])["noiseCovariance"]
+    assert np.array_equal(stored, covariance)
+
+
+def test_covariance_missing_from_matlab_output(cache, ws, tmp_path):
+    np = pytest.importorskip("numpy")
+    scipy_io = pytest.importorskip("scipy.io")
+    out = tmp_path / "OUT"
+    out.mkdir()
+    scipy_io.savemat(str(out / "results.mat"), {"SNR": np.ones((4, 4))})
+    assert cache.harvest(artifacts.NOISE_COVARIANCE, "k", out, ws) == 0
+    assert not cache.prepare(artifacts.NOISE_COVARIANCE, "k", _task(), ws)
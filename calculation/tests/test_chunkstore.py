@@ -0,0 +1,79 @@
+import json
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+h5py = pytest.importorskip("h5py")
+
+import chunkstore  # noqa: E402
+
+GEOMETRY = {"origin": [0.0, 0.0, 0.0], "spacing": [1.0, 1.0, 2.0], "direction": [1, 0, 0, 0, 1, 0, 0, 0, 1], "axes": ["z", "y", "x"]}
+
+
+@pytest.fixture
+def out_dir(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    arrays = {
+        "SNR.nii.gz": rng.random((3, 8, 6)).astype(np.float32),
+        # constant slices deflate well, noise does not: both kinds of chunk
+        "sub/gfactor.nii.gz": np.ones((2, 4, 4), dtype=np.float64),
+    }
+    for name in arrays:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"nifti")
+    (tmp_path / "info.json").write_text("{}")
+    monkeypatch.setattr(
+        chunkstore, "read_map", lambda path: (arrays[path.relative_to(tmp_path).as_posix()], GEOMETRY)
+    )
+    return tmp_path
+
+
+def test_roles():
+    assert chunkstore.role("OUT/CoilSensitivities.nii.gz") == "coil_sensitivity"
+    assert chunkstore.role("noise_gfactor.nii") == "gfactor"
+    assert chunkstore.role("SNR.mat") is None
+
+
+def test_offsets_read_back(out_dir):
+    manifest = chunkstore.write(out_dir, level=6)
+    assert manifest == json.loads((out_dir / chunkstore.MANIFEST_NAME).read_text())
+    assert set(manifest["arrays"]) == {"SNR", "sub/gfactor"}
+    raw = (out_dir / chunkstore.STORE_NAME).read_bytes()
+    with h5py.File(out_dir / chunkstore.STORE_NAME, "r") as f:
+        for name, entry in manifest["arrays"].items():
+            assert [c[0] for c in entry["chunks"]] == list(range(entry["shape"][0]))
+            for index, offset, size, compressed in entry["chunks"]:
+                data = raw[offset:offset + size]
+                if compressed:
+                    data = zlib.decompress(data)
+                chunk = np.frombuffer(data, dtype=entry["dtype"]).reshape(entry["chunk_shape"][1:])
+                assert np.array_equal(chunk, f[name][index])
+            assert list(f[name].attrs["spacing"]) == GEOMETRY["spacing"]
+
+
+def test_nothing_to_store(tmp_path):
+    (tmp_path / "info.json").write_text("{}")
+    assert chunkstore.write(tmp_path) is None
+    assert not (tmp_path / chunkstore.STORE_NAME).exists()
+
+
+def test_failure_leaves_no_store(out_dir, monkeypatch):
+    def broken(path):
+        raise OSError("unreadable map")
+
+    monkeypatch.setattr(chunkstore, "read_map", broken)
+    with pytest.raises(OSError):
+        chunkstore.write(out_dir)
+    assert not (out_dir / chunkstore.STORE_NAME).exists()
+    assert not (out_dir / chunkstore.MANIFEST_NAME).exists()
+
+
+def test_read_map_adds_the_slice_axis(tmp_path):
+    sitk = pytest.importorskip("SimpleITK")
+    image = sitk.GetImageFromArray(np.arange(12, dtype=np.float32).reshape(3, 4))
+    image.SetSpacing((0.5, 2.0))
+    sitk.WriteImage(image, str(tmp_path / "SNR.nii.gz"))
+    array, geometry = chunkstore.read_map(tmp_path / "SNR.nii.gz")
+    assert array.shape == (1, 3, 4)
+    assert geometry["spacing"] == [0.5, 2.0] and geometry["axes"] == ["z", "y", "x"]
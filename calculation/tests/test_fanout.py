@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+# fanout reports progress through pynico, a dependency of the container image
+pytest.importorskip("pynico_eros_montin")
+import fanout  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "n_slices, workers, per_task, sizes",
+    [
+        (10, 4, None, [3, 3, 2, 2]),
+        (10, 3, None, [4, 3, 3]),
+        (3, 8, None, [1, 1, 1]),
+        (10, 1, 4, [4, 3, 3]),
+        (7, 4, 2, [2, 2, 2, 1]),
+        (5, 0, None, [5]),
+    ],
+)
+def test_slice_groups(n_slices, workers, per_task, sizes):
+    groups = fanout.slice_groups(n_slices, workers, per_task)
+    assert [len(g) for g in groups] == sizes
+    assert [s for g in groups for s in g] == list(range(n_slices))
+
+
+def _outs(tmp_path, n):
+    dirs = []
+    for i in range(n):
+        d = tmp_path / f"out{i}"
+        d.mkdir()
+        dirs.append(d)
+    return dirs
+
+
+def test_merge_info_and_shared_files(tmp_path):
+    dirs = _outs(tmp_path, 2)
+    for i, d in enumerate(dirs):
+        (d / "info.json").write_text(json.dumps({"headers": {"log": [f"group {i}"]}, "version": 1}))
+        (d / "options.txt").write_text("same")
+    out = tmp_path / "merged"
+    groups = [[0, 1], [2]]
+    fanout.merge(dirs, out, groups)
+    info = json.loads((out / "info.json").read_text())
+    assert info == {"headers": {"log": ["group 0", "group 1"]}, "version": 1, "slice_groups": groups}
+    assert (out / "options.txt").read_text() == "same"
+
+
+def test_merge_rejects_what_it_cannot_merge(tmp_path):
+    dirs = _outs(tmp_path, 2)
+    (dirs[0] / "a.txt").write_text("0")
+    (dirs[1] / "a.txt").write_text("1")
+    with pytest.raises(fanout.FanoutError):
+        fanout.merge(dirs, tmp_path / "merged", [[0], [1]])
+    (dirs[1] / "b.txt").write_text("1")
+    with pytest.raises(fanout.FanoutError):
+        fanout.merge(dirs, tmp_path / "merged", [[0], [1]])
+
+
+def test_merge_mat(tmp_path):
+    np = pytest.importorskip("numpy")
+    scipy_io = pytest.importorskip("scipy.io")
+    dirs = _outs(tmp_path, 2)
+    snr = np.arange(4 * 3 * 3, dtype=float).reshape(4, 3, 3)
+    noise = np.eye(2)
+    scipy_io.savemat(dirs[0] / "snr.mat", {"SNR": snr[:, :, :2], "Noise": noise})
+    # a single-slice group's map comes back 2D
+    scipy_io.savemat(dirs[1] / "snr.mat", {"SNR": snr[:, :, 2], "Noise": noise})
+    fanout.merge(dirs, tmp_path, [[0, 1], [2]])
+    merged = scipy_io.loadmat(tmp_path / "snr.mat")
+    np.testing.assert_array_equal(merged["SNR"], snr)
+    np.testing.assert_array_equal(merged["Noise"], noise)
+
+
+def test_merge_nifti(tmp_path):
+    np = pytest.importorskip("numpy")
+    sitk = pytest.importorskip("SimpleITK")
+    dirs = _outs(tmp_path, 2)
+    volume = np.random.default_rng(0).random((3, 4, 5)).astype(np.float32)
+    first = sitk.GetImageFromArray(volume[:2])
+    first.SetOrigin((1.0, 2.0, -10.0))
+    first.SetSpacing((0.5, 0.5, 5.0))
+    sitk.WriteImage(first, str(dirs[0] / "snr.nii.gz"))
+    second = sitk.GetImageFromArray(volume[2])
+    second.SetOrigin((1.0, 2.0))
+    second.SetSpacing((0.5, 0.5))
+    sitk.WriteImage(second, str(dirs[1] / "snr.nii.gz"))
+    slices = [{"position": [0.0, 0.0, -10.0 + 5 * i], "normal": [0.0, 0.0, 1.0]} for i in range(3)]
+    fanout.merge(dirs, tmp_path, [[0, 1], [2]], slices)
+    merged = sitk.ReadImage(str(tmp_path / "snr.nii.gz"))
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(merged), volume)
+    assert merged.GetOrigin() == pytest.approx((1.0, 2.0, -10.0))
+    assert merged.GetSpacing() == pytest.approx((0.5, 0.5, 5.0))
+
+
+def test_merge_single_slice_groups_need_positions(tmp_path):
+    np = pytest.importorskip("numpy")
+    sitk = pytest.importorskip("SimpleITK")
+    dirs = _outs(tmp_path, 2)
+    for d in dirs:
+        sitk.WriteImage(sitk.GetImageFromArray(np.zeros((4, 5), np.float32)), str(d / "snr.nii"))
+    with pytest.raises(fanout.FanoutError):
+        fanout.merge(dirs, tmp_path, [[0], [1]])
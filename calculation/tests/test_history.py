@@ -0,0 +1,63 @@
+import history
+from tracing import Tracer
+
+
+def _row(task, image, seconds, status="success"):
+    return {
+        "job_id": f"{image}-{seconds}",
+        "recorded_at": len(image) + seconds,
+        "task": task,
+        "reconstructor": "sense",
+        "status": status,
+        "image_uri": image,
+        "total_seconds": seconds,
+        "stages": '{"compute": %s}' % (seconds / 2),
+    }
+
+
+def test_job_row_and_record(tmp_path):
+    db = tmp_path / "history.sqlite"
+    tracer = Tracer()
+    tracer.properties["pipelineid"] = "p1"
+    with tracer.span("compute"):
+        pass
+    task = {"name": "pmr", "options": {"NR": 20, "reconstructor": {"name": "sense", "NR": 20, "options": {}}}}
+    row = history.job_row(
+        tracer, "success", task, probes={"signal": {"size": 100}, "noise": {"size": 5}},
+        identity={"platform": "fargate", "image_uri": "img:1"}, engine="subprocess",
+        peak_rss_bytes=123, dims={"slices": 4},
+    )
+    assert history.record(row, db)
+    (stored,) = history.rows(db)
+    assert (stored["task"], stored["reconstructor"], stored["pipeline_id"]) == ("pmr", "sense", "p1")
+    assert (stored["input_bytes"], stored["peak_rss_bytes"], stored["platform"]) == (105, 123, "fargate")
+    assert history.metric_value(stored, "compute") is not None
+    assert history.rows(db, status="failure") == []
+
+
+def test_summary(tmp_path):
+    db = tmp_path / "history.sqlite"
+    for seconds in (10, 20, 30, 40):
+        history.record(_row("pmr", "img:1", seconds), db)
+    history.record(_row("pmr", "img:1", 1000, status="failure"), db)
+    history.record(_row("ac", "img:1", 5), db)
+    summary = history.summarize(history.rows(db), "pipeline", "total_seconds")
+    assert summary["pmr/sense"] == {"n": 4, "p50": 25, "p90": 37, "p99": 39.7, "max": 40}
+    assert summary["ac/sense"]["n"] == 1
+    assert history.summarize(history.rows(db), "pipeline", "compute")["pmr/sense"]["max"] == 20
+
+
+def test_regressions(tmp_path, capsys):
+    db = tmp_path / "history.sqlite"
+    for seconds in (10, 11, 12):
+        history.record(_row("pmr", "img:1", seconds), db)
+    for seconds in (20, 21, 22):
+        history.record(_row("pmr", "img:22", seconds), db)
+    for seconds in (10, 10, 10):
+        history.record(_row("ac", "img:1", seconds), db)
+        history.record(_row("ac", "img:22", seconds), db)
+    (found,) = history.regressions(history.rows(db), "image", "total_seconds")
+    assert (found["pipeline"], found["before"], found["after"]) == ("pmr/sense", "img:1", "img:22")
+    assert found["ratio"] == round(21 / 11, 3)
+    assert history.main(["--db", str(db), "regressions"]) == 1
+    assert "pmr/sense" in capsys.readouterr().out
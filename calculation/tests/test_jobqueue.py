@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+import jobqueue
+
+
+class SQS:
+    """Records calls and hands out queued messages."""
+
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.calls = []
+
+    def send_message(self, **kwargs):
+        self.calls.append(("send_message", kwargs))
+        return {"MessageId": "m1"}
+
+    def receive_message(self, **kwargs):
+        self.calls.append(("receive_message", kwargs))
+        return {"Messages": [self.messages.pop(0)]} if self.messages else {}
+
+    def delete_message(self, **kwargs):
+        self.calls.append(("delete_message", kwargs))
+
+    def change_message_visibility(self, **kwargs):
+        self.calls.append(("change_message_visibility", kwargs))
+
+
+def test_file_queue_ack(tmp_path):
+    queue = jobqueue.FileQueue(tmp_path, visibility_timeout=60, poll_interval=0.01)
+    queue.send('{"n": 1}')
+    queue.send('{"n": 2}')
+    first = queue.receive(0)
+    assert first.json() == {"n": 1}
+    assert queue.receive(0).json() == {"n": 2}
+    assert queue.receive(0) is None
+    queue.ack(first)
+    with pytest.raises(ValueError):
+        queue.ack(first)
+
+
+def test_file_queue_redelivery_and_dead_letter(tmp_path):
+    queue = jobqueue.FileQueue(tmp_path, visibility_timeout=0.05, max_receives=2, poll_interval=0.01)
+    queue.send("job")
+    first = queue.receive(0)
+    time.sleep(0.1)
+    second = queue.receive(1)
+    assert (second.id, second.receive_count) == (first.id, 2)
+    # the first delivery's receipt went stale with the redelivery
+    with pytest.raises(ValueError):
+        queue.ack(first)
+    time.sleep(0.1)
+    assert queue.receive(0.1) is None
+    assert queue.dead() == ["job"]
+
+
+def test_file_queue_release_and_dead_letter(tmp_path):
+    queue = jobqueue.FileQueue(tmp_path, visibility_timeout=60, poll_interval=0.01)
+    queue.send("job")
+    queue.release(queue.receive(0))
+    message = queue.receive(0)
+    assert message.receive_count == 2
+    queue.dead_letter(message, "failed")
+    assert queue.dead() == ["job"]
+    assert queue.receive(0) is None
+
+
+def test_sqs_queue():
+    client = SQS([{"MessageId": "m1", "Body": "job", "ReceiptHandle": "r1",
+                   "Attributes": {"ApproximateReceiveCount": "2"}}])
+    queue = jobqueue.SQSQueue("q", client=client, visibility_timeout=30)
+    message = queue.receive(60)
+    assert (message.body, message.receipt, message.receive_count) == ("job", "r1", 2)
+    assert client.calls[-1][1]["WaitTimeSeconds"] == 20
+    assert queue.receive() is None
+    queue.extend(message)
+    queue.release(message)
+    queue.ack(message)
+    assert [kwargs.get("VisibilityTimeout") for name, kwargs in client.calls if name == "change_message_visibility"] == [30, 0]
+    assert client.calls[-1] == ("delete_message", {"QueueUrl": "q", "ReceiptHandle": "r1"})
+
+
+def test_sqs_dead_letter():
+    client = SQS()
+    queue = jobqueue.SQSQueue("q", client=client, dead_letter_url="dlq")
+    queue.dead_letter(jobqueue.Message("m1", "job", "r1"), "boom")
+    (_, sent), (_, deleted) = client.calls
+    assert (sent["QueueUrl"], sent["MessageBody"]) == ("dlq", "job")
+    assert sent["MessageAttributes"]["reason"]["StringValue"] == "boom"
+    assert deleted["ReceiptHandle"] == "r1"
+
+
+def test_sqs_dead_letter_without_dlq_leaves_the_message():
+    client = SQS()
+    jobqueue.SQSQueue("q", client=client).dead_letter(jobqueue.Message("m1", "job", "r1"), "boom")
+    # redelivered until the queue's redrive policy moves it
+    assert client.calls == []
+
+
+def test_sqs_final_dead_letter_without_dlq_deletes():
+    client = SQS()
+    jobqueue.SQSQueue("q", client=client).dead_letter(jobqueue.Message("m1", "job", "r1"), "bad", final=True)
+    assert client.calls == [("delete_message", {"QueueUrl": "q", "ReceiptHandle": "r1"})]
+
+
+def test_open_queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("MROQUEUEDLQURL", "dlq")
+    assert isinstance(jobqueue.open_queue(f"file://{tmp_path}"), jobqueue.FileQueue)
+    assert isinstance(jobqueue.open_queue("memory://"), jobqueue.MemoryQueue)
+    with pytest.raises(ValueError):
+        jobqueue.open_queue("ftp://host/q")
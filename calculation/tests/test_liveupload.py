@@ -0,0 +1,102 @@
+import json
+import threading
+
+import liveupload
+
+
+class S3:
+    """put/delete of whole objects, with every call recorded in order."""
+
+    def __init__(self, on_put=None):
+        self.objects = {}
+        self.calls = []
+        self.on_put = on_put
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        body = Body if isinstance(Body, bytes) else bytes(Body)
+        with self.lock:
+            self.calls.append(("put", Key))
+            self.objects[Key] = body
+        if self.on_put:
+            self.on_put(Key)
+
+    def delete_object(self, Bucket, Key):
+        with self.lock:
+            self.calls.append(("delete", Key))
+            self.objects.pop(Key, None)
+
+
+def _live(out_dir, client):
+    return liveupload.LiveUpload(out_dir, client, "results", "job/", interval=60, settle=0, workers=2, log=lambda m: None)
+
+
+def _settle(live):
+    # a file goes up once it looked the same on two scans
+    live.scan()
+    live.scan()
+    for _, future in list(live._inflight.values()):
+        future.result()
+
+
+def test_uploads_then_writes_the_manifest_last(tmp_path):
+    (tmp_path / "SNR.nii.gz").write_bytes(b"snr")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "info.json").write_text("{}")
+    client = S3()
+    live = _live(tmp_path, client)
+    _settle(live)
+    (tmp_path / "late.mat").write_bytes(b"late")
+    manifest = live.finish()
+    assert client.calls[-1] == ("put", "job/_manifest.json")
+    assert json.loads(client.objects["job/_manifest.json"]) == manifest
+    assert [f["path"] for f in manifest["files"]] == ["SNR.nii.gz", "late.mat", "sub/info.json"]
+    assert manifest["uploaded_live"] == ["SNR.nii.gz", "sub/info.json"]
+    assert client.objects["job/late.mat"] == b"late"
+    assert live.finished
+
+
+def test_file_changed_during_upload_is_sent_again(tmp_path):
+    target = tmp_path / "SNR.nii.gz"
+    target.write_bytes(b"first")
+
+    def rewrite(key):
+        if key == "job/SNR.nii.gz" and target.read_bytes() == b"first":
+            target.write_bytes(b"second version")
+
+    client = S3(on_put=rewrite)
+    live = _live(tmp_path, client)
+    _settle(live)
+    assert "SNR.nii.gz" not in live.uploaded
+    manifest = live.finish()
+    assert client.calls.count(("put", "job/SNR.nii.gz")) == 2
+    assert client.objects["job/SNR.nii.gz"] == b"second version"
+    assert manifest["files"][0]["size"] == len(b"second version")
+    assert manifest["uploaded_live"] == []
+
+
+def test_files_gone_from_out_are_deleted_before_the_manifest(tmp_path):
+    (tmp_path / "keep.nii.gz").write_bytes(b"keep")
+    (tmp_path / "CoilSensitivities.nii.gz").write_bytes(b"maps")
+    client = S3()
+    live = _live(tmp_path, client)
+    _settle(live)
+    # stripped from OUT after compute, e.g. an artifact only computed for the cache
+    (tmp_path / "CoilSensitivities.nii.gz").unlink()
+    manifest = live.finish()
+    assert "job/CoilSensitivities.nii.gz" not in client.objects
+    assert client.calls[-2:] == [("delete", "job/CoilSensitivities.nii.gz"), ("put", "job/_manifest.json")]
+    assert [f["path"] for f in manifest["files"]] == ["keep.nii.gz"]
+
+
+def test_abort_deletes_every_object(tmp_path):
+    (tmp_path / "a.nii.gz").write_bytes(b"a")
+    (tmp_path / "b.nii.gz").write_bytes(b"b")
+    client = S3()
+    live = _live(tmp_path, client)
+    _settle(live)
+    assert set(client.objects) == {"job/a.nii.gz", "job/b.nii.gz"}
+    live.abort()
+    assert client.objects == {}
+    assert ("put", "job/_manifest.json") not in client.calls
+    assert live.finished
@@ -0,0 +1,84 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import multijob
+
+
+@pytest.mark.parametrize(
+    "cpus, workers, sets",
+    [
+        (range(4), 2, [[0, 1], [2, 3]]),
+        (range(5), 2, [[0, 1, 2], [3, 4]]),
+        ([6, 2, 4], 3, [[2], [4], [6]]),
+        (range(2), 3, [[0], [1], [0]]),
+    ],
+)
+def test_partition_cpus(cpus, workers, sets):
+    assert multijob.partition_cpus(cpus, workers) == sets
+
+
+def test_worker_takes_its_slot(tmp_path, monkeypatch):
+    pinned = []
+    monkeypatch.setattr(os, "sched_setaffinity", lambda pid, cpus: pinned.append(cpus), raising=False)
+    for var in ("MROWORKDIR", "MROINPUTCACHEDIR", "MROINPUTCACHEMAXBYTES"):
+        monkeypatch.setenv(var, "")
+    slots = queue.Queue()
+    slots.put((1, [2, 3]))
+    multijob._init_worker(slots, str(tmp_path), 1000)
+    assert pinned == [[2, 3]]
+    assert os.environ["MROWORKDIR"] == str(tmp_path / "mro-worker-1")
+    assert os.environ["MROINPUTCACHEDIR"] == str(tmp_path / "mro-worker-1" / "input-cache")
+    assert os.environ["MROINPUTCACHEMAXBYTES"] == "1000"
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch):
+    gates = {}
+
+    def run_job(event):
+        gates[event].wait(5)
+        return {"statusCode": 200, "body": event}
+
+    monkeypatch.setattr(multijob.MultiJobExecutor, "_start_pool", lambda self: ThreadPoolExecutor(self.workers))
+    monkeypatch.setattr(multijob, "_run_job", run_job)
+    monkeypatch.setenv("MROINPUTCACHEMAXBYTES", "4000")
+    # the executor sets the BLAS thread limits of its workers in this process
+    for var in multijob.BLAS_THREAD_VARS:
+        monkeypatch.delenv(var, raising=False)
+    ex = multijob.MultiJobExecutor(workers=2, memory_budget_mb=1000, estimate=lambda e: 600,
+                                   base_dir=tmp_path, log=lambda m: None)
+    ex.gates = gates
+    yield ex
+    for gate in gates.values():
+        gate.set()
+    ex.shutdown()
+
+
+def test_cache_budget_is_split(executor):
+    assert executor.cache_bytes == 2000
+
+
+def test_memory_admission(executor):
+    for name in ("a", "b", "c"):
+        executor.gates[name] = threading.Event()
+    first = executor.submit("a")
+    started = threading.Event()
+    second = []
+    thread = threading.Thread(target=lambda: (second.append(executor.submit("b")), started.set()))
+    thread.start()
+    # 600 + 600 MB does not fit the 1000 MB budget: b waits for a
+    assert not started.wait(0.2)
+    assert (executor.running, executor.reserved_mb) == (1, 600)
+    executor.gates["a"].set()
+    assert first.result(5)["body"] == "a"
+    assert started.wait(5)
+    # a job bigger than the whole budget still runs, alone
+    executor.gates["b"].set()
+    second[0].result(5)
+    assert executor.wait_idle(5)
+    executor.gates["c"].set()
+    assert executor.submit("c", memory_mb=5000).result(5)["body"] == "c"
@@ -0,0 +1,75 @@
+import pytest
+
+# planner splits jobs through fanout, which reports progress through pynico
+pytest.importorskip("pynico_eros_montin")
+import planner  # noqa: E402
+import platform_selector  # noqa: E402
+import twixfile  # noqa: E402
+
+MB = 1024 * 1024
+DIMS = {"measurements": 2, "slices": 10, "partitions": 1, "columns": 256, "lines": 256,
+        "channels": 32, "repetitions": 1, "averages": 1}
+TASK = {"name": "pmr", "options": {"NR": 20, "reconstructor": {"name": "sense", "options": {}}}}
+OUTPUT = {"coilsensitivity": False, "gfactor": True, "matlab": False}
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(twixfile, "read_dims", lambda path: dict(DIMS))
+    signal = tmp_path / "signal.dat"
+    noise = tmp_path / "noise.dat"
+    with open(signal, "wb") as f:
+        f.truncate(1000 * MB)
+    with open(noise, "wb") as f:
+        f.truncate(10 * MB)
+    return {
+        "signal": {"filename": str(signal), "vendor": "Siemens"},
+        "noise": {"filename": str(noise), "vendor": "Siemens"},
+    }
+
+
+def _plan(inputs, available_mb, limit_mb=32768, workers=4):
+    return planner.plan(TASK, inputs, OUTPUT, workers, available_mb * MB, limit_mb * MB)
+
+
+def test_estimate_matches_the_selector(inputs):
+    features = platform_selector.task_features(TASK, OUTPUT)
+    peak = planner.estimate(DIMS, 1000 * MB, 10 * MB, TASK, OUTPUT)
+    assert peak["full_mb"] == platform_selector.peak_memory_mb(1010 * MB, features)
+    assert peak["slice_mb"] == platform_selector.peak_memory_mb(110 * MB, features)
+
+
+def test_whole(inputs):
+    plan = _plan(inputs, 64 * 1024)
+    assert plan["mode"] == "full"
+    assert plan["peak"]["full_mb"] <= plan["budget_mb"]
+
+
+def test_sliced(inputs):
+    peak = planner.estimate(DIMS, 1000 * MB, 10 * MB, TASK, OUTPUT)
+    available = int(max(peak["slice_mb"] * 2, peak["split_mb"]) / planner.DEFAULT_HEADROOM) + 1
+    plan = _plan(inputs, available)
+    assert plan["mode"] == "sliced"
+    assert 1 <= plan["workers"] <= 4
+    assert plan["workers"] * peak["slice_mb"] <= plan["budget_mb"]
+
+
+def test_not_splittable_runs_whole_within_the_limit(inputs, monkeypatch):
+    # a 3D acquisition cannot be split into slices
+    monkeypatch.setattr(twixfile, "read_dims", lambda path: dict(DIMS, partitions=64))
+    plan = _plan(inputs, 1024)
+    assert plan["mode"] == "full"
+    assert plan["peak"]["full_mb"] > plan["budget_mb"]
+
+
+def test_sliced_one_at_a_time_below_the_budget(inputs):
+    peak = planner.estimate(DIMS, 1000 * MB, 10 * MB, TASK, OUTPUT)
+    plan = _plan(inputs, peak["slice_mb"] // 2, limit_mb=peak["full_mb"] * 2)
+    assert (plan["mode"], plan["workers"]) == ("sliced", 1)
+
+
+def test_refuse_past_the_limit(inputs):
+    plan = _plan(inputs, 512, limit_mb=512)
+    assert plan["mode"] == "refuse"
+    assert plan["recommended_mb"] >= platform_selector.FARGATE_MIN_MEMORY_MB
+    assert "512 MB" in plan["reason"]
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import platform_selector
+
+MB = 1024 * 1024
+
+
+def _job(reconstructor="rss", task="snr", mask=None, nr=None, signal="data/signal.dat", noise="data/noise.dat"):
+    def entry(path):
+        bucket, key = path.split("/", 1)
+        return {"type": "file", "options": {"type": "s3", "bucket": bucket, "key": key, "filename": key}}
+
+    recon_opts = {"name": reconstructor, "signal": entry(signal), "noise": entry(noise)}
+    if mask:
+        recon_opts["sensitivityMap"] = {"options": {"mask": {"method": mask}}}
+    task_opts = {"reconstructor": {"name": reconstructor, "options": recon_opts}, "slices": 10}
+    if nr:
+        task_opts["NR"] = nr
+    return {"task": {"name": task, "options": task_opts}, "output": {"coilsensitivity": True}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "data").mkdir()
+    for name, size in (("signal.dat", 200 * MB), ("noise.dat", 5 * MB), ("big.dat", 3000 * MB)):
+        with open(tmp_path / "data" / name, "wb") as f:
+            f.truncate(size)
+    return platform_selector.LocalObjectStore(tmp_path)
+
+
+def test_features_from_local_store(store):
+    features = platform_selector.job_features(_job("sense", "pmr", "espirit", nr=30), store)
+    assert features["input_sizes"] == {"signal.dat": 200 * MB, "noise.dat": 5 * MB}
+    assert (features["reconstructor"], features["mask"], features["nr"], features["slices"]) == ("sense", "espirit", 30, 10)
+
+
+def test_prediction_grows_with_the_data(store):
+    small = platform_selector.predict(platform_selector.job_features(_job(), store))
+    big = platform_selector.predict(platform_selector.job_features(_job(signal="data/big.dat"), store))
+    assert small["input_bytes"] == 205 * MB
+    assert big["peak_memory_mb"] > small["peak_memory_mb"]
+    assert big["runtime_seconds"] > small["runtime_seconds"]
+
+
+def test_small_job_runs_on_lambda(store):
+    decision = platform_selector.select_platform(_job(), store, "cost")
+    assert decision["platform"] == "lambda"
+    assert not decision["useFargate"]
+    assert decision["memoryMB"] <= platform_selector.LAMBDA_MEMORY_MB
+
+
+def test_big_job_runs_on_fargate(store):
+    decision = platform_selector.select_platform(_job("sense", "pmr", "espirit", signal="data/big.dat"), store)
+    assert decision["useFargate"]
+    assert decision["reason"].startswith("does not fit Lambda")
+    assert int(decision["fargateMemory"]) == decision["memoryMB"] >= platform_selector.FARGATE_FLOOR_MB
+    assert decision["memoryMB"] <= platform_selector.FARGATE_MAX_MEMORY_MB
+
+
+def test_fargate_memory_floor():
+    assert platform_selector.fargate_memory_mb(100) == platform_selector.FARGATE_FLOOR_MB == 16384
+    assert platform_selector.fargate_memory_mb(10**6) == platform_selector.FARGATE_MAX_MEMORY_MB
+
+
+def test_unknown_sizes_route_by_task_name(store):
+    decision = platform_selector.select_platform(_job(task="pmr", signal="data/missing.dat"), store)
+    assert decision["useFargate"]
+    assert decision["fargateMemory"] == "16384"
+    assert decision["reason"] == "input sizes unknown, routed by task name"
+
+
+def test_handler_state_output_fits_the_override(store, tmp_path):
+    job = _job("sense", "pmr", "espirit", signal="data/big.dat")
+    job["task"]["options"]["slices"] = list(range(500))
+    (tmp_path / "jobs").mkdir()
+    (tmp_path / "jobs" / "job.json").write_text(json.dumps(job))
+    event = {"Records": [{"s3": {"bucket": {"name": "jobs"}, "object": {"key": "job.json"}}}]}
+    output = platform_selector.lambda_handler(event, store=store)
+    assert output["platform"] == "fargate"
+    assert set(output) == {"useFargate", "platform", "memoryMB", "fargateMemory", "reason", "prediction"}
+    assert output["prediction"]["peak_memory_mb"] > 0
+    # the state machine passes the whole state to the Fargate task as one override
+    state = dict(event, platform=output)
+    assert len(json.dumps(state)) < 8192
+
+
+def test_handler_defaults_to_lambda_on_unreadable_job(store):
+    event = {"Records": [{"s3": {"bucket": {"name": "jobs"}, "object": {"key": "missing.json"}}}]}
+    assert platform_selector.lambda_handler(event, store=store)["platform"] == "lambda"
@@ -0,0 +1,70 @@
+import preflight
+
+
+def _file(kind="s3", **opts):
+    options = {"type": kind, "filename": "meas.dat", "vendor": "Siemens", **opts}
+    if kind == "s3":
+        options.update(bucket="b", key="meas.dat")
+    return {"type": "file", "options": options}
+
+
+def _task(name="ac", **recon_opts):
+    opts = {"signal": _file(), "noise": _file(), "sensitivityMap": {"options": {}}, **recon_opts}
+    return {"name": name, "options": {"reconstructor": {"name": "sense", "options": opts}}}
+
+
+def _validate(task, output=None):
+    logged = []
+    return preflight.validate(task, output or {"matlab": True}, log=logged.append), logged
+
+
+def test_valid_job():
+    assert _validate(_task()) == ([], [])
+
+
+def test_rejects_a_bad_spec():
+    task = _task(NR=0, noise=None)
+    task["options"]["reconstructor"]["options"]["signal"]["options"].pop("bucket")
+    problems, _ = _validate(task, {"gfactor": "yes"})
+    assert any(p.startswith("reconstructor.options.NR") for p in problems)
+    assert any(p.startswith("noise: not a file entry") for p in problems)
+    assert any(p.startswith("signal.options: needs bucket") for p in problems)
+    assert any(p.startswith("output.gfactor") for p in problems)
+
+
+def test_unknown_task_is_left_to_mrotools():
+    problems, logged = _validate(_task(name="newsnr"))
+    assert problems == []
+    assert any("newsnr" in line for line in logged)
+    problems, _ = _validate(_task(name=""))
+    assert problems == ["task.name: missing"]
+
+
+def test_local_inputs_are_not_available():
+    problems, _ = _validate(_task(noise=_file("local")))
+    assert problems == ["noise.options.type: 'local' files are not available to the job, upload it to S3"]
+    problems, _ = _validate(_task(signal=_file("local")))
+    assert [p.split(":")[0] for p in problems] == ["signal.options.type"]
+
+
+def test_noise_rules():
+    # mr needs no noise, so a local one is not used and not a problem
+    assert _validate(_task(name="mr", noise=_file("local")))[0] == []
+    no_noise = _task()
+    del no_noise["options"]["reconstructor"]["options"]["noise"]
+    assert [p.split(":")[0] for p in _validate(no_noise)[0]] == ["noise"]
+    multiraid = _task(signal=_file(multiraid=True))
+    del multiraid["options"]["reconstructor"]["options"]["noise"]
+    assert _validate(multiraid)[0] == []
+
+
+def test_check_inputs():
+    inputs = {
+        "signal": {"bucket": "b", "key": "s.dat", "filename": "s.dat", "vendor": "Siemens"},
+        "noise": {"presigned_url": "https://h/n.dat?X-Amz-Signature=x", "filename": "n.dat"},
+    }
+    problems = preflight.check_inputs(inputs, {"signal": {"size": 100}, "noise": {"error": "403"}})
+    assert problems == [
+        "signal: s3://b/s.dat has 100 bytes, too small for Siemens raw data",
+        "noise: https://h/n.dat is not readable (403)",
+    ]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import previews  # noqa: E402
+
+GEOMETRY = {"origin": [0.0, 0.0, 0.0], "spacing": [1.0, 1.0, 1.0], "direction": [1, 0, 0, 0, 1, 0, 0, 0, 1], "axes": ["z", "y", "x"]}
+
+
+@pytest.fixture
+def out_dir(tmp_path, monkeypatch):
+    snr = np.arange(2 * 16 * 12, dtype=np.float32).reshape(2, 16, 12)
+    # four coils: the preview is their root sum of squares
+    coils = np.ones((2, 6, 6, 4), dtype=np.complex64)
+    arrays = {"SNR.nii.gz": snr, "CoilSensitivities.nii.gz": coils}
+    for name in arrays:
+        (tmp_path / name).write_bytes(b"nifti")
+    monkeypatch.setattr(previews.chunkstore, "read_map", lambda path: (arrays[path.name], GEOMETRY))
+    return tmp_path
+
+
+def test_downsample_ignores_non_finite():
+    array = np.array([[[1.0, 3.0, 5.0], [np.nan, 2.0, 7.0]]], dtype=np.float32)
+    level = previews.downsample(array, 2)
+    assert level.shape == (1, 1, 1)
+    assert level[0, 0, 0] == 2.0
+
+
+def test_pyramid_levels(out_dir):
+    manifest = previews.write(out_dir, factors=[2, 4, 8])
+    assert manifest == json.loads((out_dir / previews.MANIFEST_NAME).read_text())
+    snr = manifest["maps"]["SNR"]
+    # coarsest first; 8 does not fit the 12-pixel width
+    assert [level["factor"] for level in snr["levels"]] == [8, 4, 2]
+    assert [level["shape"] for level in snr["levels"]] == [[2, 2, 1], [2, 4, 3], [2, 8, 6]]
+    for level in snr["levels"]:
+        data = np.fromfile(out_dir / level["file"], dtype="<u1")
+        assert data.size == level["bytes"] == np.prod(level["shape"])
+    lo, hi = snr["window"]
+    assert snr["stats"]["min"] <= lo < hi <= snr["stats"]["max"]
+    coils = manifest["maps"]["CoilSensitivities"]
+    assert coils["shape"] == [2, 6, 6]
+    assert [level["factor"] for level in coils["levels"]] == [4, 2]
+    lead = previews.leading_entries(manifest)
+    assert lead[0] == previews.MANIFEST_NAME and lead[-1] == f"{previews.PREVIEW_DIR}/"
+    assert lead[1].endswith(".x8.u8")
+
+
+def test_float16_keeps_values(out_dir):
+    manifest = previews.write(out_dir, factors=[2], dtype="float16")
+    level = manifest["maps"]["CoilSensitivities"]["levels"][0]
+    data = np.fromfile(out_dir / level["file"], dtype="<f2")
+    assert np.allclose(data, 2.0)
+
+
+def test_failure_leaves_no_previews(out_dir, monkeypatch):
+    def broken(path):
+        raise OSError("unreadable map")
+
+    monkeypatch.setattr(previews.chunkstore, "read_map", broken)
+    with pytest.raises(OSError):
+        previews.write(out_dir, factors=[2])
+    assert not (out_dir / previews.PREVIEW_DIR).exists()
+    assert not (out_dir / previews.MANIFEST_NAME).exists()
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pynico_eros_montin")
+
+import progress  # noqa: E402
+
+
+def test_parse():
+    event = progress.parse("reconstructing pseudo-replica 25 of 100", "stdout")
+    assert (event["stage"], event["index"], event["total"], event["percent"]) == ("pseudoreplica", 25, 100, 25.0)
+    assert progress.parse("done: 150%", "stdout")["percent"] == 100.0
+    assert progress.parse("loading data", "stdout") is None
+    # a log entry is a milestone even without a counter
+    assert progress.parse("loading data", "log")["stage"] is None
+
+
+def _write_log(path, entries, tick):
+    path.write_text(json.dumps({"log": entries}))
+    # a distinct mtime for every write, as the monitor compares it
+    os.utime(path, ns=(tick * 10**9, tick * 10**9))
+
+
+def test_poll_log_emits_only_new_entries(tmp_path):
+    log = tmp_path / "snr.log"
+    events = []
+    monitor = progress.Monitor(log, sinks=[events.append], labels={"Task": "ac"}, interval=1)
+    monitor.poll_log()
+    assert events == []
+    entries = [{"what": "INFO", "text": "slice 1/4"}]
+    _write_log(log, entries, 1)
+    monitor.poll_log()
+    # unchanged file: nothing new
+    monitor.poll_log()
+    entries += [{"what": "INFO", "text": "slice 2/4"}, {"what": "INFO", "text": "slice 3/4"}]
+    _write_log(log, entries, 2)
+    monitor.poll_log()
+    assert [e["index"] for e in events] == [1, 2, 3]
+    assert events[-1]["labels"] == {"Task": "ac"} and events[-1]["source"] == "log"
+    assert monitor.to_dict() == {"events": 3, "stage": "slice", "percent": 75.0, "error": None}
+
+
+def test_first_error_is_kept(tmp_path):
+    log = tmp_path / "snr.log"
+    monitor = progress.Monitor(log, sinks=[], interval=1)
+    entries = [{"what": "ERROR", "text": "singular matrix"}, {"what": "ERROR", "text": "later"}]
+    _write_log(log, entries, 1)
+    monitor.poll_log()
+    assert monitor.error == "ERROR singular matrix"
+
+
+def test_file_sink_and_failing_sink(tmp_path, capsys):
+    target = tmp_path / "progress.jsonl"
+
+    def broken(event):
+        raise RuntimeError("down")
+
+    monitor = progress.Monitor(None, sinks=[broken, progress.file_sink(target)], interval=1)
+    monitor.feed_stdout("coil 2 of 8")
+    monitor.feed_stdout("no progress here")
+    lines = [json.loads(line) for line in target.read_text().splitlines()]
+    assert [(e["stage"], e["percent"]) for e in lines] == [("coil", 25.0)]
+    assert "progress sink failed: down" in capsys.readouterr().out
@@ -0,0 +1,59 @@
+import pytest
+
+import resources
+
+GiB = 1024 ** 3
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, "CGROUP_ROOT", tmp_path)
+    monkeypatch.delenv("MROCPUS", raising=False)
+    return tmp_path
+
+
+def test_memory_limit_v2_and_v1(cgroup):
+    assert resources.memory_limit() is None
+    (cgroup / "memory.max").write_text("max\n")
+    assert resources.memory_limit() is None
+    (cgroup / "memory.max").write_text(f"{4 * GiB}\n")
+    assert resources.memory_limit() == 4 * GiB
+    (cgroup / "memory.max").unlink()
+    (cgroup / "memory").mkdir()
+    (cgroup / "memory" / "memory.limit_in_bytes").write_text(str(1 << 62))
+    assert resources.memory_limit() is None
+    (cgroup / "memory" / "memory.limit_in_bytes").write_text(str(2 * GiB))
+    assert resources.memory_limit() == 2 * GiB
+
+
+def test_cpu_quota_caps_affinity(cgroup, monkeypatch):
+    monkeypatch.setattr(resources.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    assert resources.effective_cpus() == 8
+    (cgroup / "cpu.max").write_text("250000 100000\n")
+    assert resources.cpu_quota() == 2.5
+    assert resources.effective_cpus() == 2
+    (cgroup / "cpu.max").write_text("50000 100000\n")
+    # a fractional CPU still runs one process
+    assert resources.effective_cpus() == 1
+    monkeypatch.setenv("MROCPUS", "3")
+    assert resources.effective_cpus() == 3
+
+
+def test_cpu_quota_v1(cgroup):
+    (cgroup / "cpu").mkdir()
+    (cgroup / "cpu" / "cpu.cfs_quota_us").write_text("-1")
+    (cgroup / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert resources.cpu_quota() is None
+    (cgroup / "cpu" / "cpu.cfs_quota_us").write_text("400000")
+    assert resources.cpu_quota() == 4
+
+
+def test_available_memory_discounts_page_cache(cgroup, monkeypatch):
+    monkeypatch.setattr(resources, "_meminfo", lambda field: 64 * GiB)
+    (cgroup / "memory.max").write_text(str(8 * GiB))
+    (cgroup / "memory.current").write_text(str(6 * GiB))
+    assert resources.available_memory() == 2 * GiB
+    # inputs just downloaded sit in the page cache, which the kernel reclaims first
+    (cgroup / "memory.stat").write_text(f"anon {2 * GiB}\ninactive_file {3 * GiB}\n")
+    assert resources.available_memory() == 5 * GiB
+    assert resources.total_memory() == 8 * GiB
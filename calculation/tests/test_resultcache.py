@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import resultcache
+
+
+class S3:
+    """Objects in a dict, with conditional PUT and the errors S3 returns."""
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _error(code):
+        return ClientError({"Error": {"Code": code}}, "op")
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        with self.lock:
+            if IfNoneMatch == "*" and (Bucket, Key) in self.objects:
+                raise self._error("PreconditionFailed")
+            self.objects[Bucket, Key] = Body
+
+    def get_object(self, Bucket, Key):
+        import io
+
+        if (Bucket, Key) not in self.objects:
+            raise self._error("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[Bucket, Key])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._error("404")
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture(params=["file", "s3"])
+def index(request, tmp_path):
+    if request.param == "file":
+        return resultcache.FileResultIndex(tmp_path / "index")
+    return resultcache.S3ResultIndex(S3(), "cache", "results/")
+
+
+def test_lock_is_exclusive(index):
+    owner = index.try_lock("k", 60)
+    assert owner is not None
+    assert index.locked("k")
+    assert index.try_lock("k", 60) is None
+    # only the owner releases it
+    index.unlock("k", "someone else")
+    assert index.locked("k")
+    index.unlock("k", owner)
+    assert not index.locked("k")
+    assert index.try_lock("k", 60) is not None
+
+
+def test_expired_lock_is_taken_over(index):
+    stale = index.try_lock("k", -1)
+    assert stale is not None
+    assert not index.locked("k")
+    owner = index.try_lock("k", 60)
+    assert owner not in (None, stale)
+    index.unlock("k", stale)
+    assert index.locked("k")
+
+
+def test_entries(index):
+    assert index.get("k") is None
+    index.put("k", {"bucket": "b", "key": "r.zip"})
+    assert index.get("k") == {"bucket": "b", "key": "r.zip"}
+    index.delete("k")
+    assert index.get("k") is None
+
+
+def test_claim_computes_then_serves(tmp_path):
+    s3 = S3()
+    first = resultcache.ResultCache(resultcache.FileResultIndex(tmp_path), s3, log=lambda m: None)
+    second = resultcache.ResultCache(resultcache.FileResultIndex(tmp_path), s3, log=lambda m: None)
+    assert first.claim("k") is None
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(entry=second.claim("k", poll=0.01)))
+    waiter.start()
+    time.sleep(0.05)
+    assert waiter.is_alive()
+    s3.put_object(Bucket="b", Key="r.zip", Body=b"zip")
+    first.publish("k", "b", "r.zip", size=3)
+    first.release("k")
+    waiter.join(5)
+    assert result["entry"]["key"] == "r.zip"
+    assert not first.index.locked("k")
+
+
+def test_claim_gives_up_without_the_lock(tmp_path):
+    index = resultcache.FileResultIndex(tmp_path)
+    index.try_lock("k", 60)
+    cache = resultcache.ResultCache(index, S3(), log=lambda m: None)
+    assert cache.claim("k", wait_seconds=0.05, poll=0.01) is None
+    assert "k" not in cache._owners
+
+
+def test_lookup_forgets_missing_results(tmp_path):
+    index = resultcache.FileResultIndex(tmp_path)
+    index.put("k", {"bucket": "b", "key": "gone.zip"})
+    cache = resultcache.ResultCache(index, S3(), log=lambda m: None)
+    assert cache.lookup("k") is None
+    assert index.get("k") is None
+
+
+def _task(sensitivity_id=2, signal_id=265, queued=False):
+    return {
+        "name": "ac",
+        "id": 11,
+        "queued": queued,
+        "options": {
+            "reconstructor": {
+                "id": 1,
+                "options": {
+                    "sensitivityMap": {"name": "inner", "id": sensitivity_id, "options": {}},
+                    "signal": {
+                        "type": "file",
+                        "id": signal_id,
+                        "options": {"type": "s3", "bucket": "b", "key": "s.dat", "etag": "e1"},
+                    },
+                },
+            }
+        },
+    }
+
+
+def test_key_ignores_volatile_top_level_fields(monkeypatch):
+    monkeypatch.setattr(resultcache, "engine_version", lambda: "1")
+    first = resultcache.result_key(_task(), {})
+    assert first is not None
+    again = dict(_task(queued=True), id=12, alias="other")
+    assert resultcache.result_key(again, {}) == first
+    # the upload record of an input does not change what it holds
+    assert resultcache.result_key(_task(signal_id=300), {}) == first
+
+
+def test_key_keeps_ids_inside_options(monkeypatch):
+    monkeypatch.setattr(resultcache, "engine_version", lambda: "1")
+    # sensitivityMap.id selects the method, so it is part of the result
+    assert resultcache.result_key(_task(sensitivity_id=3), {}) != resultcache.result_key(_task(), {})
+    other_recon = _task()
+    other_recon["options"]["reconstructor"]["id"] = 4
+    assert resultcache.result_key(other_recon, {}) != resultcache.result_key(_task(), {})
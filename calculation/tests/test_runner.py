@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("pynico_eros_montin")
+
+import runner  # noqa: E402
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def container(monkeypatch):
+    monkeypatch.delenv("MROPARALLEL", raising=False)
+    monkeypatch.delenv("MROPARALLELWORKERMB", raising=False)
+
+    def grant(cpus, memory_mb):
+        monkeypatch.setattr(runner, "effective_cpus", lambda: cpus)
+        monkeypatch.setattr(runner, "available_memory", lambda: None if memory_mb is None else memory_mb * MB)
+
+    return grant
+
+
+def test_parallel_when_a_worker_fits_every_cpu(container):
+    container(4, 16384)
+    plan = runner.plan_parallelism(2048)
+    assert plan["parallel"] and plan["workers"] == 4 and plan["threads"] == 1
+    assert plan["memory_mb"] == 16384
+
+
+def test_memory_bounds_workers(container):
+    container(8, 6000)
+    plan = runner.plan_parallelism(2048)
+    assert not plan["parallel"]
+    assert plan["workers"] == 2
+    # the single mrotools run gets the CPUs as BLAS threads instead
+    assert plan["threads"] == 8
+
+
+def test_one_cpu_and_unknown_memory(container):
+    container(1, None)
+    plan = runner.plan_parallelism()
+    assert not plan["parallel"] and plan["workers"] == 1 and plan["memory_mb"] is None
+
+
+def test_override(container, monkeypatch):
+    container(8, 1024)
+    monkeypatch.setenv("MROPARALLEL", "true")
+    assert runner.plan_parallelism(4096)["parallel"]
+    container(8, 1 << 20)
+    monkeypatch.setenv("MROPARALLEL", "false")
+    plan = runner.plan_parallelism(4096)
+    assert not plan["parallel"] and plan["threads"] == 8
+
+
+def test_thread_env_keeps_explicit_settings(monkeypatch):
+    for var in runner.BLAS_THREAD_VARS:
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv("MKL_NUM_THREADS", "2")
+    env = runner.thread_env(6)
+    assert env["MKL_NUM_THREADS"] == "2"
+    assert env["OMP_NUM_THREADS"] == "6"
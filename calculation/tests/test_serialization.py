@@ -0,0 +1,59 @@
+import json
+import math
+from pathlib import Path
+
+import pytest
+
+import serialization
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialization, "orjson", None)
+    return request.param
+
+
+def test_matches_the_json_module(encoder):
+    data = {"path": Path("/tmp/x"), "tags": ("a",), "raw": b"ok", "n": 1, "none": None}
+    assert json.loads(serialization.dumps(data)) == {
+        "path": "/tmp/x", "tags": ["a"], "raw": "ok", "n": 1, "none": None
+    }
+
+
+def test_non_finite_floats_fall_back(encoder, tmp_path):
+    data = {"snr": [1.5, float("nan"), float("inf")], "missing": None}
+    text = serialization.dumps(data)
+    # written the way the json module writes them, not as null
+    assert "NaN" in text and "Infinity" in text
+    serialization.dump(data, tmp_path / "out.json")
+    back = serialization.load(tmp_path / "out.json")
+    assert math.isnan(back["snr"][1]) and back["snr"][2] == math.inf and back["missing"] is None
+
+
+def test_numpy(encoder):
+    np = pytest.importorskip("numpy")
+    data = {"a": np.arange(3), "x": np.float32(0.5), "bad": np.array([np.nan])}
+    assert json.loads(serialization.dumps(data))["a"] == [0, 1, 2]
+    assert "NaN" in serialization.dumps(data)
+
+
+def test_cap_text():
+    assert serialization.cap_text("short", 10) == "short"
+    capped = serialization.cap_text("a" * 50 + "b" * 50, 20)
+    assert capped.startswith("a" * 10) and capped.endswith("b" * 10)
+    assert "[80 characters omitted]" in capped
+
+
+def test_cap_log(monkeypatch):
+    entries = [{"what": "INFO", "text": f"step {i}"} for i in range(10)] + [{"what": "ERROR", "text": "x" * 100}]
+    capped = serialization.cap_log(entries, max_entries=4, max_chars=30)
+    assert len(capped) == 5
+    assert capped[0]["text"] == "step 0" and capped[2]["type"] == "truncated"
+    assert capped[2]["what"] == "7 log entries omitted"
+    # the end, where the error is, is kept
+    assert capped[-1]["what"] == "ERROR" and len(capped[-1]["text"]) < 100
+    monkeypatch.setenv("MROLOGMAXENTRIES", "0")
+    assert len(serialization.cap_log(entries, max_chars=1000)) == len(entries)
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+import transfer
+
+
+class Response:
+    def __init__(self, status_code, body=b"", headers=None, cut=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        # bytes sent before the connection drops
+        self.cut = cut
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        body = self.body if self.cut is None else self.body[: self.cut]
+        for i in range(0, len(body), 7):
+            yield body[i : i + 7]
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class Session:
+    """Serves `data` with Range support; `failures` are responses returned first, in order."""
+
+    def __init__(self, data, ranges=True, failures=()):
+        self.data = data
+        self.ranges = ranges
+        self.failures = list(failures)
+        self.requests = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        response = self._get(headers)
+        self.responses.append(response)
+        return response
+
+    def _get(self, headers):
+        spec = (headers or {}).get("Range")
+        with self.lock:
+            self.requests.append(spec)
+            failure = self.failures.pop(0) if self.failures and spec != "bytes=0-0" else None
+        if not self.ranges or spec is None:
+            return Response(200, self.data, {"Content-Length": str(len(self.data))})
+        start, end = (int(v) for v in spec[len("bytes="):].split("-"))
+        if start >= len(self.data):
+            return Response(416, b"<Error>InvalidRange</Error>", {"Content-Length": "27"})
+        body = self.data[start : end + 1]
+        if failure == "drop":
+            return Response(206, body, cut=len(body) // 2)
+        if failure is not None:
+            return Response(failure)
+        return Response(206, body, {"Content-Range": f"bytes {start}-{end}/{len(self.data)}"})
+
+
+DATA = bytes(range(256)) * 41
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transfer.time, "sleep", lambda s: None)
+
+
+def test_ranged_download(tmp_path):
+    session = Session(DATA)
+    seen = []
+    n = transfer.RangeDownloader(session, part_size=1000, workers=3, callback=seen.append).download(
+        "u", tmp_path / "f"
+    )
+    assert n == len(DATA) == sum(seen)
+    assert (tmp_path / "f").read_bytes() == DATA
+    assert len(session.requests) == 1 + 11
+
+
+def test_server_without_ranges(tmp_path):
+    n = transfer.RangeDownloader(Session(DATA, ranges=False), part_size=1000).download("u", tmp_path / "f")
+    assert n == len(DATA)
+    assert (tmp_path / "f").read_bytes() == DATA
+
+
+def test_retries_resume_from_last_byte(tmp_path):
+    session = Session(DATA, failures=[503, "drop"])
+    downloader = transfer.RangeDownloader(session, part_size=len(DATA), workers=1)
+    assert downloader.download("u", tmp_path / "f") == len(DATA)
+    assert (tmp_path / "f").read_bytes() == DATA
+    half = len(DATA) // 2
+    assert session.requests[-1] == f"bytes={half}-{len(DATA) - 1}"
+
+
+def test_gives_up_after_retries(tmp_path):
+    session = Session(DATA, failures=[503] * 10)
+    downloader = transfer.RangeDownloader(session, part_size=len(DATA), workers=1, retries=2)
+    with pytest.raises(transfer.TransientHTTPError):
+        downloader.download("u", tmp_path / "f")
+
+
+def test_cancel(tmp_path):
+    cancel = threading.Event()
+    cancel.set()
+    downloader = transfer.RangeDownloader(Session(DATA), part_size=1000, cancel_event=cancel)
+    with pytest.raises(transfer.TransferCancelled):
+        downloader.download("u", tmp_path / "f")
+
+
+def test_empty_object(tmp_path):
+    session = Session(b"")
+    assert transfer.RangeDownloader(session).download("u", tmp_path / "f") == 0
+    assert (tmp_path / "f").read_bytes() == b""
+    assert session.requests == ["bytes=0-0", None]
+    assert all(r.closed for r in session.responses)
+    assert transfer.probe_url("u", Session(b""))[0] == 0
+    assert transfer.probe_url("u", Session(b"", ranges=False))[0] == 0
+
+
+def test_probe_closed_on_error(tmp_path):
+    session = Session(DATA)
+    session.get = lambda *a, **k: session.responses.append(Response(403)) or session.responses[-1]
+    with pytest.raises(Exception, match="403"):
+        transfer.RangeDownloader(session).download("u", tmp_path / "f")
+    assert session.responses[0].closed
+
+
+def test_reused_after_a_failed_download(tmp_path):
+    session = Session(DATA, failures=[503] * 3)
+    downloader = transfer.RangeDownloader(session, part_size=1000, workers=2, retries=0)
+    with pytest.raises(transfer.TransientHTTPError):
+        downloader.download("u", tmp_path / "f")
+    assert downloader.cancel_event is None
+    assert downloader.download("u", tmp_path / "f") == len(DATA)
+    assert (tmp_path / "f").read_bytes() == DATA
@@ -0,0 +1,85 @@
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+twixtools = pytest.importorskip("twixtools")
+import twixfile  # noqa: E402
+
+
+def _header(n_slices):
+    """Measurement header with the slice array in ASCCONV and NSlc in XProtocol."""
+    asc = ["### ASCCONV BEGIN ###", f"sSliceArray.lSize\t = {n_slices}"]
+    for i in range(n_slices):
+        asc += [
+            f"sSliceArray.asSlice[{i}].sPosition.dTra\t = {-10 + 5 * i}",
+            f"sSliceArray.asSlice[{i}].sNormal.dTra\t = 1",
+        ]
+    asc += [f"sSliceArray.anPos[{i}]\t = {i}" for i in range(1, n_slices)]
+    asc += ["sKSpace.lBaseResolution\t = 8", "### ASCCONV END ###", ""]
+    yaps = "\n".join(asc).encode()
+    meas = f'<XProtocol> {{ <ParamLong."NSlc">  {{ {n_slices} }} }}\n'.encode()
+    buffers = [(b"Meas", meas), (b"MeasYaps", yaps), (b"Phoenix", yaps)]
+    body = b"".join(name + b"\0" + struct.pack("<I", len(data)) + data for name, data in buffers)
+    padding = b"\0" * (-(8 + len(body)) % 32)
+    return struct.pack("<II", 8 + len(body) + len(padding), len(buffers)) + body + padding
+
+
+def _write(path, n_slices, lines=3):
+    """VE file with a one-line noise scan and an imaging scan whose data are (slice, line)."""
+    from twixtools import hdr_def
+    from twixtools.mdb import Mdb_local
+
+    scans = []
+    for n, n_lines in ((1, 1), (n_slices, lines)):
+        mdbs = []
+        for s in range(n):
+            for line in range(n_lines):
+                mdb = Mdb_local(np.full((2, 8), complex(s, line), np.complex64))
+                mdb.mdh.Counter.Sli = s
+                mdb.mdh.Counter.Lin = line
+                mdbs.append(mdb)
+        raid = np.zeros(1, hdr_def.MrParcRaidFileEntry)[0]
+        raid["measId_"] = len(scans) + 1
+        scans.append({"hdr_str": np.frombuffer(_header(n), dtype="<S1"), "mdb": mdbs, "raidfile_hdr": raid})
+    twixtools.write_twix(scans, str(path))
+    return path
+
+
+def _read(path):
+    return twixtools.read_twix(str(path), parse_pmu=False, parse_geometry=False, verbose=False)
+
+
+def test_split_slices(tmp_path):
+    source = _write(tmp_path / "sig.dat", 5)
+    groups = [[0, 1, 2], [3, 4]]
+    parts = twixfile.split_slices(source, groups, tmp_path)
+    assert [p.name for p in parts] == ["sig-slices0.dat", "sig-slices1.dat"]
+    # an estimate for the disk budget: cut-down headers only make the parts smaller, up to alignment
+    written = sum(p.stat().st_size for p in parts)
+    assert written <= twixfile.split_size(source, groups) + len(groups) * twixfile.SCAN_ALIGN
+    for path, group in zip(parts, groups):
+        twix = _read(path)
+        assert len(twix) == 2
+        assert len(twix[0]["mdb"]) == 1
+        meas = twix[-1]
+        assert int(meas["hdr"]["MeasYaps"]["sSliceArray"]["lSize"]) == len(group)
+        assert [s["sPosition"]["dTra"] for s in meas["hdr"]["MeasYaps"]["sSliceArray"]["asSlice"]] == [
+            -10 + 5 * s for s in group
+        ]
+        assert twixfile.read_dims(path)["slices"] == len(group)
+        mdbs = [m for m in meas["mdb"] if m.is_image_scan()]
+        assert [m.mdh.ScanCounter for m in meas["mdb"]] == list(range(1, len(meas["mdb"]) + 1))
+        assert [(m.mdh.Counter.Sli, m.mdh.Counter.Lin) for m in mdbs] == [
+            (n, line) for n in range(len(group)) for line in range(3)
+        ]
+        for m in mdbs:
+            # the data still say which slice of the source they came from
+            assert m.data[0, 0] == complex(group[m.mdh.Counter.Sli], m.mdh.Counter.Lin)
+
+
+def test_slice_positions(tmp_path):
+    source = _write(tmp_path / "sig.dat", 3)
+    assert twixfile.slice_positions(source) == [
+        {"position": [0.0, 0.0, -10.0 + 5 * i], "normal": [0.0, 0.0, 1.0]} for i in range(3)
+    ]
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import time
+
+import workspace
+
+
+def _stale(base, name, owner=None, age=0):
+    path = base / f"{workspace.PREFIX}{name}"
+    path.mkdir()
+    if owner is not None:
+        (path / workspace.OWNER_FILE).write_text(str(owner))
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+
+def test_sweep(tmp_path):
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    young = _stale(tmp_path, "young")
+    old = _stale(tmp_path, "old", age=workspace.OWNERLESS_GRACE + 60)
+    orphan = _stale(tmp_path, "orphan", owner=int(dead.stdout))
+    alive = _stale(tmp_path, "alive", owner=os.getppid())
+    assert workspace.sweep_stale(tmp_path, log=lambda m: None) == 2
+    assert young.exists() and alive.exists()
+    assert not old.exists() and not orphan.exists()
+
+
+def test_workspace_is_not_swept_while_in_use(tmp_path):
+    with workspace.JobWorkspace(tmp_path, monitor_interval=0, log=lambda m: None) as ws:
+        assert (ws.root / workspace.OWNER_FILE).read_text() == str(os.getpid())
+        assert [p.name for p in ws.root.iterdir()] == [workspace.OWNER_FILE]
+        workspace.sweep_stale(tmp_path, log=lambda m: None)
+        assert ws.root.exists()
+        # the same process's own leftovers are stale once no JobWorkspace holds them
+        leftover = _stale(tmp_path, "leftover", owner=os.getpid())
+        workspace.sweep_stale(tmp_path, log=lambda m: None)
+        assert not leftover.exists()
+    assert not ws.root.exists()